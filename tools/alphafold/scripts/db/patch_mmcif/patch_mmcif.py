@@ -1,10 +1,31 @@
 import argparse
+import os
+import random
 import shutil
+import sys
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 
 import requests
+from requests.adapters import HTTPAdapter
 
 RCSB_BASE_URL = 'https://files.rcsb.org/download/'
+DEFAULT_WORKERS = 8
+DEFAULT_TIMEOUT = 30  # seconds, for each connect and read
+DEFAULT_RETRIES = 5
+DEFAULT_BACKOFF = 1.0  # seconds, doubled on each retry
+MAX_BACKOFF = 60.0
+DEFAULT_RATE_LIMIT = 10.0  # requests per second, across all workers
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+PROGRESS_INTERVAL = 10.0  # seconds between progress updates
+CHUNK_SIZE = 64 * 1024
+PARTIAL_SUFFIX = '.part'
+# ETag or Last-Modified of a partial file, to validate a resumed download
+VALIDATOR_SUFFIX = '.validator'
+MMCIF_HEADER = b'data_'
 LOG_DIR = Path('logs')
 LOCAL_MMCIF_DIR = Path('mmcif_files')
 MMCIF_LOG_DIR = LOG_DIR / "mmcif_patches"
@@ -13,6 +34,7 @@ DB_PATH_PDB70_CLU = "pdb70/pdb70_clu.tsv"
 LOG_FILE_REQUIRED = "required_ids.log"
 LOG_FILE_EXISTING = "existing_ids.log"
 LOG_FILE_MISSING = "missing_ids.log"
+LOG_FILE_FAILED = "failed_ids.log"
 
 
 def parse_args():
@@ -30,6 +52,11 @@ def parse_args():
             "  python patch_mmcif.py /my/alphafold/db/ --write-db --log\n\n"
             "  # Patch a single missing file\n"
             "  python patch_mmcif.py /my/alphafold/db/ -i 4ri6 --write-db\n\n"
+            "  # Download compressed .cif.gz files (~5x less data)\n"
+            "  python patch_mmcif.py /my/alphafold/db/ --write-db --gzip\n\n"
+            "  # Download from a mirror with 16 workers at up to 20 req/s\n"
+            "  python patch_mmcif.py /my/alphafold/db/ --write-db --workers 16"
+            " --rate-limit 20 --base-url https://mirror.example.org/pdb/\n\n"
         ),
         formatter_class=argparse.RawDescriptionHelpFormatter,
     )
@@ -54,14 +81,40 @@ def parse_args():
             f"Write patched PDB files/IDs to ./{LOG_DIR}/."
             " This is useful for keeping track of which files were patched."
             f" The following files will be written: [{LOG_FILE_REQUIRED},"
-            f" {LOG_FILE_EXISTING}, {LOG_FILE_MISSING}]. Patched MMCIF files"
+            f" {LOG_FILE_EXISTING}, {LOG_FILE_MISSING}, {LOG_FILE_FAILED}]."
+            " Patched MMCIF files"
             f" will be copied to ./{MMCIF_LOG_DIR}/."
         ),
     )
+    parser.add_argument(
+        "--base-url", type=str, default=RCSB_BASE_URL,
+        help=("URL from which <ID>.cif files are downloaded."
+              f" Default: {RCSB_BASE_URL}"))
+    parser.add_argument(
+        "--gzip", action="store_true",
+        help=("Download compressed <ID>.cif.gz files and decompress them"
+              " while streaming, which transfers ~5x less data."))
+    parser.add_argument(
+        "--workers", type=int, default=DEFAULT_WORKERS,
+        help=f"Number of concurrent downloads. Default: {DEFAULT_WORKERS}")
+    parser.add_argument(
+        "--timeout", type=float, default=DEFAULT_TIMEOUT,
+        help=("Timeout (seconds) for connecting to the server and for each"
+              f" read. Default: {DEFAULT_TIMEOUT}"))
+    parser.add_argument(
+        "--retries", type=int, default=DEFAULT_RETRIES,
+        help=("Number of retries for a failed download, with exponential"
+              f" backoff. Default: {DEFAULT_RETRIES}"))
+    parser.add_argument(
+        "--rate-limit", type=float, default=DEFAULT_RATE_LIMIT,
+        help=("Maximum requests per second across all workers (0 for no"
+              f" limit). Default: {DEFAULT_RATE_LIMIT}"))
     args = parser.parse_args()
 
     if args.id and len(args.id) != 4:
         parser.error("MMCIF_ID must be exactly 4 characters long.")
+    if args.workers < 1:
+        parser.error("--workers must be at least 1.")
     if not args.db_path.is_dir():
         parser.error(f"Error: DB_PATH '{args.db_path}' does not exist.")
     pdb_mmcif_path = args.db_path / "pdb_mmcif"
@@ -77,13 +130,268 @@ def print_cli(*args, **kwargs):
         print(*args, **kwargs)
 
 
+class RateLimiter:
+    """Space out requests from all threads to a maximum rate."""
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate if rate else 0
+        self.next_time = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+class Downloader:
+    """Fetch files with a shared keep-alive session, retries and a rate limit.
+
+    Connection errors, timeouts and retryable HTTP status codes are retried
+    with exponential backoff and full jitter. Other responses (e.g. 404) are
+    returned to the caller.
+    """
+
+    def __init__(
+        self,
+        base_url: str = RCSB_BASE_URL,
+        workers: int = DEFAULT_WORKERS,
+        timeout: float = DEFAULT_TIMEOUT,
+        retries: int = DEFAULT_RETRIES,
+        backoff: float = DEFAULT_BACKOFF,
+        rate_limit: float = DEFAULT_RATE_LIMIT,
+    ):
+        self.base_url = base_url.rstrip('/') + '/'
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.rate_limiter = RateLimiter(rate_limit)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def backoff_delay(self, attempt: int, response=None) -> float:
+        delay = random.uniform(
+            0, min(MAX_BACKOFF, self.backoff * 2 ** attempt))
+        retry_after = (
+            response.headers.get('Retry-After', '')
+            if response is not None
+            else '')
+        if retry_after and retry_after.isdigit():
+            delay = max(delay, min(MAX_BACKOFF, float(retry_after)))
+        return delay
+
+    def get(
+        self,
+        filename: str,
+        retry: bool = True,
+        **kwargs,
+    ) -> requests.Response:
+        """Request a file, retrying failures unless ``retry`` is False.
+
+        Without retries, a single request is made and its response returned
+        whatever the status, and connection errors and timeouts are raised,
+        so that the caller can retry them itself.
+        """
+        url = self.base_url + filename
+        if not retry:
+            self.rate_limiter.wait()
+            return self.session.get(url, timeout=self.timeout, **kwargs)
+        for attempt in range(self.retries + 1):
+            self.rate_limiter.wait()
+            response = None
+            try:
+                response = self.session.get(
+                    url, timeout=self.timeout, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as exc:
+                error = exc
+            else:
+                if response.status_code not in RETRY_STATUS_CODES:
+                    return response
+                error = f"HTTP {response.status_code}"
+                response.close()
+            if attempt < self.retries:
+                time.sleep(self.backoff_delay(attempt, response))
+        raise IOError(
+            f"Error: Could not download {url} after {self.retries + 1}"
+            f" attempts ({error})")
+
+    def download(
+        self,
+        filename: str,
+        path: Path,
+        decompress: bool = False,
+    ) -> int:
+        """Stream a file to path, resuming with HTTP Range requests.
+
+        Resumed requests send the ETag or Last-Modified date of the first
+        response as If-Range, so a file that has changed on the server is
+        downloaded again in full. The validator is stored next to path (see
+        validator_path), and an existing file at path is resumed as a
+        partial download from a previous run only if it has one; otherwise
+        it is discarded. With decompress, a gzip file is decompressed as it
+        streams; an interrupted transfer can then only be resumed within
+        this call, since the decompressor state is lost. Failed requests and
+        interrupted transfers are retried here, up to ``retries`` times in
+        total. Returns the number of bytes transferred.
+        """
+        decompressor = None
+        validator = None
+        if not decompress and path.exists():
+            validator = read_validator(path)
+        offset = path.stat().st_size if validator else 0
+        transferred = 0
+        with open(path, 'wb' if decompress else 'ab') as f:
+            def restart():
+                nonlocal decompressor, offset
+                f.seek(0)
+                f.truncate()
+                offset = 0
+                if decompress:
+                    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+            if decompress or not validator:
+                restart()
+            error = None
+            response = None
+            for attempt in range(self.retries + 1):
+                if attempt:
+                    time.sleep(self.backoff_delay(attempt - 1, response))
+                # Range offsets must count bytes of the file itself
+                headers = {'Accept-Encoding': 'identity'}
+                if offset:
+                    headers['Range'] = f'bytes={offset}-'
+                    if validator:
+                        headers['If-Range'] = validator
+                try:
+                    response = self.get(
+                        filename, retry=False, headers=headers, stream=True)
+                except (requests.ConnectionError, requests.Timeout) as exc:
+                    error = exc
+                    response = None
+                    continue
+                with response:
+                    if response.status_code in RETRY_STATUS_CODES:
+                        error = f"HTTP {response.status_code}"
+                        continue
+                    if response.status_code == 416 and offset:
+                        # Stale partial file
+                        restart()
+                        continue
+                    if response.status_code not in (200, 206):
+                        raise IOError(
+                            f"Error: Could not download file {filename}"
+                            f" (HTTP {response.status_code})")
+                    if response.status_code == 200:
+                        if offset:
+                            # The file changed, or Range is not supported
+                            restart()
+                        validator = self.response_validator(response)
+                        if not decompress:
+                            write_validator(path, validator)
+                    expected = self.expected_size(response, offset)
+                    try:
+                        for chunk in response.iter_content(CHUNK_SIZE):
+                            offset += len(chunk)
+                            transferred += len(chunk)
+                            f.write(
+                                decompressor.decompress(chunk)
+                                if decompressor
+                                else chunk)
+                    except requests.RequestException as exc:
+                        error = exc
+                    else:
+                        if expected is None or offset >= expected:
+                            if decompressor:
+                                f.write(decompressor.flush())
+                                if not decompressor.eof:
+                                    raise IOError(
+                                        f"Error: {filename} is truncated")
+                            f.flush()
+                            os.fsync(f.fileno())
+                            validator_path(path).unlink(missing_ok=True)
+                            return transferred
+                        error = f"received {offset} of {expected} bytes"
+        raise IOError(
+            f"Error: Could not download file {filename} after"
+            f" {self.retries + 1} attempts ({error})")
+
+    @staticmethod
+    def response_validator(response: requests.Response):
+        """Return a validator to send as If-Range, if the server gave one.
+
+        Weak ETags cannot be used with If-Range.
+        """
+        etag = response.headers.get('ETag')
+        if etag and not etag.startswith('W/'):
+            return etag
+        return response.headers.get('Last-Modified')
+
+    @staticmethod
+    def expected_size(response: requests.Response, offset: int):
+        """Return the full size of the file being downloaded, if known."""
+        if response.status_code == 206:
+            total = response.headers.get('Content-Range', '').rsplit('/', 1)
+            if len(total) == 2 and total[1].isdigit():
+                return int(total[1])
+            return None
+        length = response.headers.get('Content-Length')
+        return int(length) if length and length.isdigit() else None
+
+
+def validator_path(path: Path) -> Path:
+    return path.with_name(path.name + VALIDATOR_SUFFIX)
+
+
+def read_validator(path: Path):
+    """Return the stored validator of a partial download, or None."""
+    try:
+        return validator_path(path).read_text().strip() or None
+    except OSError:
+        return None
+
+
+def write_validator(path: Path, validator: str = None):
+    if validator:
+        validator_path(path).write_text(validator + '\n')
+    else:
+        validator_path(path).unlink(missing_ok=True)
+
+
+def check_mmcif_file(path: Path):
+    """Check that a downloaded file is a non-empty mmCIF file."""
+    with open(path, 'rb') as f:
+        head = f.read(1024).lstrip()
+    if not head.startswith(MMCIF_HEADER):
+        raise IOError(
+            f"Error: {path.name} is not a valid mmCIF file"
+            f" (empty or missing '{MMCIF_HEADER.decode()}' header)")
+
+
 def patch_mmcif_file(
     pdb_id: str,
     db_path: Path,
     log: bool = False,
     write_db: bool = False,
-):
-    """Patch a single .cif file in the AlphaFold database."""
+    downloader: Downloader = None,
+    gzip: bool = False,
+) -> int:
+    """Patch a single .cif file in the AlphaFold database.
+
+    The file is streamed to a partial file next to the destination, checked
+    and then renamed into place, so that an interrupted download never
+    leaves a truncated .cif file in the database. A partial file left by an
+    earlier run is resumed if the server confirms that the file has not
+    changed since (see Downloader.download). Returns the number of bytes
+    transferred.
+    """
+    downloader = downloader or Downloader(workers=1)
     if log:
         LOG_DIR.mkdir(exist_ok=True)
     if not write_db:
@@ -95,27 +403,115 @@ def patch_mmcif_file(
         db_mmcif_files_dir / f"{id_lower}.cif"
         if write_db
         else LOCAL_MMCIF_DIR / f"{id_lower}.cif")
-    url = f"{RCSB_BASE_URL}{id_upper}.cif"
-    print_cli(f"Downloading file: {url}...")
-    response = requests.get(url)
-    if response.status_code == 200:
-        destination_path.write_bytes(response.content)
-    else:
-        raise IOError(f"Error: Could not download file {id_upper}.cif")
+    partial_path = destination_path.with_name(
+        destination_path.name + PARTIAL_SUFFIX)
+    try:
+        transferred = downloader.download(
+            f"{id_upper}.cif.gz" if gzip else f"{id_upper}.cif",
+            partial_path,
+            decompress=gzip,
+        )
+        check_mmcif_file(partial_path)
+    except Exception:
+        # Keep a partial mmCIF file for the next run to resume
+        try:
+            check_mmcif_file(partial_path)
+        except IOError:
+            partial_path.unlink(missing_ok=True)
+            validator_path(partial_path).unlink(missing_ok=True)
+        raise
+    os.replace(partial_path, destination_path)
     if log:
         MMCIF_LOG_DIR.mkdir(exist_ok=True)
         log_cif_file = MMCIF_LOG_DIR / f"{id_lower}.cif"
         shutil.copyfile(destination_path, log_cif_file)
-    print_cli(f"Written {destination_path}")
+    return transferred
+
+
+def patch_mmcif_files(
+    pdb_ids: list,
+    db_path: Path,
+    log: bool = False,
+    write_db: bool = False,
+    downloader: Downloader = None,
+    workers: int = DEFAULT_WORKERS,
+    gzip: bool = False,
+) -> dict:
+    """Patch .cif files concurrently with a bounded pool of workers.
+
+    A failed download does not stop the others. Progress is reported every
+    PROGRESS_INTERVAL seconds, and a summary of the run is returned.
+    """
+    downloader = downloader or Downloader(workers=workers)
+    if log:
+        LOG_DIR.mkdir(exist_ok=True)
+    if not write_db:
+        LOCAL_MMCIF_DIR.mkdir(exist_ok=True)
+    summary = {
+        'total': len(pdb_ids),
+        'patched': 0,
+        'failed': {},
+        'bytes': 0,
+    }
+    start = last_report = time.monotonic()
+
+    def report(final=False):
+        elapsed = max(time.monotonic() - start, 1e-9)
+        done = summary['patched'] + len(summary['failed'])
+        print_cli(
+            f"{'Finished' if final else 'Progress'}:"
+            f" {done}/{summary['total']} files"
+            f" ({summary['patched']} patched, {len(summary['failed'])} failed)"
+            f" in {elapsed:.1f} s"
+            f" - {done / elapsed:.1f} files/s,"
+            f" {summary['bytes'] / elapsed / 1024 ** 2:.2f} MB/s")
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(
+                patch_mmcif_file,
+                pdb_id,
+                db_path,
+                log=log,
+                write_db=write_db,
+                downloader=downloader,
+                gzip=gzip,
+            ): pdb_id
+            for pdb_id in pdb_ids
+        }
+        for future in as_completed(futures):
+            pdb_id = futures[future]
+            try:
+                summary['bytes'] += future.result()
+                summary['patched'] += 1
+            except Exception as exc:
+                summary['failed'][pdb_id] = str(exc)
+                print_cli(f"Failed to patch {pdb_id}: {exc}")
+            if time.monotonic() - last_report > PROGRESS_INTERVAL:
+                last_report = time.monotonic()
+                report()
+    summary['elapsed'] = time.monotonic() - start
+    report(final=True)
+    return summary
 
 
 def patch_all(
     db_path: Path,
     log: bool = False,
     prompt: bool = False,
-    write_db: bool = False
+    write_db: bool = False,
+    base_url: str = RCSB_BASE_URL,
+    workers: int = DEFAULT_WORKERS,
+    timeout: float = DEFAULT_TIMEOUT,
+    retries: int = DEFAULT_RETRIES,
+    rate_limit: float = DEFAULT_RATE_LIMIT,
+    gzip: bool = False,
 ):
-    """Calculate and patch all missing MMCIF files in the databases."""
+    """Calculate and patch all missing MMCIF files in the databases.
+
+    Returns a summary of the downloads (see patch_mmcif_files), or None if
+    nothing was patched.
+    """
     def write_ids_to_file(ids, filename):
         if log:
             print_cli(f"Writing logs/{filename}...")
@@ -160,10 +556,32 @@ def patch_all(
             print_cli("Aborted.")
             return
 
-    print_cli("Patching missing MMCIF files...")
-    for mmcif_id in missing_mmcif_ids:
-        patch_mmcif_file(mmcif_id, db_path, log=log, write_db=write_db)
+    print_cli(
+        f"Patching missing MMCIF files from {base_url}"
+        f" with {workers} workers...")
+    downloader = Downloader(
+        base_url=base_url,
+        workers=workers,
+        timeout=timeout,
+        retries=retries,
+        rate_limit=rate_limit,
+    )
+    summary = patch_mmcif_files(
+        sorted(missing_mmcif_ids),
+        db_path,
+        log=log,
+        write_db=write_db,
+        downloader=downloader,
+        workers=workers,
+        gzip=gzip,
+    )
+    write_ids_to_file(sorted(summary['failed']), LOG_FILE_FAILED)
+    if summary['failed']:
+        print_cli(
+            f"Failed to patch {len(summary['failed'])} files:"
+            f" {', '.join(sorted(summary['failed']))}")
     print_cli("Done.")
+    return summary
 
 
 def main():
@@ -183,12 +601,20 @@ def main():
     if args.id is None:
         print_cli("Attempting to patch all missing MMCIF files in"
                   f" {args.db_path}...")
-        patch_all(
+        summary = patch_all(
             args.db_path,
             log=args.log,
             write_db=args.write_db,
             prompt=True,
+            base_url=args.base_url,
+            workers=args.workers,
+            timeout=args.timeout,
+            retries=args.retries,
+            rate_limit=args.rate_limit,
+            gzip=args.gzip,
         )
+        if summary and summary['failed']:
+            sys.exit(1)
     else:
         print_cli(f"Attempting to patch MMCIF file {args.id}...")
         patch_mmcif_file(
@@ -196,7 +622,15 @@ def main():
             args.db_path,
             log=args.log,
             write_db=args.write_db,
+            downloader=Downloader(
+                base_url=args.base_url,
+                workers=1,
+                timeout=args.timeout,
+                retries=args.retries,
+            ),
+            gzip=args.gzip,
         )
+        print_cli(f"Written {args.id.lower()}.cif")
 
 
 if __name__ == '__main__':
@@ -1,6 +1,10 @@
+import gzip
 import shutil
+import threading
 import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from pathlib import Path
+from unittest import mock
 try:
     import patch_mmcif
 except ImportError:
@@ -19,28 +23,259 @@ EXPECT_PATCHED = [
 ]
 
 
+def mock_cif(pdb_id):
+    lines = [f'data_{pdb_id.upper()}', '#'] + [
+        f'ATOM {i} C CA . GLY A 1 {i} ? 1.000 2.000 3.000'
+        for i in range(2000)
+    ]
+    return ('\n'.join(lines) + '\n').encode()
+
+
+def etag_for(pdb_id, changed=False):
+    return f'"{pdb_id}-{2 if changed else 1}"'
+
+
+class MockRCSBHandler(BaseHTTPRequestHandler):
+    """Serve <ID>.cif and <ID>.cif.gz files, supporting Range requests.
+
+    The first request for each ID in ``flaky_ids`` fails with a 503, and the
+    first response for each ID in ``truncate_ids`` is cut short, to exercise
+    retries and resumed downloads. Files in ``changed_ids`` have a new ETag,
+    so If-Range requests for them are answered in full. Requests for IDs in
+    ``unreliable_ids`` alternate between a 503 and a truncated response.
+    Range requests that are served are recorded in ``ranges``.
+    """
+
+    flaky_ids = set()
+    unreliable_ids = set()
+    missing_ids = set()
+    truncate_ids = set()
+    invalid_ids = set()
+    changed_ids = set()
+    requests = []
+    ranges = []
+
+    def do_GET(self):
+        filename = self.path.rsplit('/', 1)[-1]
+        pdb_id = filename.split('.')[0].lower()
+        self.requests.append(filename)
+        if pdb_id in self.missing_ids:
+            self.send_error(404)
+            return
+        if pdb_id in self.flaky_ids:
+            self.flaky_ids.discard(pdb_id)
+            self.send_error(503)
+            return
+        if pdb_id in self.unreliable_ids and pdb_id not in self.truncate_ids:
+            self.truncate_ids.add(pdb_id)
+            self.send_error(503)
+            return
+        body = (
+            b'<html>Not an mmCIF file</html>'
+            if pdb_id in self.invalid_ids
+            else mock_cif(pdb_id))
+        if filename.endswith('.gz'):
+            body = gzip.compress(body)
+        size = len(body)
+        start = 0
+        etag = etag_for(pdb_id, changed=pdb_id in self.changed_ids)
+        if self.headers.get('Range') and (
+            self.headers.get('If-Range') in (None, etag)
+        ):
+            self.ranges.append(self.headers['Range'])
+            start = int(self.headers['Range'].split('=')[1].split('-')[0])
+            if start >= size:
+                self.send_error(416)
+                return
+            self.send_response(206)
+            self.send_header(
+                'Content-Range', f'bytes {start}-{size - 1}/{size}')
+        else:
+            self.send_response(200)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(size - start))
+        self.end_headers()
+        if pdb_id in self.truncate_ids:
+            self.truncate_ids.discard(pdb_id)
+            self.wfile.write(body[start:start + (size - start) // 2])
+            return
+        self.wfile.write(body[start:])
+
+    def log_message(self, *args):
+        pass
+
+
 class TestPatchAll(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), MockRCSBHandler)
+        cls.base_url = f'http://127.0.0.1:{cls.server.server_port}/download/'
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        # *.cif files are git-ignored, so the existing file may be missing
+        MOCK_MMCIF_DIR.mkdir(parents=True, exist_ok=True)
+        if not EXISTING_CIF_FILE.exists():
+            EXISTING_CIF_FILE.write_text('TEST_FILE\n')
+        MockRCSBHandler.flaky_ids = set()
+        MockRCSBHandler.unreliable_ids = set()
+        MockRCSBHandler.missing_ids = set()
+        MockRCSBHandler.truncate_ids = set()
+        MockRCSBHandler.invalid_ids = set()
+        MockRCSBHandler.changed_ids = set()
+        MockRCSBHandler.requests = []
+        MockRCSBHandler.ranges = []
+        self.downloader = patch_mmcif.Downloader(
+            base_url=self.base_url, backoff=0.01, rate_limit=0)
+
     def tearDown(self):
         for pdb_id in EXPECT_PATCHED:
-            path = MOCK_MMCIF_DIR / f'{pdb_id}.cif'
-            if path.exists():
-                path.unlink()
+            for path in (
+                MOCK_MMCIF_DIR / f'{pdb_id}.cif',
+                MOCK_MMCIF_DIR / f'{pdb_id}.cif.part',
+                MOCK_MMCIF_DIR / f'{pdb_id}.cif.part.validator',
+            ):
+                if path.exists():
+                    path.unlink()
         if MMCIF_TEMP_DIR.exists():
             shutil.rmtree(MMCIF_TEMP_DIR)
         return super().tearDown()
 
+    def patch_all(self, **kwargs):
+        return patch_mmcif.patch_all(
+            MOCK_DB_PATH,
+            write_db=True,
+            base_url=self.base_url,
+            rate_limit=0,
+            **kwargs,
+        )
+
     def test_patch_one(self):
         patch_mmcif.patch_mmcif_file(
-            EXPECT_PATCHED[0], MOCK_DB_PATH, write_db=True)
+            EXPECT_PATCHED[0], MOCK_DB_PATH, write_db=True,
+            downloader=self.downloader)
         path = MOCK_MMCIF_DIR / f'{EXPECT_PATCHED[0]}.cif'
         self.assertTrue(path.exists())
 
     def test_patch_all(self):
-        patch_mmcif.patch_all(MOCK_DB_PATH, write_db=True)
+        summary = self.patch_all()
         for pdb_id in EXPECT_PATCHED:
             path = MOCK_MMCIF_DIR / f'{pdb_id}.cif'
             self.assertTrue(path.exists())
+        self.assertEqual(summary['patched'], len(EXPECT_PATCHED))
+        self.assertEqual(summary['failed'], {})
         # Make sure existing file still present and unchanged
         self.assertTrue(EXISTING_CIF_FILE.exists())
         with open(EXISTING_CIF_FILE) as f:
             self.assertEqual(f.read().strip(' \n'), 'TEST_FILE')
+
+    def test_patch_all_retries(self):
+        MockRCSBHandler.flaky_ids = {'4ri6', '4gle'}
+        self.patch_all(workers=2)
+        for pdb_id in EXPECT_PATCHED:
+            path = MOCK_MMCIF_DIR / f'{pdb_id}.cif'
+            self.assertTrue(path.exists())
+        self.assertEqual(MockRCSBHandler.requests.count('4RI6.cif'), 2)
+
+    def test_download_retries_in_one_place(self):
+        # Each failed request and each interrupted transfer uses a retry
+        MockRCSBHandler.unreliable_ids = {'4ri6'}
+        downloader = patch_mmcif.Downloader(
+            base_url=self.base_url, retries=2, backoff=0.01, rate_limit=0)
+        with self.assertRaises(IOError):
+            downloader.download(
+                '4RI6.cif', MOCK_MMCIF_DIR / '4ri6.cif.part')
+        self.assertEqual(MockRCSBHandler.requests.count('4RI6.cif'), 3)
+
+    def test_patch_all_reports_failures(self):
+        MockRCSBHandler.missing_ids = {'4ri7'}
+        summary = self.patch_all()
+        self.assertEqual(list(summary['failed']), ['4ri7'])
+        self.assertEqual(summary['patched'], len(EXPECT_PATCHED) - 1)
+        self.assertFalse((MOCK_MMCIF_DIR / '4ri7.cif').exists())
+
+    def test_rate_limit(self):
+        limiter = patch_mmcif.RateLimiter(rate=50)
+        start = patch_mmcif.time.monotonic()
+        for _ in range(6):
+            limiter.wait()
+        # Five intervals of 20 ms between six requests
+        self.assertGreaterEqual(patch_mmcif.time.monotonic() - start, 0.09)
+
+    def assert_patched(self, pdb_id):
+        path = MOCK_MMCIF_DIR / f'{pdb_id}.cif'
+        self.assertEqual(path.read_bytes(), mock_cif(pdb_id))
+        self.assertFalse((MOCK_MMCIF_DIR / f'{pdb_id}.cif.part').exists())
+        self.assertFalse(
+            (MOCK_MMCIF_DIR / f'{pdb_id}.cif.part.validator').exists())
+
+    def patch_one(self, **kwargs):
+        return patch_mmcif.patch_mmcif_file(
+            EXPECT_PATCHED[0], MOCK_DB_PATH, write_db=True,
+            downloader=self.downloader, **kwargs)
+
+    def test_patch_all_gzip(self):
+        self.patch_all(gzip=True)
+        for pdb_id in EXPECT_PATCHED:
+            self.assert_patched(pdb_id)
+        self.assertTrue(all(
+            filename.endswith('.cif.gz')
+            for filename in MockRCSBHandler.requests))
+
+    @mock.patch.object(patch_mmcif, 'CHUNK_SIZE', 1024)
+    def test_resume_interrupted_download(self):
+        for use_gzip in (False, True):
+            with self.subTest(gzip=use_gzip):
+                MockRCSBHandler.truncate_ids = {EXPECT_PATCHED[0]}
+                MockRCSBHandler.ranges = []
+                self.patch_one(gzip=use_gzip)
+                self.assert_patched(EXPECT_PATCHED[0])
+                self.assertEqual(len(MockRCSBHandler.ranges), 1)
+
+    def write_partial(self, pdb_id, content, validator=None):
+        partial_path = MOCK_MMCIF_DIR / f'{pdb_id}.cif.part'
+        partial_path.write_bytes(content)
+        if validator:
+            patch_mmcif.write_validator(partial_path, validator)
+
+    def test_resume_partial_file(self):
+        pdb_id = EXPECT_PATCHED[0]
+        self.write_partial(pdb_id, mock_cif(pdb_id)[:100], etag_for(pdb_id))
+        self.patch_one()
+        self.assert_patched(pdb_id)
+        self.assertEqual(MockRCSBHandler.ranges, ['bytes=100-'])
+
+    def test_restart_partial_file_without_validator(self):
+        pdb_id = EXPECT_PATCHED[0]
+        self.write_partial(pdb_id, b'data_STALE\n')
+        self.patch_one()
+        self.assert_patched(pdb_id)
+        self.assertEqual(MockRCSBHandler.ranges, [])
+
+    def test_restart_changed_partial_file(self):
+        pdb_id = EXPECT_PATCHED[0]
+        self.write_partial(pdb_id, b'data_STALE\n', etag_for(pdb_id))
+        MockRCSBHandler.changed_ids = {pdb_id}
+        self.patch_one()
+        self.assert_patched(pdb_id)
+        self.assertEqual(MockRCSBHandler.ranges, [])
+
+    def test_restart_stale_partial_file(self):
+        pdb_id = EXPECT_PATCHED[0]
+        self.write_partial(
+            pdb_id, mock_cif(pdb_id) + b'stale', etag_for(pdb_id))
+        self.patch_one()
+        self.assert_patched(pdb_id)
+
+    def test_invalid_file(self):
+        pdb_id = EXPECT_PATCHED[0]
+        MockRCSBHandler.invalid_ids = {pdb_id}
+        with self.assertRaises(IOError):
+            self.patch_one()
+        self.assertFalse((MOCK_MMCIF_DIR / f'{pdb_id}.cif').exists())
+        self.assertFalse((MOCK_MMCIF_DIR / f'{pdb_id}.cif.part').exists())
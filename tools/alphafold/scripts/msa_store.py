@@ -0,0 +1,386 @@
+"""Content-addressed store of AlphaFold MSAs for reuse.
+
+MSAs are keyed on the SHA-256 of each canonicalised input sequence, so a
+sequence that has been searched before (alone or as a chain of a different
+multimer) can skip the jackhmmer/hhblits searches. Entries are grouped by a
+namespace (e.g. AlphaFold version, databases and model preset), since MSAs
+built against different databases are not interchangeable:
+
+    <store>/<namespace>/msas/<key[:2]>/<key>/
+        entry.json      # metadata; mtime records last use for eviction
+        *.sto, *.a3m, *.hhr
+    <store>/tmp/        # staging area for new entries
+    <store>/.lock       # shared by readers and writers, exclusive to evict
+
+New entries are staged in tmp/ and renamed into place, so a concurrent job
+never sees a partially written entry. If two jobs store the same key, the
+first rename wins and the other copy is discarded.
+
+validate_fasta.py --msa-store writes a reuse manifest, which is used to seed
+the AlphaFold output directory before the run (with --use_precomputed_msas)
+and to store new MSAs afterwards. Seeding records the source of each chain's
+MSAs in the manifest, and only MSAs built by AlphaFold's own search are
+stored, so MSAs uploaded by a user never enter the shared store:
+
+  python msa_store.py seed msa_reuse.json output/alphafold
+  python msa_store.py put msa_reuse.json output/alphafold --max-size-gb 500
+  python msa_store.py evict /path/to/store --max-size-gb 500
+"""
+
+import argparse
+import fcntl
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, List, Optional
+
+# Chain IDs assigned by AlphaFold-Multimer (alphafold.common.protein)
+PDB_CHAIN_IDS = (
+    'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789')
+MSA_SUFFIXES = ('.sto', '.a3m', '.hhr')
+ENTRY_FILE = 'entry.json'
+LOCK_FILE = '.lock'
+TMP_DIR = 'tmp'
+MANIFEST_VERSION = 1
+# Sources of a chain's MSAs, recorded in the manifest by seed()
+SOURCE_STORE = 'store'
+SOURCE_UPLOADED = 'uploaded'
+SOURCE_SEARCH = 'search'
+WHITESPACE_TABLE = str.maketrans('', '', ' \t\r\n')
+
+
+def canonicalise(sequence: str) -> str:
+    """Return the canonical form of a sequence used for hashing."""
+    return sequence.translate(WHITESPACE_TABLE).upper()
+
+
+def sequence_key(sequence: str) -> str:
+    return hashlib.sha256(canonicalise(sequence).encode()).hexdigest()
+
+
+class MsaStore:
+    """A directory of reusable MSAs (see module docstring)."""
+
+    def __init__(self, root: Path, namespace: str = 'default'):
+        self.root = Path(root)
+        self.namespace = re.sub(r'[^\w.-]', '_', namespace)
+
+    def entry_path(self, kind: str, key: str) -> Path:
+        return self.root / self.namespace / kind / key[:2] / key
+
+    def lookup(self, kind: str, key: str) -> Optional[Path]:
+        """Return the path of a complete entry, or None."""
+        path = self.entry_path(kind, key)
+        if (path / ENTRY_FILE).is_file():
+            return path
+        return None
+
+    @staticmethod
+    def touch(path: Path):
+        """Record use of an entry for LRU eviction."""
+        try:
+            os.utime(path / ENTRY_FILE)
+        except OSError:
+            pass
+
+    @contextmanager
+    def lock(self, exclusive: bool = False):
+        self.root.mkdir(parents=True, exist_ok=True)
+        with open(self.root / LOCK_FILE, 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def put(
+        self,
+        kind: str,
+        key: str,
+        files: List[Path],
+        metadata: dict = None,
+    ) -> bool:
+        """Store files under the given key.
+
+        Returns False if the key was already stored (by this or a concurrent
+        job). Should be called while holding the shared lock.
+        """
+        path = self.entry_path(kind, key)
+        if self.lookup(kind, key):
+            self.touch(path)
+            return False
+        tmp_root = self.root / TMP_DIR
+        tmp_root.mkdir(parents=True, exist_ok=True)
+        staging = Path(tempfile.mkdtemp(prefix=f'{key[:12]}-', dir=tmp_root))
+        try:
+            size = 0
+            for src in files:
+                shutil.copyfile(src, staging / src.name)
+                size += (staging / src.name).stat().st_size
+            with open(staging / ENTRY_FILE, 'w') as f:
+                json.dump({
+                    **(metadata or {}),
+                    'kind': kind,
+                    'key': key,
+                    'namespace': self.namespace,
+                    'files': [src.name for src in files],
+                    'size_bytes': size,
+                    'created': time.time(),
+                }, f, indent=2)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            try:
+                os.rename(staging, path)
+            except OSError:
+                # Another job stored this key first
+                return False
+            return True
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+
+    def entries(self) -> Iterator[dict]:
+        """Yield every entry in the store (all namespaces)."""
+        for entry_file in self.root.glob(f'*/*/*/*/{ENTRY_FILE}'):
+            namespace_dir = entry_file.parents[3]
+            if namespace_dir.name == TMP_DIR:
+                continue
+            try:
+                with open(entry_file) as f:
+                    size = json.load(f).get('size_bytes', 0)
+                last_used = entry_file.stat().st_mtime
+            except (OSError, ValueError):
+                continue
+            yield {
+                'path': entry_file.parent,
+                'size_bytes': size,
+                'last_used': last_used,
+            }
+
+    def evict(
+        self,
+        max_bytes: int = None,
+        max_entries: int = None,
+    ) -> List[Path]:
+        """Remove least recently used entries until within the limits.
+
+        Also removes staging directories left by jobs that were killed part
+        way through a put, since nothing can be staging while the exclusive
+        lock is held.
+        """
+        removed = []
+        with self.lock(exclusive=True):
+            shutil.rmtree(self.root / TMP_DIR, ignore_errors=True)
+            entries = sorted(self.entries(), key=lambda e: e['last_used'])
+            total_bytes = sum(e['size_bytes'] for e in entries)
+            count = len(entries)
+            for entry in entries:
+                if not (
+                    (max_bytes and total_bytes > max_bytes)
+                    or (max_entries and count > max_entries)
+                ):
+                    break
+                shutil.rmtree(entry['path'], ignore_errors=True)
+                total_bytes -= entry['size_bytes']
+                count -= 1
+                removed.append(entry['path'])
+        return removed
+
+
+def build_manifest(
+    store: MsaStore,
+    sequences: List[str],
+    multimer: bool,
+) -> dict:
+    """Look up each sequence in the store and describe how to reuse it.
+
+    AlphaFold-Multimer only builds MSAs for the first chain with each unique
+    sequence, so repeated chains are marked as duplicates and skipped.
+    """
+    chains = []
+    seen = set()
+    for i, sequence in enumerate(sequences):
+        key = sequence_key(sequence)
+        chain_id = PDB_CHAIN_IDS[i] if multimer else None
+        cached = store.lookup('msas', key)
+        chains.append({
+            'chain_id': chain_id,
+            'key': key,
+            'length': len(canonicalise(sequence)),
+            'target': f'msas/{chain_id}' if multimer else 'msas',
+            'duplicate': key in seen,
+            'cached': str(cached) if cached else None,
+            'source': None,
+        })
+        seen.add(key)
+
+    return {
+        'version': MANIFEST_VERSION,
+        'store': str(store.root),
+        'namespace': store.namespace,
+        'chains': chains,
+        'use_precomputed_msas': any(
+            c['cached'] and not c['duplicate'] for c in chains),
+    }
+
+
+def load_manifest(path: Path) -> dict:
+    with open(path) as f:
+        manifest = json.load(f)
+    if manifest.get('version') != MANIFEST_VERSION:
+        raise ValueError(
+            f"Unsupported reuse manifest version: {manifest.get('version')}")
+    return manifest
+
+
+def write_manifest(path: Path, manifest: dict):
+    tmp_path = Path(f'{path}.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def is_populated(path: Path) -> bool:
+    return path.is_dir() and any(path.iterdir())
+
+
+def seed(manifest: dict, workdir: Path) -> List[str]:
+    """Copy cached MSAs into an AlphaFold output directory.
+
+    MSAs that are already present (e.g. uploaded by the user) are left as
+    they are. The source of each chain's MSAs is recorded in the manifest
+    (see put). Returns the targets that were seeded.
+    """
+    store = MsaStore(manifest['store'], manifest['namespace'])
+    seeded = []
+    with store.lock():
+        for chain in manifest['chains']:
+            if chain['duplicate']:
+                continue
+            cached = store.lookup('msas', chain['key'])
+            target = workdir / chain['target']
+            if is_populated(target):
+                chain['source'] = SOURCE_UPLOADED
+                continue
+            if not cached:
+                chain['source'] = SOURCE_SEARCH
+                continue
+            target.mkdir(parents=True, exist_ok=True)
+            for src in cached.iterdir():
+                if src.name != ENTRY_FILE:
+                    # Copy then rename so AlphaFold never reads a partial MSA
+                    tmp = target / f'.{src.name}.tmp'
+                    shutil.copyfile(src, tmp)
+                    os.rename(tmp, target / src.name)
+            store.touch(cached)
+            chain['source'] = SOURCE_STORE
+            seeded.append(chain['target'])
+    return seeded
+
+
+def put(manifest: dict, workdir: Path) -> List[str]:
+    """Store MSAs from a completed AlphaFold run.
+
+    Only chains that seed() recorded as searched by AlphaFold are stored, so
+    MSAs seeded from the store or uploaded by the user are never stored.
+    Returns the targets that were added to the store.
+    """
+    store = MsaStore(manifest['store'], manifest['namespace'])
+    stored = []
+    with store.lock():
+        for chain in manifest['chains']:
+            if chain['duplicate'] or chain.get('source') != SOURCE_SEARCH:
+                continue
+            source = workdir / chain['target']
+            files = sorted(
+                path for path in source.glob('*')
+                if path.is_file() and path.suffix in MSA_SUFFIXES
+            ) if source.is_dir() else []
+            if files and store.put('msas', chain['key'], files, {
+                'length': chain['length'],
+            }):
+                stored.append(chain['target'])
+    return stored
+
+
+def gb_to_bytes(size_gb: float) -> Optional[int]:
+    return int(size_gb * 1024 ** 3) if size_gb else None
+
+
+def main():
+    args = parse_args()
+    if args.command == 'evict':
+        store = MsaStore(args.store)
+    else:
+        manifest = load_manifest(args.manifest)
+        store = MsaStore(manifest['store'], manifest['namespace'])
+
+    if args.command == 'seed':
+        seeded = seed(manifest, args.workdir)
+        write_manifest(args.manifest, manifest)
+        print(
+            f"Seeded {', '.join(seeded)} from MSA store"
+            if seeded else "No cached MSAs found in MSA store")
+        return
+
+    if args.command == 'put':
+        stored = put(manifest, args.workdir)
+        print(
+            f"Stored {', '.join(stored)} in MSA store"
+            if stored else "No new MSAs to store")
+
+    if args.max_size_gb or args.max_entries:
+        removed = store.evict(gb_to_bytes(args.max_size_gb), args.max_entries)
+        if removed:
+            print(f"Evicted {len(removed)} entries from MSA store")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    for command, help_text in (
+        ('seed', "Copy cached MSAs into an AlphaFold output directory"),
+        ('put', "Store MSAs from a completed AlphaFold output directory"),
+    ):
+        subparser = subparsers.add_parser(command, help=help_text)
+        subparser.add_argument(
+            "manifest",
+            help="Reuse manifest written by validate_fasta.py --msa-store",
+            type=Path,
+        )
+        subparser.add_argument(
+            "workdir",
+            help="AlphaFold output directory",
+            type=Path,
+        )
+    evict_parser = subparsers.add_parser(
+        'evict', help="Remove least recently used entries")
+    evict_parser.add_argument("store", help="MSA store directory", type=Path)
+
+    for subparser in (subparsers.choices['put'], evict_parser):
+        subparser.add_argument(
+            "--max-size-gb",
+            dest='max_size_gb',
+            help="Evict least recently used entries above this total size",
+            default=None,
+            type=float,
+        )
+        subparser.add_argument(
+            "--max-entries",
+            dest='max_entries',
+            help="Evict least recently used entries above this count",
+            default=None,
+            type=int,
+        )
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    main()
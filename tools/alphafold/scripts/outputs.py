@@ -14,37 +14,196 @@ This code is more complex than you might expect due to the output files
 several output paths are determined dynamically.
 """
 
+from __future__ import annotations
+
 import argparse
+import contextlib
+import copy
+import errno
+import glob
+import hashlib
 import json
+import multiprocessing
 import os
 import pickle as pk
 import shutil
+import struct
+import sys
+import tarfile
+import tempfile
+import time
+import traceback
 import zipfile
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
-from typing import Dict, List
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, List, Set
 
-from matplotlib import pyplot as plt
+if TYPE_CHECKING:
+    import numpy as np
 
-import numpy as np
+# numpy and matplotlib are imported by the stages that need them, so that
+# runs which only collect MSAs (--msa_only) do not pay their import cost.
 
 OUTPUT_DIR = 'extra'
 OUTPUTS = {
     'model_pkl': OUTPUT_DIR + '/ranked_{rank}.pkl',
+    'model_pkl_manifest': OUTPUT_DIR + '/ranked_pkls.json',
+    'model_slim': OUTPUT_DIR + '/ranked_{rank}.npz',
+    'model_slim_meta': OUTPUT_DIR + '/ranked_{rank}.json',
     'model_pae': OUTPUT_DIR + '/pae_ranked_{rank}.csv',
+    'model_pae_npy': OUTPUT_DIR + '/pae_ranked_{rank}.npy',
+    'model_pae_npz': OUTPUT_DIR + '/pae_ranked_{rank}.npz',
+    'model_pae_float16': OUTPUT_DIR + '/pae_ranked_{rank}.f16.npy',
+    'model_pae_uint8': OUTPUT_DIR + '/pae_ranked_{rank}.u8.npz',
     'model_plot': OUTPUT_DIR + '/ranked_{rank}.png',
     'model_confidence_scores': OUTPUT_DIR + '/model_confidence_scores.tsv',
     'plddts': OUTPUT_DIR + '/plddts.tsv',
+    'interface_scores': OUTPUT_DIR + '/interface_scores.tsv',
     'relax': OUTPUT_DIR + '/relax_metrics_ranked.json',
     'msa': OUTPUT_DIR + '/msa_coverage.png',
+    'msa_stats': OUTPUT_DIR + '/msa_depth.tsv',
+    'html_bundle': OUTPUT_DIR + '/html/ranked_{rank}.bin',
+    'html_tile': (
+        OUTPUT_DIR + '/html/ranked_{rank}_tiles/{level}/{row}_{col}.bin'),
+    'metrics': OUTPUT_DIR + '/outputs_metrics.json',
+    'state': OUTPUT_DIR + '/outputs_state.json',
+    'manifest': OUTPUT_DIR + '/manifest.json',
+}
+
+# PAE export formats mapped to their OUTPUTS keys
+PAE_FORMATS = {
+    'csv': 'model_pae',
+    'npy': 'model_pae_npy',
+    'npz': 'model_pae_npz',
+    'float16': 'model_pae_float16',
+    'uint8': 'model_pae_uint8',
 }
+DEFAULT_PAE_FORMATS = ['csv']
+# Decimal places for PAE CSV values (None: shortest repr of each value)
+DEFAULT_PAE_PRECISION = None
+# Number of matrix cells formatted per write when exporting PAE to CSV
+PAE_CSV_BLOCK_CELLS = 2 ** 20
+# Largest lookup table of formatted values used when exporting PAE to CSV
+PAE_CSV_MAX_TABLE_SIZE = 10 ** 7
+
+# Chain-pair interface scores (multimer). Residues are in contact if their
+# CB atoms (CA for glycine) are within this distance (Angstroms).
+INTERFACE_CONTACT_DISTANCE = 8.0
+# Number of PAE matrix cells processed at once when computing scores
+INTERFACE_BLOCK_CELLS = 2 ** 20
+INTERFACE_ATOM_KEYS = [
+    'structure_module.final_atom_positions',
+    'structure_module.final_atom_mask',
+]
+# Indices of CA and CB atoms in AlphaFold's atom37 representation
+ATOM37_CA = 1
+ATOM37_CB = 3
+
+# Strategies for writing ranked_*.pkl outputs, in order of preference
+LINK_STRATEGIES = ['hardlink', 'reflink', 'copy_file_range', 'copy']
+# ioctl request code for FICLONE (clone a file on btrfs, XFS, etc.)
+FICLONE = 0x40049409
+
+# Prefix of the scratch directory holding memory-mapped .npy sidecars of
+# model arrays (see model_array_dir). It is deleted after each run.
+MODEL_ARRAYS_PREFIX = 'alphafold-outputs-arrays-'
+
+# Confidence items retained by --pkl-slim, mapped to the maximum absolute
+# error allowed if the array is stored as float16 (None: never quantise).
+SLIM_MODEL_KEYS = {
+    'plddt': 0.05,
+    'predicted_aligned_error': 0.01,
+    'max_predicted_aligned_error': None,
+    'ptm': None,
+    'iptm': None,
+    'ranking_confidence': None,
+}
+
+# MSA coverage plot settings
+MSA_GAP = 21
+MSA_PLOT_FIGSIZE = (6, 4)
+# Number of MSA rows processed at once when computing coverage
+MSA_CHUNK_ROWS = 4096
+
+# MSA depth statistics. Sequences are weighted by the inverse of the number
+# of sequences (including themselves) with at least this identity.
+NEFF_IDENTITY = 0.8
+# MSA symbols are packed into this many bit planes for comparison
+NEFF_SYMBOL_BITS = 5
+# Number of 64-bit words compared at once when computing Neff, small enough
+# for the working arrays to stay in CPU cache
+NEFF_BLOCK_WORDS = 2 ** 16
+# Neff is O(N^2) in MSA depth, so deeper MSAs are subsampled to this many
+# sequences (see write_msa_stats)
+NEFF_MAX_SEQUENCES = 5000
+
+# MSA archive formats. Zstandard requires Python >= 3.14 (zip and tar) or
+# the zstandard package (tar only).
+MSA_ARCHIVE_FORMATS = ['stored', 'deflate', 'zstd', 'tar.zst']
+DEFAULT_MSA_ARCHIVE_FORMAT = 'stored'
+# Block size used to stream MSA files into tar archives
+MSA_ARCHIVE_BLOCK_SIZE = 2 ** 20
+
+# Matplotlib is used headless, with its config/font cache on a local path
+MPL_BACKEND = 'Agg'
+MPL_CONFIG_DIR = Path(tempfile.gettempdir()) / 'alphafold-outputs-matplotlib'
+
+# Run manifests written by a different version are rebuilt (see RunManifest)
+MANIFEST_VERSION = 1
+
+# Stage input fingerprints (see StageState). Files larger than twice the
+# sample size are hashed from their first and last sample only.
+STATE_VERSION = 1
+STATE_HASH_SAMPLE_SIZE = 2 ** 20
+
+# Batch mode (multiple workdirs): worker processes are replaced after this
+# many stages, so that memory is returned between runs (Python >= 3.11).
+BATCH_MAX_TASKS_PER_CHILD = 100
+DEFAULT_BATCH_SUMMARY = 'outputs_batch_summary.tsv'
 
 HTML_PATH = Path(__file__).parent / "alphafold.html"
 HTML_OUTPUT_FILENAME = 'alphafold.html'
+# Binary data bundles for the HTML viewer (see write_html_bundle)
+HTML_BUNDLE_MAGIC = b'AFB1'
+HTML_BUNDLE_VERSION = 1
+HTML_TILE_SIZE = 256
 HTML_BUTTON_ATTR = 'class="btn" id="btn-ranked_{rank}"'
 HTML_BUTTON_ATTR_DISABLED = (
     'class="btn disabled" id="btn-ranked_{rank}" disabled')
 
 
+# Globals that may be resolved from AlphaFold pickles. Anything else found in
+# the pickle stream is refused by ResultUnpickler.
+PICKLE_NUMPY_MODULES = (
+    'numpy',
+    'numpy.core.multiarray',
+    'numpy._core.multiarray',
+    'numpy.core.numeric',
+    'numpy._core.numeric',
+)
+PICKLE_NUMPY_NAMES = {
+    '_reconstruct',
+    '_frombuffer',
+    'dtype',
+    'ndarray',
+    'scalar',
+}
+PICKLE_JAX_ARRAYS = {
+    ('jax._src.device_array', 'reconstruct_device_array'),
+    ('jax._src.array', '_reconstruct_array'),
+}
+PICKLE_HAIKU_MAPPINGS = {
+    ('haiku._src.data_structures', 'FlatMapping'),
+    ('haiku._src.data_structures', 'FlatMap'),
+}
+
+
 class PLDDT_KEY:
     """Dict keys for accessing confidence data from JSON/pkl files."
     Changes depending on which model PRESET was used.
@@ -59,6 +218,115 @@ class PRESETS:
     multimer = 'multimer'
 
 
+class RunManifest:
+    """Index of the files and model ranking of an AlphaFold run.
+
+    Built once per invocation from a single scan of the workdir and a single
+    read of ranking_debug.json, and cached to extra/manifest.json. The cache
+    is reused (e.g. by later --msa_only calls) until files are added to or
+    removed from the workdir, or ranking_debug.json changes.
+    """
+
+    def __init__(self, workdir: Path, data: Dict[str, Any]):
+        self.workdir = workdir
+        self.data = data
+
+    @classmethod
+    def load(cls, workdir: Path) -> RunManifest:
+        """Return the cached manifest for workdir, or build and cache it."""
+        path = workdir / OUTPUTS['manifest']
+        stat = cls._stat(workdir)
+        try:
+            with open(path) as f:
+                data = json.load(f)
+            if (
+                data.get('version') == MANIFEST_VERSION
+                and data.get('stat') == stat
+            ):
+                return cls(workdir, data)
+        except (OSError, ValueError):
+            pass
+        data = cls.build(workdir)
+        data['stat'] = stat
+        tmp_path = path.with_name(path.name + '.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp_path, path)
+        return cls(workdir, data)
+
+    @staticmethod
+    def _stat(workdir: Path) -> Dict[str, Any]:
+        """Return mtimes that change if the manifest may be out of date."""
+        stat = {'workdir_mtime_ns': os.stat(workdir).st_mtime_ns}
+        try:
+            ranking_stat = os.stat(workdir / 'ranking_debug.json')
+            stat['ranking_mtime_ns'] = ranking_stat.st_mtime_ns
+            stat['ranking_size'] = ranking_stat.st_size
+        except FileNotFoundError:
+            pass
+        return stat
+
+    @staticmethod
+    def build(workdir: Path) -> Dict[str, Any]:
+        """Scan workdir and index the model ranking."""
+        with os.scandir(workdir) as entries:
+            filenames = sorted(entry.name for entry in entries)
+        model_pkls = [
+            f for f in filenames
+            if f.startswith('result_model_') and f.endswith('.pkl')
+        ]
+
+        model_preset = PRESETS.monomer
+        for f in filenames:
+            if f.endswith('.pkl') and 'feature' not in f:
+                if '_multimer_' in f:
+                    model_preset = PRESETS.multimer
+                elif '_ptm_' in f:
+                    model_preset = PRESETS.monomer_ptm
+                break
+        plddt_key = (
+            PLDDT_KEY.multimer
+            if model_preset == PRESETS.multimer
+            else PLDDT_KEY.monomer)
+
+        order = []
+        model_keys = {}
+        if 'ranking_debug.json' in filenames:
+            with open(workdir / 'ranking_debug.json') as f:
+                ranking = json.load(f)
+            order = ranking['order']
+            # Model keys have changed format between AlphaFold versions
+            for key in ranking.get(plddt_key, {}):
+                ix = key.split('_')[1]
+                model_keys.setdefault(ix, key)
+        return {
+            'version': MANIFEST_VERSION,
+            'model_preset': model_preset,
+            'model_pkls': model_pkls,
+            'order': order,
+            'ranks': {name: rank for rank, name in enumerate(order)},
+            'model_keys': model_keys,
+        }
+
+    @property
+    def model_preset(self) -> str:
+        return self.data['model_preset']
+
+    @property
+    def model_pkl_paths(self) -> List[Path]:
+        return [self.workdir / f for f in self.data['model_pkls']]
+
+    @property
+    def ranks(self) -> Dict[str, int]:
+        """Return 0-indexed rank for each model name."""
+        return self.data['ranks']
+
+    @property
+    def model_keys(self) -> Dict[str, str]:
+        """Return ranking_debug.json key for each model index."""
+        return self.data['model_keys']
+
+
 class Settings:
     """Parse and store settings/config."""
     def __init__(self):
@@ -71,8 +339,27 @@ class Settings:
         parser = argparse.ArgumentParser()
         parser.add_argument(
             "workdir",
-            help="alphafold output directory",
+            help=(
+                "alphafold output directory. Multiple directories or glob"
+                " patterns can be given to process runs in batch mode."),
             type=str,
+            nargs='*',
+        )
+        parser.add_argument(
+            "--manifest",
+            help=(
+                "Text file listing alphafold output directories to process"
+                " in batch mode, one per line"),
+            type=Path,
+            default=None,
+        )
+        parser.add_argument(
+            "--summary",
+            help=(
+                "Path of the per-directory success/failure summary written"
+                f" in batch mode. Default: {DEFAULT_BATCH_SUMMARY}"),
+            type=Path,
+            default=Path(DEFAULT_BATCH_SUMMARY),
         )
         parser.add_argument(
             "-s",
@@ -85,61 +372,214 @@ class Settings:
             help="rename model pkl outputs with rank order",
             action="store_true",
         )
+        parser.add_argument(
+            "--pkl-slim",
+            help=(
+                "write a compressed .npz of confidence arrays (pLDDT, PAE,"
+                " pTM/ipTM) for each ranked model, without logits"),
+            action="store_true",
+        )
+        parser.add_argument(
+            "--pkl-link",
+            help=(
+                "How to write ranked model pkl outputs. 'auto' tries each"
+                f" of {', '.join(LINK_STRATEGIES)} until one is supported by"
+                " the filesystem. Falls back to copy if the selected"
+                " strategy is not supported. Default: auto"),
+            choices=['auto'] + LINK_STRATEGIES,
+            default='auto',
+        )
         parser.add_argument(
             "--pae",
             help="extract PAE from pkl files to CSV format",
             action="store_true",
         )
+        parser.add_argument(
+            "--interface-scores",
+            help=(
+                "summarise PAE, pLDDT and contacts for each pair of chains"
+                " (multimer only)"),
+            action="store_true",
+        )
+        parser.add_argument(
+            "--pae-format",
+            help=(
+                "PAE export format(s) for --pae. 'npz' is compressed,"
+                " 'float16' and 'uint8' are quantised binary matrices."
+                f" Default: {' '.join(DEFAULT_PAE_FORMATS)}"),
+            nargs='+',
+            choices=list(PAE_FORMATS),
+            default=DEFAULT_PAE_FORMATS,
+        )
+        parser.add_argument(
+            "--pae-precision",
+            help=(
+                "Round PAE values written to CSV to this many decimal places."
+                " Default: full precision"),
+            type=int,
+            default=DEFAULT_PAE_PRECISION,
+        )
         parser.add_argument(
             "--plot",
             help="Plot pLDDT and PAE for each model",
             action="store_true",
         )
+        parser.add_argument(
+            "--html-bundle",
+            help=(
+                "write compact pLDDT/PAE data bundles for each model, to be"
+                " displayed by the HTML output"),
+            action="store_true",
+        )
         parser.add_argument(
             "--plot-msa",
             help="Plot multiple-sequence alignment coverage as a heatmap",
             action="store_true",
         )
+        parser.add_argument(
+            "--msa-stats",
+            help=(
+                "Write per-position MSA depth and an estimate of Neff (at"
+                f" {NEFF_IDENTITY:.0%}% identity) to TSV. Neff compares every"
+                " pair of sequences, so MSAs deeper than"
+                " --msa-stats-max-sequences are subsampled and the"
+                " neff_estimate column is scaled up to the full depth."
+                " Depth is always exact"),
+            action="store_true",
+        )
+        parser.add_argument(
+            "--msa-stats-max-sequences",
+            help=(
+                "Estimate Neff from an evenly spaced subsample of at most"
+                " this many MSA sequences, since the cost grows with the"
+                " square of MSA depth. 0 for no limit."
+                f" Default: {NEFF_MAX_SEQUENCES}"),
+            type=int,
+            default=NEFF_MAX_SEQUENCES,
+        )
         parser.add_argument(
             "--msa",
             help="Collect multiple-sequence alignments as ZIP archives",
             action="store_true",
         )
+        parser.add_argument(
+            "--workers",
+            help=(
+                "Number of parallel workers used to generate outputs."
+                " Defaults to $GALAXY_SLOTS, or 1 if not set."),
+            type=int,
+            default=int(os.environ.get('GALAXY_SLOTS', 1)),
+        )
+        parser.add_argument(
+            "--msa-compression",
+            help=(
+                "Compression for MSA archives: stored/deflate/zstd ZIP"
+                " archives, or a zstd-compressed tarball (tar.zst)."
+                f" Default: {DEFAULT_MSA_ARCHIVE_FORMAT}"),
+            choices=MSA_ARCHIVE_FORMATS,
+            default=DEFAULT_MSA_ARCHIVE_FORMAT,
+        )
+        parser.add_argument(
+            "--msa-compression-level",
+            help="Compression level for MSA archives (format-specific)",
+            type=int,
+            default=None,
+        )
         parser.add_argument(
             "--msa_only",
             help="Alphafold generated MSA files only - skip all other outputs",
             action="store_true",
         )
+        parser.add_argument(
+            "--force",
+            help=(
+                "Regenerate all outputs, including those whose inputs and"
+                " options are unchanged since a previous run"),
+            action="store_true",
+        )
         args = parser.parse_args()
-        self.workdir = Path(args.workdir.rstrip('/'))
+        self.workdirs = self._expand_workdirs(args.workdir, args.manifest)
+        if not self.workdirs:
+            parser.error("no alphafold output directories given")
+        self.batch = (
+            args.manifest is not None
+            or len(args.workdir) > 1
+            or any(glob.has_magic(arg) for arg in args.workdir))
+        self.summary_path = args.summary
         self.output_residue_scores = args.confidence_scores
         self.output_model_pkls = args.pkl
+        self.output_slim_pkls = args.pkl_slim
+        self.pkl_link_strategies = (
+            LINK_STRATEGIES
+            if args.pkl_link == 'auto'
+            else [args.pkl_link, 'copy'])
         self.output_model_plots = args.plot
         self.output_pae = args.pae
+        self.output_interface_scores = args.interface_scores
+        self.output_html_bundle = args.html_bundle
+        self.pae_formats = args.pae_format
+        self.pae_precision = args.pae_precision
         self.plot_msa = args.plot_msa
+        self.msa_stats = args.msa_stats
+        self.msa_stats_max_sequences = args.msa_stats_max_sequences
         self.collect_msas = args.msa
-        self.model_preset = self._sniff_model_preset()
-        self.is_multimer = self.model_preset == PRESETS.multimer
-        self.output_dir = self.workdir / OUTPUT_DIR
+        self.msa_archive_format = args.msa_compression
+        self.msa_compression_level = args.msa_compression_level
         self.msa_only = args.msa_only
+        self.force = args.force
+        self.workers = max(1, args.workers)
+        if not self.batch:
+            self.set_workdir(self.workdirs[0])
+
+    @staticmethod
+    def _expand_workdirs(args: List[str], manifest: Path = None) -> List[Path]:
+        """Return workdirs from positional args (or globs) and a manifest."""
+        paths = list(args)
+        if manifest:
+            with open(manifest) as f:
+                paths += [
+                    line.strip() for line in f
+                    if line.strip() and not line.startswith('#')
+                ]
+        workdirs = []
+        for path in paths:
+            if glob.has_magic(path):
+                matches = sorted(
+                    p for p in glob.glob(path) if os.path.isdir(p))
+                if not matches:
+                    print(f"No directories match '{path}'")
+                workdirs += [Path(p) for p in matches]
+            else:
+                workdirs.append(Path(path.rstrip('/')))
+        return workdirs
+
+    def set_workdir(self, workdir: Path) -> None:
+        """Set the alphafold output directory and dependent settings."""
+        if not workdir.is_dir():
+            raise FileNotFoundError(
+                errno.ENOENT, "AlphaFold output directory not found",
+                str(workdir))
+        self.workdir = workdir
+        self.output_dir = self.workdir / OUTPUT_DIR
+        # The cleaned input FASTA is written two levels above the workdir
+        self.input_fasta = self.workdir.parent.parent / 'alphafold.fasta'
         os.makedirs(self.output_dir, exist_ok=True)
+        self.manifest = RunManifest.load(self.workdir)
+        self.model_preset = self.manifest.model_preset
+        self.is_multimer = self.model_preset == PRESETS.multimer
 
-    def _sniff_model_preset(self) -> bool:
-        """Check if the run was multimer or monomer."""
-        for path in self.workdir.glob('*.pkl'):
-            if 'feature' not in path.name:
-                if '_multimer_' in path.name:
-                    return PRESETS.multimer
-                if '_ptm_' in path.name:
-                    return PRESETS.monomer_ptm
-                return PRESETS.monomer
-        return PRESETS.monomer
+    def for_workdir(self, workdir: Path) -> Settings:
+        """Return a copy of these settings for the given workdir."""
+        settings = copy.copy(self)
+        settings.set_workdir(workdir)
+        return settings
 
 
 class ExecutionContext:
     """Collect file paths etc."""
     def __init__(self, settings: Settings):
         self.settings = settings
+        self.manifest = settings.manifest
         if settings.is_multimer:
             self.plddt_key = PLDDT_KEY.multimer
         else:
@@ -151,15 +591,12 @@ class ExecutionContext:
         The key format changed between minor AlphaFold versions so this
         function determines the correct key.
         """
-        with open(self.ranking_debug) as f:
-            data = json.load(f)
-        model_keys = list(data[self.plddt_key].keys())
-        for k in model_keys:
-            if k.startswith(f"model_{ix}_"):
-                return k
-        return KeyError(
-            f'Could not find key for index={ix} in'
-            ' ranking_debug.json')
+        try:
+            return self.manifest.model_keys[str(ix)]
+        except KeyError:
+            raise KeyError(
+                f'Could not find key for index={ix} in'
+                ' ranking_debug.json')
 
     @property
     def ranking_debug(self) -> str:
@@ -174,28 +611,201 @@ class ExecutionContext:
         return self.settings.workdir / 'relax_metrics_ranked.json'
 
     @property
-    def model_pkl_paths(self) -> List[str]:
-        return sorted([
-            self.settings.workdir / f
-            for f in os.listdir(self.settings.workdir)
-            if f.startswith('result_model_') and f.endswith('.pkl')
-        ])
+    def model_pkl_paths(self) -> List[Path]:
+        return self.manifest.model_pkl_paths
+
+
+def import_pyplot():
+    """Import pyplot with a non-interactive backend.
+
+    The backend and config directory are set before matplotlib is first
+    imported, so that no GUI toolkit is probed and the font cache is built
+    on a writable local path rather than in $HOME. Either can be overridden
+    with the MPLBACKEND and MPLCONFIGDIR environment variables.
+    """
+    os.environ.setdefault('MPLBACKEND', MPL_BACKEND)
+    if 'MPLCONFIGDIR' not in os.environ:
+        MPL_CONFIG_DIR.mkdir(parents=True, exist_ok=True)
+        os.environ['MPLCONFIGDIR'] = str(MPL_CONFIG_DIR)
+    from matplotlib import pyplot as plt
+    return plt
+
+
+def _reconstruct_jax_array(fun, args, arr_state, aval_state=None):
+    """Rebuild a pickled jax array as a plain numpy array.
+
+    Mirrors jax's own reconstructor, minus the ``device_put`` call.
+    """
+    arr = fun(*args)
+    arr.__setstate__(arr_state)
+    return arr
+
+
+def _reconstruct_haiku_mapping(*args):
+    """Rebuild a pickled haiku FlatMapping as a plain dict."""
+    if not args:
+        return {}
+    return dict(args[0])
+
+
+class ResultUnpickler(pk.Unpickler):
+    """Unpickle AlphaFold outputs without importing jax or haiku.
+
+    Jax device arrays and haiku mappings are rebuilt as numpy arrays and
+    dicts. Only numpy reconstructors are otherwise allowed, so arbitrary
+    objects in the pickle stream cannot be instantiated.
+    """
+
+    def find_class(self, module: str, name: str):
+        if (module, name) in PICKLE_JAX_ARRAYS:
+            return _reconstruct_jax_array
+        if (module, name) in PICKLE_HAIKU_MAPPINGS:
+            return _reconstruct_haiku_mapping
+        if module == 'collections' and name == 'OrderedDict':
+            return super().find_class(module, name)
+        if module == 'numpy.dtypes' or (
+            module in PICKLE_NUMPY_MODULES
+            and name in PICKLE_NUMPY_NAMES
+        ):
+            return super().find_class(module, name)
+        raise pk.UnpicklingError(
+            f"Refusing to load global '{module}.{name}' from pickle file")
+
+
+def load_pickle(path: Path, keys: Iterable[str] = None) -> Dict[str, Any]:
+    """Load a dict from an AlphaFold pickle file with ResultUnpickler.
+
+    If ``keys`` is given, the dict is filtered to those items after loading.
+    The whole pickle is still unpickled, so this does not reduce peak memory
+    while loading, but other items can be freed as soon as this returns.
+    """
+    with open(path, 'rb') as f:
+        data = ResultUnpickler(f).load()
+    if keys is None:
+        return data
+    return {k: data[k] for k in keys if k in data}
+
+
+def _flatten_items(data: Dict[str, Any], prefix: str = ''):
+    """Iterate over (key, value) pairs of nested dicts with dotted keys."""
+    for key, value in data.items():
+        if isinstance(value, dict):
+            yield from _flatten_items(value, f'{prefix}{key}.')
+        else:
+            yield f'{prefix}{key}', value
+
+
+def load_model_items(
+    path: Path,
+    keys: Iterable[str] = None,
+) -> Dict[str, Any]:
+    """Load items from a model pickle, with nested dicts flattened to dotted
+    keys (e.g. ``structure_module.final_atom_positions``).
+
+    If ``keys`` is given, items are filtered after loading (see load_pickle).
+    """
+    data = load_pickle(path)
+    items = {
+        key: value
+        for key, value in _flatten_items(data)
+        if keys is None or key in keys
+    }
+    del data
+    return items
+
+
+def write_model_arrays(
+    path: Path,
+    array_dir: Path,
+    keys: Iterable[str],
+):
+    """Load the given items from a model pickle, converting arrays to .npy
+    sidecar files.
+
+    Only numeric arrays listed in ``keys`` are written to ``<key>.npy`` and
+    memory-mapped read-only, so that worker processes can open them without
+    the arrays being copied between processes. If none of the items are
+    arrays, nothing is written.
+
+    Returns a dict of items and a dict of sidecar paths for array items.
+    """
+    import numpy as np
+
+    data = load_model_items(path, keys)
+    paths = {}
+    for key, value in data.items():
+        if isinstance(value, np.ndarray) and value.dtype.kind in 'biuf':
+            array_dir.mkdir(parents=True, exist_ok=True)
+            paths[key] = array_dir / f'{key}.npy'
+            np.save(paths[key], value)
+    for key, array_path in paths.items():
+        data[key] = open_array(array_path)
+    return data, paths
+
+
+@contextlib.contextmanager
+def model_array_dir(settings: Settings):
+    """Yield a scratch directory for model array sidecars.
+
+    The directory is deleted when the run completes or fails.
+    """
+    with tempfile.TemporaryDirectory(prefix=MODEL_ARRAYS_PREFIX) as path:
+        yield Path(path)
+
+
+def open_array(array: np.ndarray | Path) -> np.ndarray:
+    """Return the given array, or memory-map it from a .npy file path.
+
+    Stages run in worker processes are passed sidecar paths rather than
+    arrays, so that arrays are not copied between processes.
+    """
+    import numpy as np
+
+    if isinstance(array, (str, Path)):
+        array = np.load(array, mmap_mode='r')
+        if not array.ndim:
+            array = np.array(array)
+    return array
 
 
 class ResultModelPrediction:
-    """Load and manipulate data from result_model_*.pkl files."""
-    def __init__(self, path: str, context: ExecutionContext):
+    """Load and manipulate data from result_model_*.pkl files.
+
+    If ``keys`` is given, only those items are kept. If ``array_dir`` is
+    given, arrays are converted to .npy sidecars in a subdirectory (see
+    write_model_arrays), which are memory-mapped rather than loaded.
+    """
+    def __init__(
+        self,
+        path: str,
+        context: ExecutionContext,
+        keys: Iterable[str] = None,
+        array_dir: Path = None,
+    ):
         self.context = context
         self.path = path
         self.name = os.path.basename(path).replace('result_', '').split('.')[0]
-        with open(path, 'rb') as path:
-            self.data = pk.load(path)
+        self.array_paths = {}
+        if array_dir:
+            self.data, self.array_paths = write_model_arrays(
+                path, array_dir / self.name, keys)
+        else:
+            self.data = load_model_items(path, keys)
 
     @property
     def plddts(self) -> List[float]:
         """Return pLDDT scores for each residue."""
         return list(self.data['plddt'])
 
+    def get_array_ref(self, key: str):
+        """Return an item to pass to a worker process stage.
+
+        Arrays are returned as their sidecar path if they were converted
+        (see open_array), other items as their value, or None if the item is
+        absent.
+        """
+        return self.array_paths.get(key, self.data.get(key))
+
 
 class ResultRanking:
     """Load and manipulate data from ranking_debug.json file."""
@@ -220,21 +830,499 @@ class ResultRanking:
 
         Model names are expressed in result_model_*.pkl file names.
         """
-        return self.data['order'].index(model_name)
+        return self.context.manifest.ranks[model_name]
+
+
+class ModelResultStore:
+    """Load each result_model_*.pkl file once and share the results.
+
+    Model pickles can be several GB for large multimers, so each file is read
+    exactly once, and only the items required by the enabled output stages
+    are kept. If ``array_dir`` is given, the required arrays are converted to
+    .npy sidecars there and memory-mapped, and each full result dict is
+    released before the next pickle is read, so peak memory is bounded by a
+    single model. Stages run in worker processes are passed the sidecar
+    paths (see ResultModelPrediction.get_array_ref).
+    """
+
+    def __init__(
+        self,
+        ranking: ResultRanking,
+        context: ExecutionContext,
+        load: bool = True,
+        array_dir: Path = None,
+    ):
+        self.ranking = ranking
+        self.context = context
+        self.array_dir = array_dir
+        self.keys = self.required_keys(context.settings)
+        self.models: Dict[int, ResultModelPrediction] = {}
+        if load:
+            self.load()
+
+    def load(self):
+        """Open required items from each model pkl file."""
+        for path in self.context.model_pkl_paths:
+            model = ResultModelPrediction(
+                path, self.context, keys=self.keys, array_dir=self.array_dir)
+            rank = self.ranking.get_rank_for_model(model.name)
+            self.models[rank] = model
+
+    @staticmethod
+    def required_keys(settings: Settings) -> Set[str]:
+        """Return the pkl keys required by the enabled output stages."""
+        keys = {'ptm', 'iptm'}
+        if (
+            settings.output_residue_scores
+            or settings.output_model_plots
+            or settings.output_html_bundle
+        ):
+            keys.add('plddt')
+        if (
+            settings.output_pae
+            or settings.output_model_plots
+            or settings.output_html_bundle
+        ):
+            keys.add('predicted_aligned_error')
+            keys.add('max_predicted_aligned_error')
+        if settings.output_slim_pkls:
+            keys.update(SLIM_MODEL_KEYS)
+        if settings.output_interface_scores:
+            keys.update(['plddt', 'predicted_aligned_error'])
+            keys.update(INTERFACE_ATOM_KEYS)
+        return keys
+
+    @property
+    def ranks(self) -> List[int]:
+        """Return ranks for all loaded models in ascending order."""
+        return sorted(self.models)
+
+    def items(self):
+        """Iterate over (rank, model) pairs in rank order."""
+        for rank in self.ranks:
+            yield rank, self.models[rank]
+
+    def items_by_path(self):
+        """Iterate over (rank, model) pairs in model pkl path order."""
+        for rank, model in sorted(
+            self.models.items(),
+            key=lambda x: x[1].path,
+        ):
+            yield rank, model
+
+
+class Stage:
+    """A unit of work in the output generation graph.
+
+    A stage runs once all stages named in ``requires`` have completed.
+    Stages flagged as ``cpu_bound`` are run in a process pool, otherwise in a
+    thread pool. If a stage returns a list of stages, these are scheduled in
+    its place (e.g. to fan out work for each ranked model).
+
+    Stages that declare ``inputs`` are skipped on re-runs if their input
+    files and ``options`` are unchanged and all ``outputs`` exist (see
+    StageState). Stages flagged as ``on_demand`` (e.g. loading shared data)
+    are only run if a stage that requires them is run.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        func: Callable,
+        *args,
+        requires: Iterable[str] = (),
+        cpu_bound: bool = False,
+        inputs: Iterable[Path] = None,
+        outputs: Iterable[Path] = (),
+        options: Dict[str, Any] = None,
+        on_demand: bool = False,
+        **kwargs,
+    ):
+        self.name = name
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.requires = set(requires)
+        self.cpu_bound = cpu_bound
+        self.inputs = None if inputs is None else list(inputs)
+        self.outputs = list(outputs)
+        self.options = options or {}
+        self.on_demand = on_demand
+        # Name of the top-level stage that this stage was fanned out from
+        self.root = name
+
+    def __repr__(self):
+        return f"<Stage {self.name}>"
+
+    def run(self):
+        return self.func(*self.args, **self.kwargs)
+
+
+def read_io_counters() -> Dict[str, int]:
+    """Return bytes read/written so far by the calling thread.
+
+    Counts all read/write calls, including those served from the page cache
+    or by network filesystems. Returns zeros where /proc is unavailable.
+    """
+    counters = {'rchar': 0, 'wchar': 0}
+    for path in ('/proc/thread-self/io', '/proc/self/io'):
+        try:
+            with open(path) as f:
+                for line in f:
+                    key, _, value = line.partition(':')
+                    if key in counters:
+                        counters[key] = int(value)
+            break
+        except OSError:
+            continue
+    return counters
+
+
+def read_peak_rss() -> float:
+    """Return peak resident set size of this process in MB.
+
+    Returns 0 where the resource module is unavailable.
+    """
+    try:
+        import resource
+    except ImportError:
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    # ru_maxrss is in bytes on macOS and KB elsewhere
+    scale = 1024 ** 2 if sys.platform == 'darwin' else 1024
+    return usage.ru_maxrss / scale
+
+
+def run_measured(func: Callable, *args, **kwargs):
+    """Call ``func`` and measure the resources it used.
+
+    Returns a tuple of the function's result and a dict of metrics. CPU time
+    and I/O are measured for the calling thread; peak RSS is process-wide, so
+    concurrent stages in the same process share their RSS delta.
+    """
+    io_start = read_io_counters()
+    rss_start = read_peak_rss()
+    cpu_start = time.thread_time()
+    wall_start = time.perf_counter()
+    result = func(*args, **kwargs)
+    wall_time = time.perf_counter() - wall_start
+    cpu_time = time.thread_time() - cpu_start
+    io_end = read_io_counters()
+    rss_end = read_peak_rss()
+    metrics = {
+        'wall_time_s': round(wall_time, 4),
+        'cpu_time_s': round(cpu_time, 4),
+        'peak_rss_mb': round(rss_end, 1),
+        'peak_rss_delta_mb': round(rss_end - rss_start, 1),
+        'bytes_read': io_end['rchar'] - io_start['rchar'],
+        'bytes_written': io_end['wchar'] - io_start['wchar'],
+    }
+    return result, metrics
+
+
+class StageExecutors:
+    """Thread and process pools for running stages concurrently.
+
+    Worker processes are started from a clean server process, because
+    forking while the thread pool is running is unsafe.
+    """
+
+    def __init__(self, workers: int, max_tasks_per_child: int = None):
+        mp_context = multiprocessing.get_context(
+            'forkserver'
+            if 'forkserver' in multiprocessing.get_all_start_methods()
+            else 'spawn')
+        kwargs = {}
+        if max_tasks_per_child and sys.version_info >= (3, 11):
+            kwargs['max_tasks_per_child'] = max_tasks_per_child
+        self.threads = ThreadPoolExecutor(workers)
+        self.processes = ProcessPoolExecutor(
+            workers, mp_context=mp_context, **kwargs)
+
+    def shutdown(self):
+        self.threads.shutdown()
+        self.processes.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+
+
+def run_stages(
+    stages: List[Stage],
+    workers: int = 1,
+    on_complete: Callable[[str], None] = None,
+    executors: StageExecutors = None,
+    on_metrics: Callable[[dict], None] = None,
+) -> List[dict]:
+    """Run output stages in dependency order.
+
+    With a single worker, stages are run in the given order in this process.
+    Otherwise up to ``workers`` stages are run concurrently, in the given
+    ``executors`` or in pools created for this call.
+
+    If given, ``on_complete`` is called with the name of each top-level
+    stage once it and all stages fanned out from it have completed, and
+    ``on_metrics`` with the metrics of each stage as it completes.
+
+    Returns resource metrics for each stage run (see run_measured), in order
+    of completion. A dict returned by a stage is included as its summary.
+    """
+    metrics = []
+    outstanding = {stage.name: 1 for stage in stages}
+
+    def record(stage, result, stage_metrics, pool):
+        metrics.append({'stage': stage.name, 'pool': pool, **stage_metrics})
+        if isinstance(result, dict):
+            metrics[-1]['summary'] = result
+        if on_metrics:
+            on_metrics(metrics[-1])
+        if isinstance(result, list):
+            for child in result:
+                child.root = stage.root
+            outstanding[stage.root] += len(result)
+        outstanding[stage.root] -= 1
+        if not outstanding[stage.root] and on_complete:
+            on_complete(stage.root)
+
+    if workers <= 1:
+        pending = list(stages)
+        while pending:
+            stage = pending.pop(0)
+            result, stage_metrics = run_measured(stage.run)
+            record(stage, result, stage_metrics, 'main')
+            if isinstance(result, list):
+                pending = result + pending
+        return metrics
+
+    done = set()
+    pending = list(stages)
+    running = {}
+    owns_executors = executors is None
+    if owns_executors:
+        executors = StageExecutors(workers)
+    try:
+        while pending or running:
+            for stage in list(pending):
+                if len(running) >= workers:
+                    break
+                if stage.requires <= done:
+                    pool = (
+                        executors.processes
+                        if stage.cpu_bound
+                        else executors.threads)
+                    future = pool.submit(
+                        run_measured, stage.func, *stage.args, **stage.kwargs)
+                    running[future] = stage
+                    pending.remove(stage)
+            if not running:
+                raise RuntimeError(
+                    "Unable to schedule output stages with unmet"
+                    f" requirements: {pending}")
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                stage = running.pop(future)
+                result, stage_metrics = future.result()
+                record(
+                    stage, result, stage_metrics,
+                    'process' if stage.cpu_bound else 'thread')
+                if isinstance(result, list):
+                    pending = result + pending
+                    # Dependents of a fan-out stage wait for its children
+                    for s in pending:
+                        if stage.name in s.requires:
+                            s.requires |= {r.name for r in result}
+                            s.requires.discard(stage.name)
+                else:
+                    done.add(stage.name)
+    except BaseException:
+        # Let running stages finish before the pools are reused or shut down
+        wait(running)
+        raise
+    finally:
+        if owns_executors:
+            executors.shutdown()
+    return metrics
+
+
+class StageState:
+    """Record input fingerprints of completed stages between runs.
+
+    A stage's fingerprint covers the size, mtime and a sampled hash of each
+    of its input files, its options and this script. Stages whose
+    fingerprint matches that recorded by a previous run, and whose outputs
+    all exist, are skipped unless ``--force`` is given. This allows a failed
+    job to be re-run without re-reading every model pickle.
+    """
 
+    def __init__(self, settings: Settings):
+        self.path = settings.workdir / OUTPUTS['state']
+        self.force = settings.force
+        self.completed: Dict[str, str] = {} if self.force else self.load()
+        self.fingerprints: Dict[str, str] = {}
+        self._file_fingerprints: Dict[Path, list] = {}
+
+    def load(self) -> Dict[str, str]:
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if state.get('version') != STATE_VERSION:
+            return {}
+        return state.get('stages', {})
+
+    def save(self):
+        """Write the state file, replacing any previous version atomically."""
+        tmp_path = self.path.with_name(self.path.name + '.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump({
+                'version': STATE_VERSION,
+                'stages': self.completed,
+            }, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+    def file_fingerprint(self, path: Path) -> list:
+        """Return [path, size, mtime, hash] for a file, or None if absent."""
+        if path in self._file_fingerprints:
+            return self._file_fingerprints[path]
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            fingerprint = [str(path), None, None, None]
+        else:
+            digest = hashlib.blake2b(digest_size=16)
+            with open(path, 'rb') as f:
+                if stat.st_size <= 2 * STATE_HASH_SAMPLE_SIZE:
+                    digest.update(f.read())
+                else:
+                    digest.update(f.read(STATE_HASH_SAMPLE_SIZE))
+                    f.seek(-STATE_HASH_SAMPLE_SIZE, os.SEEK_END)
+                    digest.update(f.read())
+            fingerprint = [
+                str(path), stat.st_size, stat.st_mtime_ns, digest.hexdigest()]
+        self._file_fingerprints[path] = fingerprint
+        return fingerprint
+
+    def fingerprint(self, stage: Stage) -> str:
+        data = {
+            'script': self.file_fingerprint(Path(__file__).resolve()),
+            'inputs': [
+                self.file_fingerprint(Path(path)) for path in stage.inputs],
+            'options': stage.options,
+        }
+        return hashlib.sha256(
+            json.dumps(data, sort_keys=True, default=str).encode()
+        ).hexdigest()
+
+    def skip_unchanged(self, stages: List[Stage]) -> List[Stage]:
+        """Return the stages that need to be run.
+
+        Records of the returned stages are cleared, so that a stage which
+        fails part way through is re-run next time.
+        """
+        run = []
+        skipped = set()
+        for stage in stages:
+            if stage.inputs is not None:
+                fingerprint = self.fingerprint(stage)
+                self.fingerprints[stage.name] = fingerprint
+                if (
+                    self.completed.get(stage.name) == fingerprint
+                    and all(Path(p).exists() for p in stage.outputs)
+                ):
+                    print(f"Skipping unchanged stage: {stage.name}")
+                    skipped.add(stage.name)
+                    continue
+                self.completed.pop(stage.name, None)
+            run.append(stage)
+        required = set()
+        for stage in run:
+            if not stage.on_demand:
+                required |= stage.requires
+        for stage in list(run):
+            if stage.on_demand and stage.name not in required:
+                run.remove(stage)
+                skipped.add(stage.name)
+        for stage in run:
+            stage.requires -= skipped
+        self.save()
+        return run
+
+    def record(self, name: str):
+        """Record a completed stage."""
+        if name in self.fingerprints:
+            self.completed[name] = self.fingerprints[name]
+            self.save()
+
+
+def format_bytes(size: float) -> str:
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024 or unit == 'GB':
+            break
+        size /= 1024
+    return f"{size:.1f} {unit}" if unit != 'B' else f"{int(size)} B"
+
+
+def write_metrics(
+    settings: Settings,
+    metrics: List[dict],
+    wall_time: float,
+    status: str = 'complete',
+):
+    """Write the per-stage resource report and print a summary to stderr.
 
-def write_confidence_scores(ranking: ResultRanking, context: ExecutionContext):
+    The report is rewritten as each stage completes with status 'running',
+    so that a run which fails or is killed still leaves the metrics of the
+    stages it completed. The summary is only printed once the run has
+    finished.
+    """
+    # Stages run in worker processes report the peak RSS of their worker
+    peak_rss = max([read_peak_rss()] + [m['peak_rss_mb'] for m in metrics])
+    report = {
+        'status': status,
+        'workers': settings.workers,
+        'wall_time_s': round(wall_time, 4),
+        'peak_rss_mb': round(peak_rss, 1),
+        'bytes_read': sum(m['bytes_read'] for m in metrics),
+        'bytes_written': sum(m['bytes_written'] for m in metrics),
+        'stages': metrics,
+    }
+    path = settings.workdir / OUTPUTS['metrics']
+    tmp_path = path.with_name(path.name + '.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    os.replace(tmp_path, path)
+    if status == 'running':
+        return
+    slowest = max(metrics, key=lambda m: m['wall_time_s'], default=None)
+    summary = (
+        f"outputs.py: {len(metrics)} stages {status} in {wall_time:.1f} s,"
+        f" peak RSS {peak_rss:.0f} MB,"
+        f" read {format_bytes(report['bytes_read'])},"
+        f" written {format_bytes(report['bytes_written'])}")
+    if slowest:
+        summary += (
+            f"; slowest: {slowest['stage']}"
+            f" ({slowest['wall_time_s']:.1f} s)")
+    print(summary, file=sys.stderr)
+
+
+def write_confidence_scores(
+    ranking: ResultRanking,
+    context: ExecutionContext,
+    store: ModelResultStore,
+):
     """Write per-model confidence scores."""
     outfile = context.settings.workdir / OUTPUTS['model_confidence_scores']
     scores: Dict[str, list] = {}
     header = ['model', context.plddt_key]
 
-    for i, path in enumerate(context.model_pkl_paths):
-        model_name = 'model_' + path.stem.split('model_')[1]
-        rank = ranking.get_rank_for_model(model_name)
+    for i, (rank, model) in enumerate(store.items_by_path()):
         scores_ls = [ranking.get_plddt_for_rank(rank)]
-        with open(path, 'rb') as f:
-            data = pk.load(f)
+        data = model.data
         if 'ptm' in data:
             scores_ls.append(data['ptm'])
             if i == 0:
@@ -256,15 +1344,14 @@ def write_confidence_scores(ranking: ResultRanking, context: ExecutionContext):
 def write_per_residue_scores(
     ranking: ResultRanking,
     context: ExecutionContext,
+    store: ModelResultStore,
 ):
     """Write per-residue plddts for each model.
 
     A row of plddt values is written for each model in tabular format.
     """
     model_plddts = {}
-    for i, path in enumerate(context.model_pkl_paths):
-        model = ResultModelPrediction(path, context)
-        rank = ranking.get_rank_for_model(model.name)
+    for rank, model in store.items():
         model_plddts[rank] = model.plddts
 
     path = context.settings.workdir / OUTPUTS['plddts']
@@ -276,41 +1363,562 @@ def write_per_residue_scores(
             f.write('\t'.join(row) + '\n')
 
 
-def rename_model_pkls(ranking: ResultRanking, context: ExecutionContext):
-    """Rename model.pkl files so the rank order is implicit."""
-    for path in context.model_pkl_paths:
-        model = ResultModelPrediction(path, context)
-        rank = ranking.get_rank_for_model(model.name)
-        new_path = (
+def _reflink(src: Path, dst: Path):
+    """Clone a file with the FICLONE ioctl (copy-on-write filesystems)."""
+    import fcntl
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+
+
+def _copy_file_range(src: Path, dst: Path):
+    """Copy a file in-kernel with copy_file_range(2)."""
+    if not hasattr(os, 'copy_file_range'):
+        raise OSError(errno.ENOSYS, 'copy_file_range is not available')
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        remaining = os.fstat(fsrc.fileno()).st_size
+        while remaining > 0:
+            copied = os.copy_file_range(
+                fsrc.fileno(), fdst.fileno(), remaining)
+            if copied == 0:
+                break
+            remaining -= copied
+
+
+def link_file(
+    src: Path,
+    dst: Path,
+    strategies: List[str] = LINK_STRATEGIES,
+) -> str:
+    """Write ``dst`` with the same content as ``src``.
+
+    Each strategy is attempted in turn until one is supported by the
+    filesystem. Returns the name of the strategy that succeeded.
+    """
+    for strategy in strategies:
+        if os.path.lexists(dst):
+            os.unlink(dst)
+        try:
+            if strategy == 'hardlink':
+                os.link(src, dst)
+            elif strategy == 'reflink':
+                _reflink(src, dst)
+            elif strategy == 'copy_file_range':
+                _copy_file_range(src, dst)
+            elif strategy == 'copy':
+                shutil.copyfile(src, dst)
+            else:
+                raise ValueError(f"Unknown link strategy: '{strategy}'")
+            return strategy
+        except OSError:
+            if os.path.lexists(dst):
+                os.unlink(dst)
+            if strategy == strategies[-1]:
+                raise
+    raise ValueError("No link strategies provided")
+
+
+def link_model_pkl(
+    src: Path,
+    dst: Path,
+    strategies: List[str],
+    manifest: Dict[str, dict],
+):
+    """Link a ranked model pkl and record the strategy used in the manifest.
+
+    Run in a thread, so that the manifest is shared with the manifest stage.
+    """
+    manifest[dst.name]['strategy'] = link_file(src, dst, strategies)
+
+
+def write_pkl_manifest(manifest: Dict[str, dict], path: Path):
+    """Write the manifest of ranked model pkls."""
+    with open(path, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+
+def rename_model_pkls(
+    ranking: ResultRanking,
+    context: ExecutionContext,
+    store: ModelResultStore,
+) -> List[Stage]:
+    """Rename model.pkl files so the rank order is implicit.
+
+    Ranked pkl files are hardlinked, reflinked or copied from the source
+    model pkl files, depending on what the filesystem supports. The strategy
+    is detected with the first model, and a manifest mapping each ranked pkl
+    back to its source model and the strategy used is written once all
+    models are linked.
+
+    Returns a link stage for each remaining model, and a manifest stage.
+    """
+    settings = context.settings
+    strategies = settings.pkl_link_strategies
+    manifest = {}
+    stages = []
+    for rank, model in store.items_by_path():
+        new_path = settings.workdir / OUTPUTS['model_pkl'].format(rank=rank)
+        manifest[new_path.name] = {
+            'source': os.path.basename(model.path),
+            'model': model.name,
+        }
+        if len(manifest) == 1:
+            link_model_pkl(model.path, new_path, strategies, manifest)
+            strategy = manifest[new_path.name]['strategy']
+            strategies = [strategy]
+            if strategy != 'copy':
+                strategies.append('copy')
+        else:
+            stages.append(Stage(
+                f'pkl_ranked_{rank}',
+                link_model_pkl,
+                model.path,
+                new_path,
+                strategies,
+                manifest,
+            ))
+
+    stages.append(Stage(
+        'pkl_manifest',
+        write_pkl_manifest,
+        manifest,
+        settings.workdir / OUTPUTS['model_pkl_manifest'],
+        requires=[stage.name for stage in stages],
+    ))
+    return stages
+
+
+def slim_model_pkls(
+    ranking: ResultRanking,
+    context: ExecutionContext,
+    store: ModelResultStore,
+) -> List[Stage]:
+    """Write slim confidence-only outputs for each ranked model.
+
+    Returns a write stage for each model.
+    """
+    stages = []
+    for rank, model in store.items_by_path():
+        arrays = {
+            k: model.get_array_ref(k)
+            for k in SLIM_MODEL_KEYS
+            if k in model.data
+        }
+        metadata = {
+            'model': model.name,
+            'rank': rank,
+            'source': os.path.basename(model.path),
+            'model_preset': context.settings.model_preset,
+        }
+        stages.append(Stage(
+            f'slim_ranked_{rank}',
+            write_slim_model,
+            arrays,
             context.settings.workdir
-            / OUTPUTS['model_pkl'].format(rank=rank)
-        )
-        shutil.copyfile(path, new_path)
+            / OUTPUTS['model_slim'].format(rank=rank),
+            context.settings.workdir
+            / OUTPUTS['model_slim_meta'].format(rank=rank),
+            metadata,
+            cpu_bound=True,
+        ))
+    return stages
+
+
+def write_slim_model(
+    arrays: Dict[str, Any],
+    npz_path: Path,
+    meta_path: Path,
+    metadata: Dict[str, Any],
+):
+    """Write confidence arrays to a compressed .npz with a metadata JSON.
+
+    Arrays listed with a tolerance in SLIM_MODEL_KEYS are stored as float16
+    if they round-trip within that tolerance, otherwise as float32. The
+    written file is re-read and checked against the original values.
+    """
+    import numpy as np
+
+    arrays = {key: open_array(value) for key, value in arrays.items()}
+
+    def max_abs_error(stored, value):
+        if not value.size or value.dtype.kind != 'f':
+            return 0.0
+        with np.errstate(over='ignore', invalid='ignore'):
+            error = np.abs(stored.astype(np.float64) - value)
+        return float(np.nanmax(error)) if not np.isnan(error).all() else 0.0
+
+    slim = {}
+    errors = {}
+    for key, value in arrays.items():
+        value = np.asarray(value)
+        stored = value
+        tolerance = SLIM_MODEL_KEYS[key]
+        if tolerance is not None and value.dtype.kind == 'f':
+            stored = value.astype(np.float32)
+            with np.errstate(over='ignore'):
+                quantised = value.astype(np.float16)
+            if max_abs_error(quantised, value) <= tolerance:
+                stored = quantised
+        slim[key] = stored
+        errors[key] = max_abs_error(stored, value)
+    np.savez_compressed(npz_path, **slim)
+
+    with np.load(npz_path) as saved:
+        for key, value in arrays.items():
+            tolerance = SLIM_MODEL_KEYS[key] or 0.0
+            if not np.allclose(
+                saved[key].astype(np.float64),
+                np.asarray(value, dtype=np.float64),
+                rtol=0,
+                atol=tolerance,
+                equal_nan=True,
+            ):
+                raise ValueError(
+                    f"Slim model output {npz_path} failed round-trip check"
+                    f" for '{key}'")
+
+    metadata = dict(metadata)
+    metadata['arrays'] = {
+        key: {
+            'dtype': str(value.dtype),
+            'shape': list(value.shape),
+            'max_abs_error': errors[key],
+        }
+        for key, value in slim.items()
+    }
+    with open(meta_path, 'w') as f:
+        json.dump(metadata, f, indent=2)
+
+
+def write_pae_csv(
+    pae: np.ndarray,
+    path: Path,
+    precision: int = DEFAULT_PAE_PRECISION,
+):
+    """Write PAE matrix to CSV, optionally with fixed decimal precision.
+
+    By default each value is written in full, as the shortest repr of its
+    dtype. If ``precision`` is given, PAE values are bounded and
+    non-negative, so the matrix is rounded to integer steps of
+    ``10 ** -precision`` and each step is formatted once in a lookup table.
+    Rows are then built by indexing into the table, rather than converting
+    each value individually. Matrices too large or irregular for a table are
+    formatted value by value, after the same rounding (half to even, on the
+    value scaled to integer steps), so both paths write identical text.
+    """
+    import numpy as np
+
+    nrows, ncols = pae.shape
+    block_rows = max(1, PAE_CSV_BLOCK_CELLS // max(ncols, 1))
+    if precision is None:
+        return _write_pae_csv_repr(pae, path, block_rows)
+    factor = 10 ** precision
+    max_step = (
+        float(np.nanmax(pae)) * factor
+        if pae.size and np.isfinite(pae).all()
+        else None)
+    if (
+        max_step is None
+        or max_step > PAE_CSV_MAX_TABLE_SIZE
+        or (pae.size and pae.min() < 0)
+    ):
+        return _write_pae_csv_fmt(pae, path, precision, block_rows)
+
+    table = np.array([
+        f'{i / factor:.{precision}f}'
+        for i in range(int(np.rint(max_step)) + 1)
+    ], dtype=object)
+    with open(path, 'w') as f:
+        for start in range(0, nrows, block_rows):
+            block = pae[start:start + block_rows].astype(np.float64)
+            steps = np.rint(block * factor).astype(np.int64)
+            f.write(''.join(
+                ','.join(row) + '\n'
+                for row in table[steps].tolist()
+            ))
+
+
+def _write_pae_csv_repr(pae: np.ndarray, path: Path, block_rows: int):
+    """Write PAE matrix to CSV in full, converting blocks of rows at once."""
+    with open(path, 'w') as f:
+        for start in range(0, pae.shape[0], block_rows):
+            block = pae[start:start + block_rows].astype(str)
+            f.write(''.join(
+                ','.join(row) + '\n'
+                for row in block.tolist()
+            ))
+
+
+def _write_pae_csv_fmt(
+    pae: np.ndarray,
+    path: Path,
+    precision: int,
+    block_rows: int,
+):
+    """Write PAE matrix to CSV by formatting blocks of rows at once.
+
+    Values are rounded to integer steps of ``10 ** -precision`` first, as
+    for the lookup table in write_pae_csv.
+    """
+    import numpy as np
+
+    factor = 10 ** precision
+    row_fmt = ','.join([f'%.{precision}f'] * pae.shape[1]) + '\n'
+    with open(path, 'w') as f:
+        for start in range(0, pae.shape[0], block_rows):
+            block = pae[start:start + block_rows].astype(np.float64)
+            block = np.rint(block * factor) / factor
+            f.write(
+                (row_fmt * len(block)) % tuple(block.ravel().tolist()))
 
 
-def extract_pae_to_csv(ranking: ResultRanking, context: ExecutionContext):
-    """Extract predicted alignment error matrix from pickle files.
+def quantize_pae(pae: np.ndarray, max_pae: float = None):
+    """Quantise PAE matrix to uint8.
 
-    Creates a CSV file for each of five ranked models.
+    Returns the quantised matrix and the scale factor required to recover
+    approximate PAE values (``pae ~= quantised * scale``).
     """
-    for path in context.model_pkl_paths:
-        model = ResultModelPrediction(path, context)
-        rank = ranking.get_rank_for_model(model.name)
-        with open(path, 'rb') as f:
-            data = pk.load(f)
-        if 'predicted_aligned_error' not in data:
+    import numpy as np
+
+    if max_pae is None:
+        max_pae = float(pae.max()) if pae.size else 0.0
+    scale = float(max_pae) / 255 if max_pae else 1.0
+    quantised = np.clip(np.rint(pae / scale), 0, 255).astype(np.uint8)
+    return quantised, scale
+
+
+def write_pae(
+    pae: np.ndarray | Path,
+    path: Path,
+    fmt: str,
+    precision: int = DEFAULT_PAE_PRECISION,
+    max_pae: float = None,
+):
+    """Write PAE matrix to file in the given format."""
+    import numpy as np
+
+    pae = open_array(pae)
+
+    if fmt == 'csv':
+        write_pae_csv(pae, path, precision=precision)
+    elif fmt == 'npy':
+        np.save(path, pae.astype(np.float32, copy=False))
+    elif fmt == 'npz':
+        np.savez_compressed(path, pae=pae.astype(np.float32, copy=False))
+    elif fmt == 'float16':
+        np.save(path, pae.astype(np.float16))
+    elif fmt == 'uint8':
+        quantised, scale = quantize_pae(pae, max_pae=max_pae)
+        np.savez_compressed(path, pae=quantised, scale=scale)
+    else:
+        raise ValueError(f"Unknown PAE export format: '{fmt}'")
+
+
+def export_pae(
+    ranking: ResultRanking,
+    context: ExecutionContext,
+    store: ModelResultStore,
+):
+    """Export predicted alignment error matrix from pickle files.
+
+    Creates a file for each of five ranked models in each of the requested
+    formats (see PAE_FORMATS). Returns a write stage for each file.
+    """
+    settings = context.settings
+    stages = []
+    for rank, model in store.items_by_path():
+        if 'predicted_aligned_error' not in model.data:
             print("Skipping PAE output"
-                  f" - not found in {path}."
+                  f" - not found in {model.path}."
                   " Running with model_preset=monomer?")
+            return stages
+        pae = model.get_array_ref('predicted_aligned_error')
+        max_pae = model.data.get('max_predicted_aligned_error')
+        for fmt in settings.pae_formats:
+            out_path = (
+                settings.workdir
+                / OUTPUTS[PAE_FORMATS[fmt]].format(rank=rank)
+            )
+            stages.append(Stage(
+                f'pae_ranked_{rank}_{fmt}',
+                write_pae,
+                pae,
+                out_path,
+                fmt,
+                precision=settings.pae_precision,
+                max_pae=max_pae,
+                cpu_bound=True,
+            ))
+    return stages
+
+
+def contact_coordinates(
+    positions: np.ndarray,
+    mask: np.ndarray,
+) -> np.ndarray:
+    """Return CB coordinates for each residue, or CA where there is no CB."""
+    import numpy as np
+    has_cb = np.asarray(mask[:, ATOM37_CB]) > 0
+    return np.where(
+        has_cb[:, None],
+        positions[:, ATOM37_CB],
+        positions[:, ATOM37_CA],
+    ).astype(np.float64)
+
+
+def multimer_chain_id(index: int) -> str:
+    """Return the chain ID AlphaFold-Multimer assigns to a 0-based chain index.
+
+    IDs run A..Z, then AA, BA, CA, ..., as in
+    alphafold.data.pipeline_multimer.int_id_to_str_id.
+    """
+    letters = []
+    while index >= 0:
+        letters.append(chr(ord('A') + index % 26))
+        index = index // 26 - 1
+    return ''.join(letters)
+
+
+def chain_pair_scores(
+    plddt: np.ndarray,
+    pae: np.ndarray,
+    chain_lengths: List[int],
+    coords: np.ndarray = None,
+    contact_distance: float = INTERFACE_CONTACT_DISTANCE,
+) -> Dict[str, np.ndarray]:
+    """Summarise PAE and contacts for each (aligned, scored) pair of chains.
+
+    The PAE matrix is read in blocks of rows, and each block is reduced to
+    per-chain columns with ``reduceat``, so memory use is bounded by the
+    block size. If ``coords`` are given, PAE and pLDDT are also averaged over
+    the residue pairs in contact.
+
+    Returns a dict of per-chain arrays (``plddt``) and chain x chain arrays
+    (the rest). Pairs without contacts have NaN contact scores.
+    """
+    import numpy as np
+
+    k = len(chain_lengths)
+    n = pae.shape[0]
+    starts = np.concatenate([[0], np.cumsum(chain_lengths)[:-1]])
+    chain_of = np.repeat(np.arange(k), chain_lengths)
+    plddt = np.asarray(plddt, dtype=np.float64)
+
+    pae_sum = np.zeros((k, k))
+    pae_min = np.full((k, k), np.inf)
+    contacts = np.zeros((k, k))
+    contact_pae_sum = np.zeros((k, k))
+    iface_plddt_sum = np.zeros((k, k))
+    iface_residues = np.zeros((k, k))
+    block_rows = max(1, INTERFACE_BLOCK_CELLS // max(n, 1))
+    for start in range(0, n, block_rows):
+        stop = min(start + block_rows, n)
+        block = np.asarray(pae[start:stop], dtype=np.float64)
+        rows = chain_of[start:stop]
+        np.add.at(pae_sum, rows, np.add.reduceat(block, starts, axis=1))
+        np.minimum.at(
+            pae_min, rows, np.minimum.reduceat(block, starts, axis=1))
+        if coords is None:
+            continue
+        delta = coords[start:stop, None, :] - coords[None, :, :]
+        contact = (delta ** 2).sum(axis=-1) < contact_distance ** 2
+        contact[np.arange(stop - start), np.arange(start, stop)] = False
+        np.add.at(contacts, rows, np.add.reduceat(
+            contact.astype(np.float64), starts, axis=1))
+        np.add.at(contact_pae_sum, rows, np.add.reduceat(
+            np.where(contact, block, 0), starts, axis=1))
+        touches = np.logical_or.reduceat(contact, starts, axis=1)
+        np.add.at(iface_residues, rows, touches)
+        np.add.at(
+            iface_plddt_sum, rows, touches * plddt[start:stop, None])
+
+    lengths = np.asarray(chain_lengths, dtype=np.float64)
+    scores = {
+        'plddt': np.add.reduceat(plddt, starts) / lengths,
+        'mean_pae': pae_sum / np.outer(lengths, lengths),
+        'min_pae': pae_min,
+    }
+    if coords is not None:
+        with np.errstate(invalid='ignore', divide='ignore'):
+            scores['contacts'] = contacts
+            scores['contact_pae'] = contact_pae_sum / contacts
+            # Interface residues of both chains in the pair
+            scores['contact_plddt'] = (
+                (iface_plddt_sum + iface_plddt_sum.T)
+                / (iface_residues + iface_residues.T))
+    return scores
+
+
+def write_interface_scores(
+    ranking: ResultRanking,
+    context: ExecutionContext,
+    store: ModelResultStore,
+):
+    """Write chain-pair PAE, pLDDT and contact scores for each model.
+
+    Chain boundaries are taken from the input FASTA. A row is written for
+    each ordered pair of chains (aligned on chain_1, scored on chain_2),
+    including each chain with itself. Contact scores are only given for
+    pairs of different chains.
+    """
+    settings = context.settings
+    if not settings.is_multimer:
+        print("Skipping interface scores - only available for multimer"
+              " models")
+        return
+    chain_ids = get_input_sequence_ids(settings.input_fasta)
+    chain_lengths = get_input_sequence_lengths(settings.input_fasta)
+    chain_names = [
+        f'{multimer_chain_id(i)}-{chain_id}'
+        for i, chain_id in enumerate(chain_ids)
+    ]
+    header = [
+        'model', 'chain_1', 'chain_2', 'chain_1_plddt', 'chain_2_plddt',
+        'mean_pae', 'min_pae', 'contacts', 'contact_pae', 'contact_plddt',
+    ]
+
+    def fmt(value):
+        return '' if value != value else f'{value:.3f}'
+
+    rows = []
+    for rank, model in store.items():
+        pae = model.data.get('predicted_aligned_error')
+        if pae is None:
+            print("Skipping interface scores"
+                  f" - PAE not found in {model.path}")
             return
-        pae = data['predicted_aligned_error']
-        out_path = (
-            context.settings.workdir
-            / OUTPUTS['model_pae'].format(rank=rank)
-        )
-        with open(out_path, 'w') as f:
-            for row in pae:
-                f.write(','.join([str(x) for x in row]) + '\n')
+        if pae.shape[0] != sum(chain_lengths):
+            print("Skipping interface scores - input FASTA sequence lengths"
+                  f" do not match the {pae.shape[0]} residues predicted")
+            return
+        coords = None
+        if all(key in model.data for key in INTERFACE_ATOM_KEYS):
+            coords = contact_coordinates(*[
+                model.data[key] for key in INTERFACE_ATOM_KEYS])
+        scores = chain_pair_scores(
+            model.data['plddt'], pae, chain_lengths, coords=coords)
+        for i, chain_1 in enumerate(chain_names):
+            for j, chain_2 in enumerate(chain_names):
+                row = [
+                    f'ranked_{rank}', chain_1, chain_2,
+                    fmt(scores['plddt'][i]),
+                    fmt(scores['plddt'][j]),
+                    fmt(scores['mean_pae'][i, j]),
+                    fmt(scores['min_pae'][i, j]),
+                ]
+                if 'contacts' in scores and i != j:
+                    row += [
+                        str(int(scores['contacts'][i, j])),
+                        fmt(scores['contact_pae'][i, j]),
+                        fmt(scores['contact_plddt'][i, j]),
+                    ]
+                else:
+                    row += [''] * 3
+                rows.append(row)
+
+    with open(settings.workdir / OUTPUTS['interface_scores'], 'w') as f:
+        f.write('\t'.join(header) + '\n')
+        for row in rows:
+            f.write('\t'.join(row) + '\n')
 
 
 def rekey_relax_metrics(ranking: ResultRanking, context: ExecutionContext):
@@ -325,67 +1933,148 @@ def rekey_relax_metrics(ranking: ResultRanking, context: ExecutionContext):
         json.dump(data, f)
 
 
-def plddt_pae_plots(ranking: ResultRanking, context: ExecutionContext):
-    """Generate a pLDDT + PAE plot for each model."""
-    for path in context.model_pkl_paths:
-        num_plots = 2
-        model = ResultModelPrediction(path, context)
-        rank = ranking.get_rank_for_model(model.name)
+def plddt_pae_plots(
+    ranking: ResultRanking,
+    context: ExecutionContext,
+    store: ModelResultStore,
+) -> List[Stage]:
+    """Generate a pLDDT + PAE plot for each model.
+
+    Returns a plotting stage for each model.
+    """
+    stages = []
+    for rank, model in store.items_by_path():
         png_path = (
             context.settings.workdir
             / OUTPUTS['model_plot'].format(rank=rank)
         )
-        plddts = model.data['plddt']
-        if 'predicted_aligned_error' in model.data:
-            pae = model.data['predicted_aligned_error']
-            max_pae = model.data['max_predicted_aligned_error']
-        else:
-            num_plots = 1
+        pae = model.get_array_ref('predicted_aligned_error')
+        max_pae = (
+            model.data['max_predicted_aligned_error']
+            if pae is not None
+            else None)
+        stages.append(Stage(
+            f'plot_ranked_{rank}',
+            plot_model,
+            model.get_array_ref('plddt'),
+            png_path,
+            pae=pae,
+            max_pae=max_pae,
+            cpu_bound=True,
+        ))
+    return stages
+
+
+def plot_model(
+    plddts: np.ndarray | Path,
+    png_path: Path,
+    pae: np.ndarray | Path = None,
+    max_pae: float = None,
+):
+    """Plot pLDDT and (if available) PAE for a single model."""
+    plt = import_pyplot()
+    plddts = open_array(plddts)
+    if pae is not None:
+        pae = open_array(pae)
+
+    num_plots = 1 if pae is None else 2
+
+    plt.figure(figsize=[8 * num_plots, 6])
+    plt.subplot(1, num_plots, 1)
+    plt.plot(plddts)
+    plt.title('Predicted LDDT')
+    plt.xlabel('Residue')
+    plt.ylabel('pLDDT')
+
+    if num_plots == 2:
+        plt.subplot(1, 2, 2)
+        plt.imshow(pae, vmin=0., vmax=max_pae, cmap='Greens_r')
+        plt.colorbar(fraction=0.046, pad=0.04)
+        plt.title('Predicted Aligned Error')
+        plt.xlabel('Scored residue')
+        plt.ylabel('Aligned residue')
+
+    plt.savefig(png_path)
+    plt.close()
 
-        plt.figure(figsize=[8 * num_plots, 6])
-        plt.subplot(1, num_plots, 1)
-        plt.plot(plddts)
-        plt.title('Predicted LDDT')
-        plt.xlabel('Residue')
-        plt.ylabel('pLDDT')
 
-        if num_plots == 2:
-            plt.subplot(1, 2, 2)
-            plt.imshow(pae, vmin=0., vmax=max_pae, cmap='Greens_r')
-            plt.colorbar(fraction=0.046, pad=0.04)
-            plt.title('Predicted Aligned Error')
-            plt.xlabel('Scored residue')
-            plt.ylabel('Aligned residue')
+def msa_coverage(
+    msa: np.ndarray,
+    max_rows: int,
+    chunk_rows: int = MSA_CHUNK_ROWS,
+):
+    """Compute the MSA coverage image and per-position depth.
+
+    Sequences are sorted by identity to the query and binned down to at most
+    ``max_rows`` image rows. Each image cell holds the mean identity of the
+    non-gap sequences in its bin, or NaN if most of them are gaps (as a
+    single row would be drawn if the bin were sampled). All arrays are
+    computed over blocks of ``chunk_rows`` sequences, so memory use does not
+    scale with MSA depth.
 
-        plt.savefig(png_path)
-        plt.close()
+    Returns (image, depth).
+    """
+    import numpy as np
+
+    nrows, ncols = msa.shape
+    query = msa[0]
+    seqid = np.empty(nrows)
+    depth = np.zeros(ncols, dtype=np.int64)
+    for start in range(0, nrows, chunk_rows):
+        block = msa[start:start + chunk_rows]
+        seqid[start:start + len(block)] = (block == query).mean(-1)
+        depth += (block != MSA_GAP).sum(0)
+    order = seqid.argsort()
+
+    nbins = min(nrows, max_rows)
+    edges = np.linspace(0, nrows, nbins + 1).astype(int)
+    image = np.full((nbins, ncols), np.nan)
+    for i in range(nbins):
+        sums = np.zeros(ncols)
+        counts = np.zeros(ncols)
+        for start in range(edges[i], edges[i + 1], chunk_rows):
+            ix = order[start:min(start + chunk_rows, edges[i + 1])]
+            non_gaps = msa[ix] != MSA_GAP
+            sums += (non_gaps * seqid[ix, None]).sum(0)
+            counts += non_gaps.sum(0)
+        covered = counts * 2 >= edges[i + 1] - edges[i]
+        image[i, covered] = sums[covered] / counts[covered]
+    return image, depth
 
 
 def plot_msa(wdir: Path, dpi: int = 150):
-    """Plot MSA as a heatmap."""
-    with open(wdir / 'features.pkl', 'rb') as f:
-        features = pk.load(f)
+    """Plot MSA as a heatmap.
+
+    Deep alignments are binned down to the pixel height of the figure.
+    """
+    plt = import_pyplot()
 
+    features = load_pickle(wdir / 'features.pkl', keys=['msa'])
     msa = features.get('msa')
     if msa is None:
         print("Could not plot MSA coverage - 'msa' key not found in"
               " features.pkl")
         return
-    seqid = (np.array(msa[0] == msa).mean(-1))
-    seqid_sort = seqid.argsort()
-    non_gaps = (msa != 21).astype(float)
-    non_gaps[non_gaps == 0] = np.nan
-    final = non_gaps[seqid_sort] * seqid[seqid_sort, None]
-
-    plt.figure(figsize=(6, 4))
+    nrows, ncols = msa.shape
+    max_rows = int(MSA_PLOT_FIGSIZE[1] * dpi)
+    final, depth = msa_coverage(msa, max_rows)
+    del features, msa
+    # Binned rows are stretched back over the full sequence axis
+    extent = (
+        (-0.5, ncols - 0.5, -0.5, nrows - 0.5)
+        if nrows > max_rows
+        else None)
+
+    plt.figure(figsize=MSA_PLOT_FIGSIZE)
     # plt.subplot(111)
     plt.title("Sequence coverage")
     plt.imshow(final,
                interpolation='nearest', aspect='auto',
-               cmap="rainbow_r", vmin=0, vmax=1, origin='lower')
-    plt.plot((msa != 21).sum(0), color='black')
-    plt.xlim(-0.5, msa.shape[1] - 0.5)
-    plt.ylim(-0.5, msa.shape[0] - 0.5)
+               cmap="rainbow_r", vmin=0, vmax=1, origin='lower',
+               extent=extent)
+    plt.plot(depth, color='black')
+    plt.xlim(-0.5, ncols - 0.5)
+    plt.ylim(-0.5, nrows - 0.5)
     plt.colorbar(label="Sequence identity to query", )
     plt.xlabel("Positions")
     plt.ylabel("Sequences")
@@ -394,36 +2083,277 @@ def plot_msa(wdir: Path, dpi: int = 150):
     plt.close()
 
 
-def collect_msas(settings: Settings):
-    """Collect MSA files into ZIP archive(s)."""
+def pack_msa(msa: np.ndarray, chunk_rows: int = MSA_CHUNK_ROWS) -> np.ndarray:
+    """Pack MSA symbols into bit planes of 64-bit words.
 
-    def zip_dir(directory: Path, is_multimer: bool, name: str):
-        chain_id = directory.with_suffix('.zip').stem
-        msa_dir = settings.output_dir / 'msas'
-        msa_dir.mkdir(exist_ok=True)
-        zip_name = (
-            f"MSA-{chain_id}-{name}.zip"
-            if is_multimer
-            else f"MSA-{name}.zip")
-        zip_path = msa_dir / zip_name
-        with zipfile.ZipFile(zip_path, 'w') as z:
-            for path in directory.glob('*'):
-                z.write(path, path.name)
+    Returns an array of shape (sequences, NEFF_SYMBOL_BITS, words), where
+    plane ``p`` holds bit ``p`` of the symbol at each position. Padding bits
+    are zero, so they never count as mismatches.
+    """
+    import numpy as np
+
+    nrows, ncols = msa.shape
+    used_bytes = -(-ncols // 8)
+    padded_bytes = -(-ncols // 64) * 8
+    packed = np.zeros(
+        (nrows, NEFF_SYMBOL_BITS, padded_bytes), dtype=np.uint8)
+    shifts = np.arange(NEFF_SYMBOL_BITS)[None, :, None]
+    for start in range(0, nrows, chunk_rows):
+        block = np.asarray(msa[start:start + chunk_rows], dtype=np.uint8)
+        bits = (block[:, None, :] >> shifts) & 1
+        packed[start:start + len(block), :, :used_bytes] = np.packbits(
+            bits, axis=-1, bitorder='little')
+    return packed.view(np.uint64)
+
+
+def _popcount(words: np.ndarray) -> np.ndarray:
+    """Return the number of set bits in each row of 64-bit words."""
+    import numpy as np
+
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(words).sum(-1, dtype=np.int64)
+    table = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+    nbytes = words.shape[-1] * 8
+    return table[words.view(np.uint8)].reshape(
+        words.shape[:-1] + (nbytes,)).sum(-1, dtype=np.int64)
+
+
+def msa_neff(
+    msa: np.ndarray,
+    identity: float = NEFF_IDENTITY,
+    block_words: int = NEFF_BLOCK_WORDS,
+) -> np.ndarray:
+    """Return the Neff weight of each sequence in the MSA.
+
+    Each weight is the inverse of the number of sequences (including itself)
+    with identity >= ``identity`` over all alignment columns. Sequences are
+    compared as packed bit planes (see pack_msa): positions differ where any
+    plane differs, so each comparison is a few XOR/OR operations and a
+    popcount per 64 positions. Each pair of sequences is compared once, in
+    blocks of at most ``block_words`` words, so no N x N matrix is stored.
+    """
+    import numpy as np
+
+    nrows, ncols = msa.shape
+    packed = pack_msa(msa)
+    words = packed.shape[-1]
+    max_mismatches = ncols - int(np.ceil(identity * ncols - 1e-9))
+    block = max(1, int(np.sqrt(block_words / max(words, 1))))
+    neighbours = np.zeros(nrows, dtype=np.int64)
+    for i in range(0, nrows, block):
+        a = packed[i:i + block]
+        for j in range(i, nrows, block):
+            b = packed[j:j + block]
+            diff = np.zeros((len(a), len(b), words), dtype=np.uint64)
+            for plane in range(NEFF_SYMBOL_BITS):
+                diff |= a[:, None, plane] ^ b[None, :, plane]
+            close = _popcount(diff) <= max_mismatches
+            neighbours[i:i + len(a)] += close.sum(1)
+            if j != i:
+                neighbours[j:j + len(b)] += close.sum(0)
+    return 1 / neighbours
+
+
+def write_msa_stats(
+    wdir: Path,
+    max_sequences: int = NEFF_MAX_SEQUENCES,
+    chunk_rows: int = MSA_CHUNK_ROWS,
+):
+    """Write per-position MSA depth and estimated Neff to TSV.
 
-    print("Collecting MSA archives...")
-    chain_names = get_input_sequence_ids(
-        settings.workdir.parent.parent / 'alphafold.fasta')
+    Depth is the number of non-gap sequences at each position, and Neff the
+    sum of their sequence weights (see msa_neff). If the MSA is deeper than
+    ``max_sequences``, weights are computed for an evenly spaced subsample
+    (including the query) and Neff is scaled up to the full depth, so the
+    column is named neff_estimate. Subsampling is also noted in a comment
+    line at the top of the TSV.
+
+    Returns a summary of the MSA statistics.
+    """
+    import numpy as np
+
+    features = load_pickle(wdir / 'features.pkl', keys=['msa'])
+    msa = features.get('msa')
+    if msa is None:
+        print("Could not compute MSA statistics - 'msa' key not found in"
+              " features.pkl")
+        return
+    nrows, ncols = msa.shape
+    depth = np.zeros(ncols, dtype=np.int64)
+    for start in range(0, nrows, chunk_rows):
+        depth += (msa[start:start + chunk_rows] != MSA_GAP).sum(0)
+
+    sample = msa
+    if max_sequences and nrows > max_sequences:
+        print(f"Estimating Neff from {max_sequences} of {nrows} MSA"
+              " sequences (see --msa-stats-max-sequences)")
+        sample = msa[np.linspace(0, nrows - 1, max_sequences).astype(int)]
+    scale = nrows / len(sample) if len(sample) else 1.0
+    weights = msa_neff(sample) * scale
+    neff = np.zeros(ncols)
+    for start in range(0, len(sample), chunk_rows):
+        non_gaps = sample[start:start + chunk_rows] != MSA_GAP
+        neff += weights[start:start + chunk_rows] @ non_gaps
+
+    with open(wdir / OUTPUTS['msa_stats'], 'w') as f:
+        if len(sample) < nrows:
+            f.write(
+                f'# Neff estimated from {len(sample)} of {nrows} sequences\n')
+        f.write('position\tdepth\tneff_estimate\n')
+        for i in range(ncols):
+            f.write(f'{i + 1}\t{depth[i]}\t{neff[i]:.2f}\n')
+    return {
+        'sequences': int(nrows),
+        'positions': int(ncols),
+        'neff_estimate': round(float(weights.sum()), 2),
+        'neff_identity': NEFF_IDENTITY,
+        'neff_sequences': int(len(sample)),
+        'min_depth': int(depth.min()) if ncols else 0,
+        'mean_depth': round(float(depth.mean()), 2) if ncols else 0,
+        'min_neff_estimate': round(float(neff.min()), 2) if ncols else 0,
+        'mean_neff_estimate': round(float(neff.mean()), 2) if ncols else 0,
+    }
+
+
+def msa_archives(settings: Settings) -> List[tuple]:
+    """Return (MSA directory, archive path) for each chain."""
+    chain_names = get_input_sequence_ids(settings.input_fasta)
     msa_dir = settings.workdir / 'msas'
+    out_dir = settings.output_dir / 'msas'
+    ext = (
+        '.tar.zst'
+        if settings.msa_archive_format == 'tar.zst'
+        else '.zip')
     is_multimer = (msa_dir / 'A').exists()
     if is_multimer:
         msa_dirs = sorted([
             path for path in msa_dir.glob('*')
             if path.is_dir()
         ])
-        for i, path in enumerate(msa_dirs):
-            zip_dir(path, is_multimer, chain_names[i])
+        archives = [
+            (path, out_dir / f"MSA-{path.name}-{chain_names[i]}{ext}")
+            for i, path in enumerate(msa_dirs)
+        ]
     else:
-        zip_dir(msa_dir, is_multimer, chain_names[0])
+        archives = [(msa_dir, out_dir / f"MSA-{chain_names[0]}{ext}")]
+    return archives
+
+
+def collect_msas(settings: Settings) -> List[Stage]:
+    """Collect MSA files into ZIP archive(s).
+
+    Returns an archive stage for each chain.
+    """
+    print("Collecting MSA archives...")
+    (settings.output_dir / 'msas').mkdir(exist_ok=True)
+    return [
+        Stage(
+            f'msa_{archive_path.name}',
+            archive_msa_dir,
+            directory,
+            archive_path,
+            settings.msa_archive_format,
+            level=settings.msa_compression_level,
+        )
+        for directory, archive_path in msa_archives(settings)
+    ]
+
+
+def archive_msa_dir(
+    directory: Path,
+    archive_path: Path,
+    fmt: str = DEFAULT_MSA_ARCHIVE_FORMAT,
+    level: int = None,
+):
+    """Write the files in an MSA directory to an archive.
+
+    Files are streamed into the archive in fixed-size blocks, so MSAs of any
+    size can be archived with constant memory. Throughput is reported on
+    stdout.
+    """
+    paths = sorted(path for path in directory.glob('*') if path.is_file())
+    start = time.perf_counter()
+    if fmt == 'tar.zst':
+        _write_msa_tar_zst(paths, archive_path, level)
+    else:
+        _write_msa_zip(paths, archive_path, fmt, level)
+    elapsed = time.perf_counter() - start
+    size_in = sum(path.stat().st_size for path in paths)
+    size_out = archive_path.stat().st_size
+    # Single write, so lines from concurrent stages are not interleaved
+    print(
+        f"Written {archive_path.name}: {size_in / 1e6:.1f} MB"
+        f" -> {size_out / 1e6:.1f} MB in {elapsed:.1f} s"
+        f" ({size_in / 1e6 / max(elapsed, 1e-6):.1f} MB/s)\n",
+        end='')
+
+
+def _write_msa_zip(
+    paths: List[Path],
+    archive_path: Path,
+    fmt: str,
+    level: int = None,
+):
+    """Stream files into a ZIP archive.
+
+    ZipFile.write streams each file in blocks and applies the archive's
+    compression level.
+    """
+    if fmt == 'stored':
+        compression = zipfile.ZIP_STORED
+    elif fmt == 'deflate':
+        compression = zipfile.ZIP_DEFLATED
+    elif fmt == 'zstd':
+        if not hasattr(zipfile, 'ZIP_ZSTANDARD'):
+            raise RuntimeError(
+                "Zstandard ZIP archives require Python >= 3.14."
+                " Use --msa-compression tar.zst with the 'zstandard'"
+                " package instead.")
+        compression = zipfile.ZIP_ZSTANDARD
+    else:
+        raise ValueError(f"Unknown MSA archive format: '{fmt}'")
+
+    with zipfile.ZipFile(
+        archive_path,
+        'w',
+        compression=compression,
+        compresslevel=level,
+    ) as z:
+        for path in paths:
+            z.write(path, path.name)
+
+
+def _open_zstd_writer(path: Path, level: int = None):
+    """Open a zstd-compressed file for writing."""
+    try:
+        from compression import zstd  # Python >= 3.14
+        return zstd.open(path, 'wb', level=level)
+    except ImportError:
+        pass
+    try:
+        import zstandard
+    except ImportError:
+        raise RuntimeError(
+            "tar.zst MSA archives require Python >= 3.14 or the"
+            " 'zstandard' package.")
+    compressor = zstandard.ZstdCompressor(
+        level=3 if level is None else level)
+    return compressor.stream_writer(open(path, 'wb'), closefd=True)
+
+
+def _write_msa_tar_zst(
+    paths: List[Path],
+    archive_path: Path,
+    level: int = None,
+):
+    """Stream files into a zstd-compressed tarball."""
+    with _open_zstd_writer(archive_path, level) as f, tarfile.open(
+        fileobj=f,
+        mode='w|',
+        copybufsize=MSA_ARCHIVE_BLOCK_SIZE,
+    ) as tar:
+        for path in paths:
+            tar.add(path, arcname=path.name)
 
 
 def get_input_sequence_ids(fasta_file: Path) -> List[str]:
@@ -441,6 +2371,17 @@ def get_input_sequence_ids(fasta_file: Path) -> List[str]:
     return headers
 
 
+def get_input_sequence_lengths(fasta_file: Path) -> List[int]:
+    """Read the length of each sequence in the input FASTA file."""
+    lengths = []
+    for line in fasta_file.read_text().split('\n'):
+        if line.startswith('>'):
+            lengths.append(0)
+        elif lengths:
+            lengths[-1] += len(line.strip())
+    return lengths
+
+
 def template_html(context: ExecutionContext):
     """Template HTML file.
 
@@ -457,30 +2398,326 @@ def template_html(context: ExecutionContext):
         f.write(html)
 
 
-def main():
-    """Parse output files and generate additional output files."""
-    settings = Settings()
+def html_bundles(
+    ranking: ResultRanking,
+    context: ExecutionContext,
+    store: ModelResultStore,
+) -> List[Stage]:
+    """Write pLDDT/PAE data bundles for the HTML viewer.
+
+    Returns a bundle stage for each model.
+    """
+    (context.settings.output_dir / 'html').mkdir(exist_ok=True)
+    return [
+        Stage(
+            f'bundle_ranked_{rank}',
+            write_html_bundle,
+            model.get_array_ref('plddt'),
+            context.settings.workdir,
+            rank,
+            pae=model.get_array_ref('predicted_aligned_error'),
+            max_pae=model.data.get('max_predicted_aligned_error'),
+            cpu_bound=True,
+        )
+        for rank, model in store.items_by_path()
+    ]
+
+
+def pae_pyramid(pae: np.ndarray, tile_size: int = HTML_TILE_SIZE):
+    """Return a list of PAE matrices, each downsampled 2x from the last.
+
+    Level 0 is the full matrix and the last level fits in a single tile.
+    Downsampled cells are the mean of the (up to) 2x2 cells they cover.
+    """
+    import numpy as np
+    levels = [np.asarray(pae, dtype=np.float32)]
+    while levels[-1].shape[0] > tile_size:
+        level = levels[-1]
+        n = level.shape[0]
+        if n % 2:
+            level = np.pad(level, ((0, 1), (0, 1)), mode='edge')
+        m = level.shape[0] // 2
+        levels.append(level.reshape(m, 2, m, 2).mean(axis=(1, 3)))
+    return levels
+
+
+def write_html_bundle(
+    plddts: np.ndarray | Path,
+    workdir: Path,
+    rank: int,
+    pae: np.ndarray | Path = None,
+    max_pae: float = None,
+    tile_size: int = HTML_TILE_SIZE,
+):
+    """Write a compact binary data bundle for the HTML viewer.
+
+    The bundle holds pLDDT (uint8, 0-100) and the coarsest level of a PAE
+    pyramid (uint8, see quantize_pae), so the page can draw an overview
+    without loading the full matrix. Finer levels are written as separate
+    tiles of ``tile_size`` square, which the page fetches on zoom.
+
+    Bundle layout: magic bytes, uint32 (little-endian) header length, JSON
+    header, pLDDT array, coarse PAE level (row-major).
+    """
+    import numpy as np
+    plddts = open_array(plddts)
+    if pae is not None:
+        pae = open_array(pae)
+    plddt_u8 = np.clip(np.rint(plddts), 0, 100).astype(np.uint8)
+    header = {
+        'version': HTML_BUNDLE_VERSION,
+        'residues': len(plddt_u8),
+        'tile_size': tile_size,
+        'levels': [],
+    }
+    coarse = b''
+    if pae is not None:
+        levels = pae_pyramid(pae, tile_size)
+        _, scale = quantize_pae(levels[0], max_pae=max_pae)
+        header['pae_scale'] = scale
+        header['max_pae'] = float(scale * 255)
+        for ix, level in enumerate(levels):
+            quantised, _ = quantize_pae(level, max_pae=scale * 255)
+            n = quantised.shape[0]
+            header['levels'].append({
+                'size': n,
+                'tiles': -(-n // tile_size),
+            })
+            if ix == len(levels) - 1:
+                coarse = quantised.tobytes()
+                break
+            for row in range(0, n, tile_size):
+                for col in range(0, n, tile_size):
+                    path = workdir / OUTPUTS['html_tile'].format(
+                        rank=rank,
+                        level=ix,
+                        row=row // tile_size,
+                        col=col // tile_size,
+                    )
+                    path.parent.mkdir(parents=True, exist_ok=True)
+                    tile = quantised[row:row + tile_size, col:col + tile_size]
+                    path.write_bytes(np.ascontiguousarray(tile).tobytes())
+
+    header_bytes = json.dumps(header).encode()
+    path = workdir / OUTPUTS['html_bundle'].format(rank=rank)
+    with open(path, 'wb') as f:
+        f.write(HTML_BUNDLE_MAGIC)
+        f.write(struct.pack('<I', len(header_bytes)))
+        f.write(header_bytes)
+        f.write(plddt_u8.tobytes())
+        f.write(coarse)
+
+
+def build_stages(settings: Settings, array_dir: Path = None) -> List[Stage]:
+    """Build the output stage graph for the given settings.
+
+    Stages are listed in the order they are run with a single worker. Model
+    array sidecars are written to ``array_dir``, if given.
+    """
+    stages = []
+    workdir = settings.workdir
     if not settings.msa_only:
         context = ExecutionContext(settings)
         ranking = ResultRanking(context)
-        write_confidence_scores(ranking, context)
-        rekey_relax_metrics(ranking, context)
-        template_html(context)
+        store = ModelResultStore(
+            ranking, context, load=False, array_dir=array_dir)
+        model_inputs = [context.ranking_debug] + context.model_pkl_paths
+        ranks = range(len(context.model_pkl_paths))
+
+        def ranked(key, **kwargs):
+            return [
+                workdir / OUTPUTS[key].format(rank=rank, **kwargs)
+                for rank in ranks
+            ]
+
+        def model_stage(name, func, outputs, options=None):
+            return Stage(
+                name, func, ranking, context, store,
+                requires=['models'],
+                inputs=model_inputs,
+                outputs=outputs,
+                options=options,
+            )
+
+        stages += [
+            Stage('models', store.load, on_demand=True),
+            model_stage(
+                'confidence_scores',
+                write_confidence_scores,
+                [workdir / OUTPUTS['model_confidence_scores']],
+            ),
+            Stage(
+                'relax', rekey_relax_metrics, ranking, context,
+                inputs=[context.ranking_debug, context.relax_metrics],
+                outputs=[workdir / OUTPUTS['relax']],
+            ),
+            Stage(
+                'html', template_html, context,
+                inputs=[HTML_PATH] + context.model_pkl_paths,
+                outputs=[settings.output_dir / HTML_OUTPUT_FILENAME],
+            ),
+        ]
 
         # Optional outputs
         if settings.output_model_pkls:
-            rename_model_pkls(ranking, context)
+            stages.append(model_stage(
+                'pkls', rename_model_pkls,
+                ranked('model_pkl')
+                + [workdir / OUTPUTS['model_pkl_manifest']],
+                {'link': settings.pkl_link_strategies}))
+        if settings.output_slim_pkls:
+            stages.append(model_stage(
+                'slim_pkls', slim_model_pkls,
+                ranked('model_slim') + ranked('model_slim_meta')))
         if settings.output_model_plots:
-            plddt_pae_plots(ranking, context)
+            stages.append(model_stage(
+                'plots', plddt_pae_plots, ranked('model_plot')))
         if settings.output_pae:
             # Only created by monomer_ptm and multimer models
-            extract_pae_to_csv(ranking, context)
+            stages.append(model_stage(
+                'pae', export_pae,
+                [
+                    path
+                    for fmt in settings.pae_formats
+                    for path in ranked(PAE_FORMATS[fmt])
+                ],
+                {
+                    'formats': settings.pae_formats,
+                    'precision': settings.pae_precision,
+                }))
+        if settings.output_interface_scores:
+            stages.append(Stage(
+                'interface_scores', write_interface_scores,
+                ranking, context, store,
+                requires=['models'],
+                inputs=model_inputs + [settings.input_fasta],
+                outputs=(
+                    [workdir / OUTPUTS['interface_scores']]
+                    if settings.is_multimer else []),
+            ))
+        if settings.output_html_bundle:
+            stages.append(model_stage(
+                'html_bundles', html_bundles, ranked('html_bundle')))
         if settings.output_residue_scores:
-            write_per_residue_scores(ranking, context)
+            stages.append(model_stage(
+                'plddts', write_per_residue_scores,
+                [workdir / OUTPUTS['plddts']]))
         if settings.plot_msa:
-            plot_msa(settings.workdir)
+            stages.append(Stage(
+                'msa_plot', plot_msa, workdir, cpu_bound=True,
+                inputs=[workdir / 'features.pkl'],
+                outputs=[workdir / OUTPUTS['msa']]))
+        if settings.msa_stats:
+            stages.append(Stage(
+                'msa_stats', write_msa_stats, workdir,
+                max_sequences=settings.msa_stats_max_sequences,
+                cpu_bound=True,
+                options={'max_sequences': settings.msa_stats_max_sequences},
+                inputs=[workdir / 'features.pkl'],
+                outputs=[workdir / OUTPUTS['msa_stats']]))
     if settings.collect_msas or settings.msa_only:
-        collect_msas(settings)
+        msa_dir = workdir / 'msas'
+        stages.append(Stage(
+            'msas', collect_msas, settings,
+            inputs=[settings.input_fasta] + sorted(
+                path for path in msa_dir.rglob('*') if path.is_file()),
+            outputs=[path for _, path in msa_archives(settings)],
+            options={
+                'format': settings.msa_archive_format,
+                'level': settings.msa_compression_level,
+            }))
+    return stages
+
+
+def run_workdir(settings: Settings, executors: StageExecutors = None):
+    """Generate additional outputs for a single alphafold output directory."""
+    start = time.perf_counter()
+    metrics = []
+    status = 'failed'
+
+    def record_metrics(stage_metrics: dict):
+        metrics.append(stage_metrics)
+        write_metrics(
+            settings, metrics, time.perf_counter() - start, status='running')
+
+    try:
+        state = StageState(settings)
+        with model_array_dir(settings) as array_dir:
+            stages = state.skip_unchanged(build_stages(settings, array_dir))
+            run_stages(
+                stages,
+                workers=settings.workers,
+                on_complete=state.record,
+                executors=executors,
+                on_metrics=record_metrics,
+            )
+        status = 'complete'
+    finally:
+        write_metrics(
+            settings, metrics, time.perf_counter() - start, status=status)
+
+
+def run_batch(settings: Settings) -> bool:
+    """Generate additional outputs for each workdir in turn.
+
+    Workdirs are processed one at a time, sharing one set of worker pools,
+    so memory use is bounded as for a single run. A workdir that fails is
+    reported in the summary and does not stop the batch.
+
+    Returns True if all workdirs succeeded.
+    """
+    results = []
+    executors = None
+    if settings.workers > 1:
+        executors = StageExecutors(
+            settings.workers, max_tasks_per_child=BATCH_MAX_TASKS_PER_CHILD)
+    try:
+        for i, workdir in enumerate(settings.workdirs):
+            print(f"[{i + 1}/{len(settings.workdirs)}] Processing {workdir}")
+            start = time.perf_counter()
+            error = ''
+            try:
+                run_workdir(settings.for_workdir(workdir), executors)
+            except Exception as exc:
+                traceback.print_exc()
+                error = f"{type(exc).__name__}: {exc}"
+                if isinstance(exc, BrokenProcessPool):
+                    executors.shutdown()
+                    executors = StageExecutors(
+                        settings.workers,
+                        max_tasks_per_child=BATCH_MAX_TASKS_PER_CHILD)
+            results.append([
+                str(workdir),
+                'failed' if error else 'ok',
+                f'{time.perf_counter() - start:.2f}',
+                ' '.join(error.split()),
+            ])
+    finally:
+        if executors:
+            executors.shutdown()
+
+    with open(settings.summary_path, 'w') as f:
+        f.write('\t'.join(['workdir', 'status', 'wall_time_s', 'error']))
+        f.write('\n')
+        for row in results:
+            f.write('\t'.join(row) + '\n')
+    failed = [row for row in results if row[1] == 'failed']
+    print(
+        f"Batch complete: {len(results) - len(failed)} succeeded,"
+        f" {len(failed)} failed. Summary written to {settings.summary_path}")
+    for row in failed:
+        print(f"  {row[0]}: {row[3]}")
+    return not failed
+
+
+def main():
+    """Parse output files and generate additional output files."""
+    settings = Settings()
+    if settings.batch:
+        if not run_batch(settings):
+            sys.exit(1)
+    else:
+        run_workdir(settings)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,221 @@
+"""Estimate the resources an AlphaFold job will need from its input.
+
+Estimates are polynomial functions of the number of tokens (residues, summed
+over all chains) and of the unique chains that need an MSA search. For
+monomer batches (validate_fasta.py --batch), targets are folded one at a time
+so memory is estimated from the longest target:
+
+    peak GPU memory (GB)   = a + b * tokens + c * tokens ** 2
+    peak host memory (GB)  = a + b * tokens
+    MSA search (minutes)   = a * unique chains + b * unique residues
+
+The coefficients are held in a model table (see DEFAULT_MODEL), which can be
+refitted from the metrics of previous jobs. The metrics file is a TSV with a
+header row and the columns:
+
+    model_preset  db_preset  tokens  unique_chains  unique_residues
+    peak_gpu_memory_gb  peak_host_memory_gb  msa_search_minutes
+
+Empty cells are ignored when fitting the corresponding quantity.
+
+Example usage:
+
+  # Refit the default model table from job metrics
+  python resource_estimate.py refit job_metrics.tsv -o resource_model.json
+
+  # Use the refitted table when validating input
+  python validate_fasta.py input.fasta --resource-estimate resources.json \\
+      --resource-model resource_model.json
+"""
+
+import argparse
+import csv
+import json
+import sys
+from pathlib import Path
+from typing import List
+
+MODEL_VERSION = 1
+
+# Initial coefficients, approximated from AlphaFold 2.3 runs on A100 GPUs.
+# These should be refitted from local job metrics.
+DEFAULT_MODEL = {
+    'version': MODEL_VERSION,
+    # Memory of the target GPU, above which unified memory is required
+    'gpu_memory_gb': 40,
+    'models': {
+        'monomer': {
+            'peak_gpu_memory_gb': [2.0, 0.0, 2.2e-6],
+            'peak_host_memory_gb': [6.0, 0.004],
+            'msa_search_minutes': {
+                'reduced': [8.0, 0.02],
+                'full': [25.0, 0.05],
+            },
+        },
+        'multimer': {
+            'peak_gpu_memory_gb': [3.0, 0.0, 3.0e-6],
+            'peak_host_memory_gb': [8.0, 0.006],
+            'msa_search_minutes': {
+                'reduced': [15.0, 0.03],
+                'full': [40.0, 0.07],
+            },
+        },
+    },
+}
+
+# Terms of each fitted quantity, given tokens, unique chains and residues
+TERMS = {
+    'peak_gpu_memory_gb': lambda n, c, r: [1, n, n ** 2],
+    'peak_host_memory_gb': lambda n, c, r: [1, n],
+    'msa_search_minutes': lambda n, c, r: [c, r],
+}
+
+
+def load_model(path: Path = None) -> dict:
+    if not path:
+        return DEFAULT_MODEL
+    with open(path) as f:
+        model = json.load(f)
+    if model.get('version') != MODEL_VERSION:
+        raise ValueError(
+            f"Unsupported resource model version: {model.get('version')}")
+    return model
+
+
+def evaluate(coefficients: List[float], terms: List[float]) -> float:
+    return max(0.0, sum(c * t for c, t in zip(coefficients, terms)))
+
+
+def estimate_resources(
+    sequences: List[str],
+    multimer: bool,
+    db_preset: str = 'reduced',
+    model: dict = None,
+) -> dict:
+    """Return the estimated resources for a job with these sequences."""
+    model = model or DEFAULT_MODEL
+    model_preset = 'multimer' if multimer else 'monomer'
+    coefficients = model['models'][model_preset]
+    unique = set(sequences)
+    tokens = sum(len(seq) for seq in sequences)
+    max_chain_length = max((len(seq) for seq in sequences), default=0)
+    # Monomer batches fold one target at a time
+    folded_tokens = tokens if multimer else max_chain_length
+    terms = {
+        key: func(folded_tokens, len(unique), sum(len(seq) for seq in unique))
+        for key, func in TERMS.items()
+    }
+    peak_gpu_memory_gb = evaluate(
+        coefficients['peak_gpu_memory_gb'], terms['peak_gpu_memory_gb'])
+    return {
+        'version': MODEL_VERSION,
+        'model_preset': model_preset,
+        'db_preset': db_preset,
+        'tokens': tokens,
+        'chains': len(sequences),
+        'unique_chains': len(unique),
+        'max_chain_length': max_chain_length,
+        'peak_gpu_memory_gb': round(peak_gpu_memory_gb, 1),
+        'peak_host_memory_gb': round(evaluate(
+            coefficients['peak_host_memory_gb'],
+            terms['peak_host_memory_gb']), 1),
+        'msa_search_minutes': round(evaluate(
+            coefficients['msa_search_minutes'][db_preset],
+            terms['msa_search_minutes']), 1),
+        'gpu_memory_gb': model['gpu_memory_gb'],
+        'unified_memory_required': (
+            peak_gpu_memory_gb > model['gpu_memory_gb']),
+    }
+
+
+def read_metrics(path: Path) -> List[dict]:
+    with open(path, newline='') as f:
+        return list(csv.DictReader(f, delimiter='\t'))
+
+
+def fit(rows: List[dict], key: str, previous: List[float]) -> List[float]:
+    """Fit one quantity by least squares, unless there are too few rows."""
+    import numpy as np
+
+    terms, values = [], []
+    for row in rows:
+        if not row.get(key):
+            continue
+        terms.append(TERMS[key](
+            float(row['tokens']),
+            float(row['unique_chains']),
+            float(row['unique_residues']),
+        ))
+        values.append(float(row[key]))
+    if len(values) < len(previous):
+        return previous
+    coefficients, *_ = np.linalg.lstsq(
+        np.array(terms), np.array(values), rcond=None)
+    return [float(c) for c in coefficients]
+
+
+def refit(rows: List[dict], model: dict) -> dict:
+    """Return a copy of the model table refitted to the given job metrics."""
+    model = json.loads(json.dumps(model))
+    for model_preset, coefficients in model['models'].items():
+        preset_rows = [r for r in rows if r['model_preset'] == model_preset]
+        for key in ('peak_gpu_memory_gb', 'peak_host_memory_gb'):
+            coefficients[key] = fit(preset_rows, key, coefficients[key])
+        for db_preset, previous in coefficients['msa_search_minutes'].items():
+            coefficients['msa_search_minutes'][db_preset] = fit(
+                [r for r in preset_rows if r['db_preset'] == db_preset],
+                'msa_search_minutes',
+                previous,
+            )
+    return model
+
+
+def main():
+    args = parse_args()
+    model = refit(read_metrics(args.metrics), load_model(args.model))
+    if args.gpu_memory_gb:
+        model['gpu_memory_gb'] = args.gpu_memory_gb
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(model, f, indent=2)
+    else:
+        json.dump(model, sys.stdout, indent=2)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    refit_parser = subparsers.add_parser(
+        'refit', help="Refit the model table from job metrics")
+    refit_parser.add_argument(
+        "metrics",
+        help="TSV of job metrics (see above)",
+        type=Path,
+    )
+    refit_parser.add_argument(
+        "--model",
+        help="Model table to refit (default: built-in table)",
+        default=None,
+        type=Path,
+    )
+    refit_parser.add_argument(
+        "--gpu-memory-gb",
+        dest='gpu_memory_gb',
+        help="Memory of the target GPU, above which unified memory is needed",
+        default=None,
+        type=float,
+    )
+    refit_parser.add_argument(
+        "-o", "--output",
+        help="Write the refitted table here (default: stdout)",
+        default=None,
+        type=Path,
+    )
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,66 +1,116 @@
 """Validate input FASTA sequence."""
 
 import argparse
+import json
 import re
 import sys
-from typing import List
+from pathlib import Path
+from typing import Iterable, Iterator, List
 
 DEFAULT_MAX_SEQUENCE_COUNT = 10
+DEFAULT_MAX_BATCH_SEQUENCE_COUNT = 100
+DEFAULT_BATCH_MAX_RESIDUES = 5000
+BATCH_MANIFEST = 'batches.json'
 STRIP_SEQUENCE_CHARS = ['\n', '\r', '\t', ' ']
+STRIP_SEQUENCE_TABLE = str.maketrans('', '', ''.join(STRIP_SEQUENCE_CHARS))
+# Pasted text has newlines and '>' escaped by Galaxy
+ESCAPED_NEWLINE = '__cn__'
+HEADER_CARETS = ('>', '__gt__')
+# Further violations are counted but not listed in the error message
+MAX_REPORTED_ERRORS = 50
 
 
 class Fasta:
-    def __init__(self, header_str: str, seq_str: str):
+    def __init__(self, header_str: str, seq_str: str, truncated=False):
         self.header = header_str
         self.sequence = seq_str
+        # Loading stopped part way through this sequence (see FastaLoader)
+        self.truncated = truncated
 
 
 class FastaLoader:
-    def __init__(self, fasta_path: str):
-        """Initialize from FASTA file."""
+    def __init__(
+        self,
+        fasta_path: str,
+        max_sequence_count: int = None,
+        max_length: int = None,
+    ):
+        """Initialize from FASTA file.
+
+        Loading stops once more than ``max_sequence_count`` sequences have
+        been read, or a sequence exceeds ``max_length``, as the input will
+        fail validation regardless of the remaining content.
+        """
         self.fastas = []
+        self.max_sequence_count = (
+            max_sequence_count
+            or DEFAULT_MAX_SEQUENCE_COUNT)
+        self.max_length = max_length
         self.load(fasta_path)
 
     def load(self, fasta_path: str):
-        """Load bare or FASTA formatted sequence."""
-        with open(fasta_path, 'r') as f:
-            self.content = f.read()
-
-        if "__cn__" in self.content:
-            # Pasted content with escaped characters
-            self.newline = '__cn__'
-            self.read_caret = '__gt__'
-        else:
-            # Uploaded file with normal content
-            self.newline = '\n'
-            self.read_caret = '>'
+        """Load bare or FASTA formatted sequence.
 
-        self.lines = self.content.split(self.newline)
-
-        if not self.lines[0].startswith(self.read_caret):
+        The file is read line by line and each sequence is joined from its
+        lines once complete, so that large inputs are not held in memory.
+        """
+        with open(fasta_path, 'r') as f:
+            lines = self.iter_lines(f)
+            first_line = next(lines, None)
+            if first_line is None:
+                return
             # Fasta is headless, load as single sequence
-            self.update_fastas(
-                '', ''.join(self.lines)
-            )
-
-        else:
+            headless = not first_line.startswith(HEADER_CARETS)
             header = None
-            sequence = None
-            for line in self.lines:
-                if line.startswith(self.read_caret):
-                    if header:
-                        self.update_fastas(header, sequence)
+            parts = []
+            length = 0
+            for line in self.chain_lines(first_line, lines):
+                if not headless and line.startswith(HEADER_CARETS):
+                    if not self.update_fastas(header, ''.join(parts)):
+                        return
                     header = '>' + self.strip_header(line)
-                    sequence = ''
+                    parts = []
+                    length = 0
                 else:
-                    sequence += line.strip('\n ')
-            self.update_fastas(header, sequence)
+                    part = line.translate(STRIP_SEQUENCE_TABLE)
+                    parts.append(part)
+                    length += len(part)
+                    if self.max_length and length > self.max_length:
+                        self.update_fastas(
+                            header, ''.join(parts), truncated=True)
+                        return
+            self.update_fastas(header, ''.join(parts))
+
+    @staticmethod
+    def iter_lines(f: Iterable[str]) -> Iterator[str]:
+        """Iterate over lines, splitting pasted text on escaped newlines."""
+        for line in f:
+            if ESCAPED_NEWLINE in line:
+                for part in line.split(ESCAPED_NEWLINE):
+                    yield part.rstrip('\r\n')
+            else:
+                yield line.rstrip('\r\n')
+
+    @staticmethod
+    def chain_lines(first_line: str, lines: Iterator[str]) -> Iterator[str]:
+        yield first_line
+        yield from lines
 
     def strip_header(self, line):
         """Strip characters escaped with underscores from pasted text."""
         return re.sub(r'\_\_.{2}\_\_', '', line).strip('>')
 
-    def update_fastas(self, header: str, sequence: str):
+    def update_fastas(
+        self,
+        header: str,
+        sequence: str,
+        truncated: bool = False,
+    ) -> bool:
+        """Add a sequence to the loaded FASTAs.
+
+        Returns False once more than the maximum number of sequences have
+        been loaded.
+        """
         # if we have a sequence
         if sequence:
             # create generic header if not exists
@@ -68,11 +118,9 @@ class FastaLoader:
                 fasta_count = len(self.fastas)
                 header = f'>sequence_{fasta_count}'
 
-            for char in STRIP_SEQUENCE_CHARS:
-                sequence = sequence.replace(char, '')
-
             # Create new Fasta
-            self.fastas.append(Fasta(header, sequence))
+            self.fastas.append(Fasta(header, sequence, truncated))
+        return len(self.fastas) <= self.max_sequence_count
 
 
 class FastaValidator:
@@ -82,8 +130,10 @@ class FastaValidator:
         max_length=None,
         multiple=False,
         max_sequence_count=None,
+        batch=False,
     ):
         self.multiple = multiple
+        self.batch = batch
         self.min_length = min_length
         self.max_length = max_length
         self.iupac_characters = {
@@ -92,27 +142,55 @@ class FastaValidator:
             'Q', 'R', 'S', 'T', 'U', 'V', 'W', 'X',
             'Y', 'Z', '-'
         }
+        self.invalid_char_re = re.compile(
+            '[^' + re.escape(''.join(sorted(self.iupac_characters))) + ']')
         self.max_sequence_count = (
             max_sequence_count
             or DEFAULT_MAX_SEQUENCE_COUNT)
 
     def validate(self, fasta_list: List[Fasta]):
-        """Perform FASTA validation."""
+        """Perform FASTA validation.
+
+        Every sequence is checked, and all length and alphabet violations
+        are reported together in a single error.
+        """
         self.fasta_list = fasta_list
         self.validate_num_seqs()
-        self.validate_length()
-        self.validate_alphabet()
+        errors = self.validate_length() + self.validate_alphabet()
         # not checking for 'X' nucleotides at the moment.
         # alphafold can throw an error if it doesn't like it.
         # self.validate_x()
+        if errors:
+            self.raise_errors(errors)
         return self.fasta_list
 
+    def raise_errors(self, errors: List[str]):
+        """Raise a single error listing (up to MAX_REPORTED_ERRORS) errors."""
+        lines = [f' {error}' for error in errors[:MAX_REPORTED_ERRORS]]
+        if len(errors) > MAX_REPORTED_ERRORS:
+            lines.append(
+                f' ...and {len(errors) - MAX_REPORTED_ERRORS} more errors.')
+        raise ValueError(
+            'Error encountered validating FASTA:\n' + '\n'.join(lines))
+
     def validate_num_seqs(self) -> None:
         """Assert that only one sequence has been provided."""
         fasta_count = len(self.fasta_list)
 
-        if self.multiple:
-            if fasta_count < 2:
+        if self.batch:
+            if fasta_count == 0:
+                raise ValueError(
+                    'Error encountered validating FASTA:\n'
+                    ' no FASTA sequences detected in input file.')
+            elif fasta_count > self.max_sequence_count:
+                raise ValueError(
+                    'WARNING: detected more than the maximum of'
+                    f' {self.max_sequence_count} sequences allowed.')
+        elif self.multiple:
+            if fasta_count < 2 and not (
+                # A single sequence too long to load is reported by length
+                fasta_count and self.fasta_list[0].truncated
+            ):
                 raise ValueError(
                     'Error encountered validating FASTA:\n'
                     'Multimer mode requires multiple input sequence.'
@@ -121,9 +199,8 @@ class FastaValidator:
 
             elif fasta_count > self.max_sequence_count:
                 raise ValueError(
-                    f'WARNING: detected {fasta_count} sequences but the'
-                    f' maximum allowed is {self.max_sequence_count}'
-                    ' sequences.')
+                    'WARNING: detected more than the maximum of'
+                    f' {self.max_sequence_count} sequences allowed.')
         else:
             if fasta_count > 1:
                 sys.stderr.write(
@@ -136,33 +213,42 @@ class FastaValidator:
                     'Error encountered validating FASTA:\n'
                     ' no FASTA sequences detected in input file.')
 
-    def validate_length(self):
-        """Confirm whether sequence length is valid."""
-        fasta = self.fasta_list[0]
-        if self.min_length:
-            if len(fasta.sequence) < self.min_length:
-                raise ValueError(
-                    'Error encountered validating FASTA:\n Sequence too short'
-                    f' ({len(fasta.sequence)}AA).'
-                    f' Minimum length is {self.min_length}AA.')
-        if self.max_length:
-            if len(fasta.sequence) > self.max_length:
-                raise ValueError(
-                    'Error encountered validating FASTA:\n'
-                    f' Sequence too long ({len(fasta.sequence)}AA).'
-                    f' Maximum length is {self.max_length}AA.')
-
-    def validate_alphabet(self):
-        """Confirm whether the sequence conforms to IUPAC codes.
-
-        If not, report the offending character and its position.
+    def validate_length(self) -> List[str]:
+        """Return errors for sequences of invalid length."""
+        errors = []
+        for fasta in self.fasta_list:
+            if self.min_length:
+                if len(fasta.sequence) < self.min_length:
+                    errors.append(
+                        f'{fasta.header}: Sequence too short'
+                        f' ({len(fasta.sequence)}AA).'
+                        f' Minimum length is {self.min_length}AA.')
+            if self.max_length:
+                if len(fasta.sequence) > self.max_length:
+                    length = (
+                        f'over {self.max_length}'
+                        if fasta.truncated
+                        else len(fasta.sequence))
+                    errors.append(
+                        f'{fasta.header}: Sequence too long ({length}AA).'
+                        f' Maximum length is {self.max_length}AA.')
+        return errors
+
+    def validate_alphabet(self) -> List[str]:
+        """Return errors for characters that are not IUPAC codes.
+
+        Each error reports the sequence, the offending character and its
+        position. Sequences are scanned with a single regex pass each.
         """
-        fasta = self.fasta_list[0]
-        for i, char in enumerate(fasta.sequence.upper()):
-            if char not in self.iupac_characters:
-                raise ValueError(
-                    'Error encountered validating FASTA:\n Invalid amino acid'
-                    f' found at pos {i}: "{char}"')
+        errors = []
+        for fasta in self.fasta_list:
+            for match in self.invalid_char_re.finditer(
+                fasta.sequence.upper()
+            ):
+                errors.append(
+                    f'{fasta.header}: Invalid amino acid'
+                    f' found at pos {match.start()}: "{match.group()}"')
+        return errors
 
     def validate_x(self):
         """Check for X bases."""
@@ -178,11 +264,12 @@ class FastaWriter:
     def __init__(self) -> None:
         self.line_wrap = 60
 
-    def write(self, fasta: Fasta):
+    def write(self, fasta: Fasta, out=None):
+        out = out or sys.stdout
         header = fasta.header
         seq = self.format_sequence(fasta.sequence)
-        sys.stdout.write(header + '\n')
-        sys.stdout.write(seq)
+        out.write(header + '\n')
+        out.write(seq)
 
     def format_sequence(self, sequence: str):
         formatted_seq = ''
@@ -191,11 +278,103 @@ class FastaWriter:
         return formatted_seq.upper()
 
 
+class FastaBatcher:
+    """Pack monomer targets into batches to run in a single AlphaFold job.
+
+    Identical sequences are folded once. Targets are sorted by length and
+    packed in order, so that each batch holds targets of similar length, up
+    to a budget of residues per batch. AlphaFold monomer accepts only one
+    sequence per FASTA file, so each batch is written as a directory of
+    single-sequence FASTA files, to be passed together as --fasta_paths.
+    """
+
+    def __init__(self, max_residues: int = DEFAULT_BATCH_MAX_RESIDUES):
+        self.max_residues = max_residues
+
+    def dedupe(self, fasta_list: List[Fasta]) -> List[dict]:
+        """Return unique targets, recording the headers of duplicates."""
+        targets = {}
+        for i, fasta in enumerate(fasta_list):
+            sequence = fasta.sequence.upper()
+            if sequence in targets:
+                targets[sequence]['duplicates'].append(fasta.header)
+            else:
+                targets[sequence] = {
+                    'name': self.target_name(i, fasta.header),
+                    'fasta': fasta,
+                    'duplicates': [],
+                }
+        return list(targets.values())
+
+    @staticmethod
+    def target_name(index: int, header: str) -> str:
+        """Return a file name for the target (also its output dir name)."""
+        words = header.lstrip('>').split()
+        name = re.sub(r'[^\w.-]', '_', words[0])[:50] if words else ''
+        return f'{index + 1:03d}_{name}' if name else f'{index + 1:03d}'
+
+    def batch(self, fasta_list: List[Fasta]) -> List[List[dict]]:
+        targets = sorted(
+            self.dedupe(fasta_list),
+            key=lambda t: len(t['fasta'].sequence))
+        batches = []
+        residues = 0
+        for target in targets:
+            length = len(target['fasta'].sequence)
+            if not batches or residues + length > self.max_residues:
+                batches.append([])
+                residues = 0
+            batches[-1].append(target)
+            residues += length
+        return batches
+
+    def write(self, fasta_list: List[Fasta], batch_dir: str) -> dict:
+        """Write FASTA files for each batch and a manifest to batch_dir."""
+        batch_dir = Path(batch_dir)
+        writer = FastaWriter()
+        manifest = {
+            'max_residues': self.max_residues,
+            'sequences': len(fasta_list),
+            'batches': [],
+        }
+        for i, batch in enumerate(self.batch(fasta_list)):
+            name = f'batch_{i + 1:03d}'
+            (batch_dir / name).mkdir(parents=True, exist_ok=True)
+            fasta_paths = []
+            for target in batch:
+                path = batch_dir / name / f"{target['name']}.fasta"
+                with open(path, 'w') as f:
+                    writer.write(target['fasta'], f)
+                fasta_paths.append(str(path))
+            manifest['batches'].append({
+                'name': name,
+                'residues': sum(len(t['fasta'].sequence) for t in batch),
+                'max_length': len(batch[-1]['fasta'].sequence),
+                'fasta_paths': fasta_paths,
+                'targets': [
+                    {
+                        'name': target['name'],
+                        'header': target['fasta'].header,
+                        'length': len(target['fasta'].sequence),
+                        'duplicates': target['duplicates'],
+                    }
+                    for target in batch
+                ],
+            })
+        with open(batch_dir / BATCH_MANIFEST, 'w') as f:
+            json.dump(manifest, f, indent=2)
+        return manifest
+
+
 def main():
     # load fasta file
     try:
         args = parse_args()
-        fas = FastaLoader(args.input)
+        fas = FastaLoader(
+            args.input,
+            max_sequence_count=args.max_sequence_count,
+            max_length=args.max_length,
+        )
 
         # validate
         fv = FastaValidator(
@@ -203,6 +382,7 @@ def main():
             max_length=args.max_length,
             multiple=args.multimer,
             max_sequence_count=args.max_sequence_count,
+            batch=args.batch,
         )
         clean_fastas = fv.validate(fas.fastas)
 
@@ -216,6 +396,18 @@ def main():
             sys.stderr.write(fas.header + '\n')
             sys.stderr.write(fas.sequence + '\n\n')
 
+        if args.batch:
+            manifest = FastaBatcher(args.batch_max_residues).write(
+                clean_fastas, args.batch_dir)
+            sys.stderr.write(
+                f"Packed {len(clean_fastas)} sequence(s) into"
+                f" {len(manifest['batches'])} batch(es) in {args.batch_dir}"
+                "\n\n")
+        if args.msa_store:
+            write_reuse_manifest(args, clean_fastas)
+        if args.resource_estimate:
+            write_resource_estimate(args, clean_fastas)
+
     except ValueError as exc:
         sys.stderr.write(f"{exc}\n\n")
         raise exc
@@ -227,6 +419,38 @@ def main():
         raise exc
 
 
+def write_reuse_manifest(args: argparse.Namespace, fastas: List[Fasta]):
+    """Look up validated sequences in the MSA store (see msa_store.py)."""
+    from msa_store import MsaStore, build_manifest
+
+    store = MsaStore(args.msa_store, args.msa_store_namespace)
+    manifest = build_manifest(
+        store,
+        [fas.sequence for fas in fastas],
+        multimer=args.multimer,
+    )
+    with open(args.reuse_manifest, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    cached = [c for c in manifest['chains'] if c['cached']]
+    sys.stderr.write(
+        f"Found cached MSAs for {len(cached)} of {len(fastas)} sequence(s)"
+        f" in MSA store {args.msa_store}\n")
+
+
+def write_resource_estimate(args: argparse.Namespace, fastas: List[Fasta]):
+    """Estimate job resources (see resource_estimate.py)."""
+    from resource_estimate import estimate_resources, load_model
+
+    estimate = estimate_resources(
+        [fas.sequence.upper() for fas in fastas],
+        multimer=args.multimer,
+        db_preset=args.db_preset,
+        model=load_model(args.resource_model),
+    )
+    with open(args.resource_estimate, 'w') as f:
+        json.dump(estimate, f, indent=2)
+
+
 def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser()
     parser.add_argument(
@@ -260,7 +484,89 @@ def parse_args() -> argparse.Namespace:
         action='store_true',
         help="Require multiple input sequences",
     )
-    return parser.parse_args()
+    parser.add_argument(
+        "--msa-store",
+        dest='msa_store',
+        help=(
+            "Directory of an MSA store to look up validated sequences in."
+            " A reuse manifest is written for msa_store.py"),
+        default=None,
+        type=str,
+    )
+    parser.add_argument(
+        "--msa-store-namespace",
+        dest='msa_store_namespace',
+        help=(
+            "MSA store namespace, which should identify the AlphaFold"
+            " version, databases and model preset"),
+        default='default',
+        type=str,
+    )
+    parser.add_argument(
+        "--reuse-manifest",
+        dest='reuse_manifest',
+        help="Path of the MSA reuse manifest (default: msa_reuse.json)",
+        default='msa_reuse.json',
+        type=str,
+    )
+    parser.add_argument(
+        "--resource-estimate",
+        dest='resource_estimate',
+        help="Write an estimate of the job's resource usage to this JSON file",
+        default=None,
+        type=str,
+    )
+    parser.add_argument(
+        "--resource-model",
+        dest='resource_model',
+        help=(
+            "Model table for the resource estimate, as written by"
+            " resource_estimate.py refit (default: built-in table)"),
+        default=None,
+        type=str,
+    )
+    parser.add_argument(
+        "--db-preset",
+        dest='db_preset',
+        help="AlphaFold database preset, for the resource estimate",
+        choices=['reduced', 'full'],
+        default='reduced',
+    )
+    parser.add_argument(
+        "--batch",
+        action='store_true',
+        help=(
+            "Batch monomer mode: keep every sequence and pack them into"
+            " batches of single-sequence FASTA files (see --batch-dir)"),
+    )
+    parser.add_argument(
+        "--batch-max-residues",
+        dest='batch_max_residues',
+        help=(
+            "Maximum total residues per batch"
+            f" (default: {DEFAULT_BATCH_MAX_RESIDUES})"),
+        default=DEFAULT_BATCH_MAX_RESIDUES,
+        type=int,
+    )
+    parser.add_argument(
+        "--batch-dir",
+        dest='batch_dir',
+        help=(
+            "Directory for batch FASTA files and the batch manifest"
+            " (default: batches)"),
+        default='batches',
+        type=str,
+    )
+    args = parser.parse_args()
+    if args.batch:
+        if args.multimer:
+            parser.error("--batch cannot be used with --multimer")
+        if args.msa_store:
+            parser.error("--msa-store is not supported with --batch")
+        args.max_sequence_count = (
+            args.max_sequence_count
+            or DEFAULT_MAX_BATCH_SEQUENCE_COUNT)
+    return args
 
 
 if __name__ == '__main__':
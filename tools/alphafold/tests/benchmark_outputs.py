@@ -0,0 +1,264 @@
+"""Benchmark outputs.py stages against synthetic AlphaFold outputs.
+
+Synthetic multimer working directories are generated for each sequence
+length, and each stage of outputs.py is run in a fresh process so that its
+wall time and peak RSS can be measured in isolation.
+
+Example usage:
+
+  # Run the default benchmark and save the results as a baseline
+  python tests/benchmark_outputs.py --output baseline.json
+
+  # Compare a later run against the baseline (exits 1 on regression)
+  python tests/benchmark_outputs.py --sizes 500 2000 --baseline baseline.json
+
+Synthetic data for 10,000 residues needs ~2.5 GB of disk space.
+"""
+
+import argparse
+import json
+import multiprocessing
+import pickle as pk
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+SCRIPTS_DIR = Path(__file__).resolve().parent.parent / 'scripts'
+DEFAULT_SIZES = [500, 2000, 5000, 10000]
+DEFAULT_MSA_DEPTH = 2048
+DEFAULT_TOLERANCE = 0.25
+# Differences smaller than these are treated as noise, not regressions
+MIN_REGRESSION = {
+    'wall_time_s': 0.5,
+    'peak_rss_mb': 16,
+}
+NUM_MODELS = 5
+MODEL_NAME = 'model_{ix}_multimer_v3_pred_0'
+MSA_FILES = ['uniref90_hits.sto', 'mgnify_hits.sto', 'small_bfd_hits.sto']
+AMINO_ACIDS = 'ACDEFGHIKLMNPQRSTVWY'
+
+# outputs.py flags that enable each benchmarked stage
+STAGES = {
+    'confidence_scores': [],
+    'pae_export': ['--pae'],
+    'plots': ['--plot'],
+    'msa_plot': ['--plot-msa'],
+    'msa_stats': ['--msa-stats'],
+    'msa_zips': ['--msa'],
+}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument(
+        "--sizes", type=int, nargs='+', default=DEFAULT_SIZES,
+        help="Number of residues in each synthetic run")
+    parser.add_argument(
+        "--stages", nargs='+', choices=list(STAGES), default=list(STAGES),
+        help="Stages to benchmark (default: all)")
+    parser.add_argument(
+        "--msa-depth", type=int, default=DEFAULT_MSA_DEPTH,
+        help="Number of sequences in the synthetic features.pkl MSA")
+    parser.add_argument(
+        "--workdir", type=Path, default=None,
+        help="Directory for synthetic data (default: a temp directory)")
+    parser.add_argument(
+        "--keep", action="store_true",
+        help="Keep synthetic data after the benchmark")
+    parser.add_argument(
+        "--output", type=Path, default=None,
+        help="Write results to this JSON file")
+    parser.add_argument(
+        "--baseline", type=Path, default=None,
+        help="Compare results against a previous --output JSON file")
+    parser.add_argument(
+        "--tolerance", type=float, default=DEFAULT_TOLERANCE,
+        help=(
+            "Fractional increase in wall time or peak RSS over the baseline"
+            f" that counts as a regression. Default: {DEFAULT_TOLERANCE}"))
+    return parser.parse_args()
+
+
+def random_sequence(rng, length: int) -> str:
+    return ''.join(rng.choice(list(AMINO_ACIDS), length))
+
+
+def generate_run(root: Path, residues: int, msa_depth: int) -> Path:
+    """Write a synthetic two-chain multimer run and return its workdir.
+
+    The layout matches a Galaxy job: the input FASTA is two directories above
+    the AlphaFold output directory.
+    """
+    rng = np.random.default_rng(residues)
+    workdir = root / 'output' / 'alphafold'
+    workdir.mkdir(parents=True, exist_ok=True)
+
+    chain_lengths = [residues // 2, residues - residues // 2]
+    with open(root / 'alphafold.fasta', 'w') as f:
+        for i, length in enumerate(chain_lengths):
+            f.write(f'>chain_{i}\n{random_sequence(rng, length)}\n')
+
+    names = [MODEL_NAME.format(ix=ix) for ix in range(1, NUM_MODELS + 1)]
+    confidences = {name: float(rng.uniform(0.3, 0.9)) for name in names}
+    order = sorted(names, key=confidences.get, reverse=True)
+    with open(workdir / 'ranking_debug.json', 'w') as f:
+        json.dump({'iptm+ptm': confidences, 'order': order}, f)
+    with open(workdir / 'relax_metrics.json', 'w') as f:
+        json.dump({
+            name: {
+                'remaining_violations': [0.0] * residues,
+                'remaining_violations_count': 0.0,
+            }
+            for name in names
+        }, f)
+
+    for name in names:
+        pae = rng.uniform(0, 31.75, (residues, residues)).astype(np.float32)
+        result = {
+            'plddt': rng.uniform(20, 100, residues),
+            'predicted_aligned_error': pae,
+            'max_predicted_aligned_error': np.float32(31.75),
+            'ptm': np.array(rng.uniform(0.3, 0.9)),
+            'iptm': np.array(rng.uniform(0.3, 0.9)),
+            'ranking_confidence': confidences[name],
+        }
+        with open(workdir / f'result_{name}.pkl', 'wb') as f:
+            pk.dump(result, f, protocol=4)
+        del pae, result
+
+    msa = rng.integers(0, 22, (msa_depth, residues), dtype=np.int32)
+    with open(workdir / 'features.pkl', 'wb') as f:
+        pk.dump({'msa': msa}, f, protocol=4)
+
+    for chain_id, length in zip('AB', chain_lengths):
+        chain_dir = workdir / 'msas' / chain_id
+        chain_dir.mkdir(parents=True, exist_ok=True)
+        for filename in MSA_FILES:
+            with open(chain_dir / filename, 'w') as f:
+                f.write('# STOCKHOLM 1.0\n\n')
+                for i in range(msa_depth):
+                    f.write(f'seq_{i} {random_sequence(rng, length)}\n')
+                f.write('//\n')
+    return workdir
+
+
+def run_stage(workdir: Path, stage: str, queue):
+    """Run a single outputs.py stage and report time and peak RSS.
+
+    Called in a fresh (spawned) process. Timings include loading the model
+    pickles for stages that need them.
+    """
+    sys.path.insert(0, str(SCRIPTS_DIR))
+    import outputs
+
+    sys.argv = ['outputs.py', str(workdir), '--workers', '1'] + STAGES[stage]
+    settings = outputs.Settings()
+    start = time.perf_counter()
+    if stage == 'msa_plot':
+        outputs.plot_msa(settings.workdir)
+    elif stage == 'msa_stats':
+        outputs.write_msa_stats(settings.workdir)
+    elif stage == 'msa_zips':
+        outputs.run_stages([
+            outputs.Stage(stage, outputs.collect_msas, settings)])
+    else:
+        func = {
+            'confidence_scores': outputs.write_confidence_scores,
+            'pae_export': outputs.export_pae,
+            'plots': outputs.plddt_pae_plots,
+        }[stage]
+        context = outputs.ExecutionContext(settings)
+        ranking = outputs.ResultRanking(context)
+        with outputs.model_array_dir(settings) as array_dir:
+            store = outputs.ModelResultStore(
+                ranking, context, array_dir=array_dir)
+            outputs.run_stages([
+                outputs.Stage(stage, func, ranking, context, store)])
+    queue.put({
+        'wall_time_s': time.perf_counter() - start,
+        # ru_maxrss is in KB on Linux
+        'peak_rss_mb': resource.getrusage(
+            resource.RUSAGE_SELF).ru_maxrss / 1024,
+    })
+
+
+def benchmark_stage(workdir: Path, stage: str) -> dict:
+    context = multiprocessing.get_context('spawn')
+    queue = context.Queue()
+    process = context.Process(target=run_stage, args=(workdir, stage, queue))
+    process.start()
+    process.join()
+    if process.exitcode:
+        raise RuntimeError(
+            f"Stage '{stage}' failed with exit code {process.exitcode}")
+    return queue.get()
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """Return a list of regressions relative to the baseline."""
+    regressions = []
+    for size, stages in results.items():
+        for stage, metrics in stages.items():
+            previous = baseline.get(size, {}).get(stage)
+            if not previous:
+                continue
+            for key, value in metrics.items():
+                limit = max(
+                    previous[key] * (1 + tolerance),
+                    previous[key] + MIN_REGRESSION[key],
+                )
+                if value > limit:
+                    regressions.append(
+                        f"{size} residues, {stage}: {key} {value:.2f}"
+                        f" > {limit:.2f} (baseline {previous[key]:.2f})")
+    return regressions
+
+
+def main():
+    args = parse_args()
+    root = args.workdir or Path(tempfile.mkdtemp(prefix='af-outputs-bench-'))
+    results = {}
+    try:
+        for size in args.sizes:
+            print(f"Generating synthetic run with {size} residues...")
+            workdir = generate_run(root / str(size), size, args.msa_depth)
+            results[str(size)] = {}
+            for stage in args.stages:
+                metrics = benchmark_stage(workdir, stage)
+                results[str(size)][stage] = metrics
+                print(
+                    f"  {stage:<20} {metrics['wall_time_s']:>8.2f} s"
+                    f" {metrics['peak_rss_mb']:>10.1f} MB")
+            if not args.keep:
+                shutil.rmtree(root / str(size))
+    finally:
+        if not args.keep and args.workdir is None:
+            shutil.rmtree(root, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print("FAIL: performance regressions detected:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print("PASS: no regressions against baseline")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env bash
+
+# Check that MSAs stored after one run are found by validate_fasta.py and
+# seeded into the output directory of the next run.
+
+set -e
+
+# Check PWD
+if [[ "$PWD" == *"/tests" ]]; then
+  cd ..
+fi
+
+TMP_DIR=$(mktemp -d)
+trap 'rm -rf "$TMP_DIR"' EXIT
+STORE=$TMP_DIR/store
+
+validate() {
+  python scripts/validate_fasta.py test-data/multimer.fasta \
+      --multimer \
+      --msa-store $STORE \
+      --msa-store-namespace 2.3_reduced_dbs_multimer \
+      --reuse-manifest $1 \
+      > $TMP_DIR/alphafold.fasta \
+      2> $TMP_DIR/stderr
+}
+
+count_cached() {
+  python -c "import json, sys; print(sum(bool(c['cached'])
+    for c in json.load(open(sys.argv[1]))['chains']))" $1
+}
+
+echo "Testing lookup in an empty store..."
+validate $TMP_DIR/run1.json
+if [ "$(count_cached $TMP_DIR/run1.json)" != "0" ]; then
+  echo "Failed: empty store returned cached MSAs"
+  exit 1
+fi
+
+echo "Testing that uploaded MSAs are not stored..."
+cp $TMP_DIR/run1.json $TMP_DIR/uploaded.json
+mkdir -p $TMP_DIR/uploaded
+cp -R test-data/multimer_output/msas $TMP_DIR/uploaded/msas
+python scripts/msa_store.py seed $TMP_DIR/uploaded.json $TMP_DIR/uploaded
+python scripts/msa_store.py put $TMP_DIR/uploaded.json $TMP_DIR/uploaded
+if [ -n "$(find $STORE -name entry.json)" ]; then
+  echo "Failed: uploaded MSAs were stored"
+  exit 1
+fi
+
+echo "Testing storing MSAs from a completed run..."
+mkdir -p $TMP_DIR/run1
+python scripts/msa_store.py seed $TMP_DIR/run1.json $TMP_DIR/run1
+cp -R test-data/multimer_output/msas $TMP_DIR/run1/msas
+python scripts/msa_store.py put $TMP_DIR/run1.json $TMP_DIR/run1
+
+echo "Testing lookup and seeding of stored MSAs..."
+validate $TMP_DIR/run2.json
+if [ "$(count_cached $TMP_DIR/run2.json)" != "2" ]; then
+  echo "Failed: stored MSAs were not found"
+  exit 1
+fi
+python scripts/msa_store.py seed $TMP_DIR/run2.json $TMP_DIR/run2
+for chain in A B; do
+  if ! diff -r test-data/multimer_output/msas/$chain $TMP_DIR/run2/msas/$chain; then
+    echo "Failed: seeded MSAs for chain $chain differ from the originals"
+    exit 1
+  fi
+done
+
+echo "Testing eviction..."
+python scripts/msa_store.py evict $STORE --max-entries 1
+if [ "$(find $STORE -name entry.json | wc -l)" != "1" ]; then
+  echo "Failed: store was not evicted to one entry"
+  exit 1
+fi
+
+echo "Tests passed"
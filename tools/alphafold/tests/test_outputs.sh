@@ -1,7 +1,7 @@
 #!/usr/bin/env bash
 
-# You will probably need to create a venv and 'pip install -r alphafold/requirements.txt'
-# for the script to be able to read the pickle outputs as they contain jax objects.
+# The pickle outputs contain jax objects, but outputs.py unpickles them as plain
+# numpy arrays, so only numpy and matplotlib are required to run these tests.
 
 set -e
 
@@ -65,16 +65,30 @@ test-data/multimer_output/extra/ranked_3.png
 test-data/multimer_output/extra/ranked_4.png
 test-data/multimer_output/extra/msa_coverage.png"
 
-if [[ `pip freeze | grep jax` = '' ]]; then
-  echo "JAX is required to open AF2 pkl files. Please see ./scripts/pip_install_jax.sh to install."
-  exit 1
-fi
-
 # Check PWD
 if [[ "$PWD" == *"/tests" ]]; then
   cd ..
 fi
 
+TMP_DIR=$(mktemp -d)
+trap 'rm -rf "$TMP_DIR"' EXIT
+
+fail() {
+  printf "${KRED}FAIL: $1${KNRM}\n"
+  exit 1
+}
+
+# Copy test data (default: monomer_ptm) to an AlphaFold job layout, with the
+# input FASTA two levels up, under $TMP_DIR/$1 and print the output directory
+job_workdir() {
+  local workdir=$TMP_DIR/$1/output/alphafold
+  mkdir -p $TMP_DIR/$1/output
+  cp -R test-data/${2:-monomer_ptm}_output $workdir
+  rm -rf $workdir/extra
+  cp test-data/${3:-test1.fasta} $TMP_DIR/$1/alphafold.fasta
+  echo $workdir
+}
+
 printf "${KYEL}TEST monomer output${KNRM}\n"
 python scripts/outputs.py test-data/monomer_output --confidence-scores --pkl --plot --plot-msa
 
@@ -104,6 +118,344 @@ for path in $EXPECT_OUTPUTS; do
   fi
 done
 
+echo ""
+printf "${KYEL}TEST PAE export formats${KNRM}\n"
+WORKDIR=$(job_workdir pae_formats)
+python scripts/outputs.py $WORKDIR --pae --pae-format csv npy npz float16 uint8
+python - $WORKDIR/extra <<'EOF' || fail "PAE export formats do not match CSV"
+import sys
+import numpy as np
+extra = sys.argv[1]
+for rank in range(5):
+    pae = np.loadtxt(
+        f'{extra}/pae_ranked_{rank}.csv', delimiter=',', dtype=np.float32)
+    assert np.array_equal(np.load(f'{extra}/pae_ranked_{rank}.npy'), pae)
+    with np.load(f'{extra}/pae_ranked_{rank}.npz') as npz:
+        assert np.array_equal(npz['pae'], pae)
+    f16 = np.load(f'{extra}/pae_ranked_{rank}.f16.npy')
+    assert f16.dtype == np.float16
+    assert np.allclose(f16, pae, rtol=1e-3, atol=0)
+    with np.load(f'{extra}/pae_ranked_{rank}.u8.npz') as u8:
+        assert u8['pae'].dtype == np.uint8
+        scale = float(u8['scale'])
+        assert np.abs(u8['pae'] * scale - pae).max() <= scale / 2 + 1e-6
+EOF
+
+echo ""
+printf "${KYEL}TEST --pae-precision table and fallback CSVs are identical${KNRM}\n"
+python - $TMP_DIR <<'EOF' || fail "PAE CSV lookup table and fallback differ"
+import sys
+import numpy as np
+sys.path.insert(0, 'scripts')
+import outputs
+tmp_dir = sys.argv[1]
+rng = np.random.default_rng(0)
+# Include values on and either side of rounding ties
+ties = np.array([0.125, 0.15, 0.25, 0.35, 0.5, 1.5, 2.5, 2.675, 30.0])
+for dtype in (np.float32, np.float64):
+    pae = np.concatenate([
+        rng.uniform(0, 31.75, 1000 - ties.size), ties]).reshape(40, 25)
+    pae = pae.astype(dtype)
+    for precision in range(4):
+        table_path = f'{tmp_dir}/pae_table.csv'
+        fallback_path = f'{tmp_dir}/pae_fallback.csv'
+        outputs.PAE_CSV_MAX_TABLE_SIZE = 10 ** 7
+        outputs.write_pae_csv(pae, table_path, precision=precision)
+        outputs.PAE_CSV_MAX_TABLE_SIZE = 0
+        outputs.write_pae_csv(pae, fallback_path, precision=precision)
+        with open(table_path) as f, open(fallback_path) as g:
+            assert f.read() == g.read(), (dtype, precision)
+EOF
+
+echo ""
+printf "${KYEL}TEST --workers 1 and --workers 4 outputs are identical${KNRM}\n"
+for workers in 1 4; do
+  WORKDIR=$(job_workdir workers_$workers)
+  python scripts/outputs.py $WORKDIR --workers $workers \
+    --confidence-scores --pkl --plot --pae --plot-msa
+done
+# Run metrics, stage state and the manifest record timings and mtimes
+diff -r \
+  -x outputs_metrics.json -x outputs_state.json -x manifest.json \
+  $TMP_DIR/workers_1/output/alphafold/extra \
+  $TMP_DIR/workers_4/output/alphafold/extra \
+  || fail "outputs differ between --workers 1 and --workers 4"
+
+echo ""
+printf "${KYEL}TEST --pkl-slim outputs reload within tolerance${KNRM}\n"
+WORKDIR=$(job_workdir pkl_slim)
+python scripts/outputs.py $WORKDIR --pkl-slim
+python - $WORKDIR <<'EOF' || fail "--pkl-slim outputs do not match model pkls"
+import json
+import sys
+import numpy as np
+sys.path.insert(0, 'scripts')
+from outputs import SLIM_MODEL_KEYS, load_pickle
+workdir = sys.argv[1]
+for rank in range(5):
+    with open(f'{workdir}/extra/ranked_{rank}.json') as f:
+        metadata = json.load(f)
+    expected = load_pickle(f"{workdir}/{metadata['source']}")
+    with np.load(f'{workdir}/extra/ranked_{rank}.npz') as slim:
+        assert set(slim) == set(SLIM_MODEL_KEYS) & set(expected)
+        for key in slim:
+            error = np.abs(
+                slim[key].astype(np.float64) - expected[key]).max()
+            assert error <= (SLIM_MODEL_KEYS[key] or 0.0), key
+EOF
+
+echo ""
+printf "${KYEL}TEST --pkl manifest records the link strategy used${KNRM}\n"
+for link in auto copy; do
+  WORKDIR=$(job_workdir pkl_$link)
+  python scripts/outputs.py $WORKDIR --pkl --pkl-link $link --workers 2
+  python - $WORKDIR $link <<'EOF' || fail "--pkl-link $link manifest is incorrect"
+import json
+import os
+import sys
+workdir, link = sys.argv[1:]
+with open(f'{workdir}/extra/ranked_pkls.json') as f:
+    manifest = json.load(f)
+assert sorted(manifest) == [f'ranked_{rank}.pkl' for rank in range(5)]
+for name, entry in manifest.items():
+    if link != 'auto':
+        assert entry['strategy'] == link, entry
+    linked = os.path.samefile(
+        f'{workdir}/extra/{name}', f"{workdir}/{entry['source']}")
+    assert linked == (entry['strategy'] == 'hardlink'), entry
+EOF
+done
+
+echo ""
+printf "${KYEL}TEST --msa-compression archives${KNRM}\n"
+FORMATS="stored deflate"
+if python -c "import zstandard" 2> /dev/null; then
+  FORMATS="$FORMATS tar.zst"
+fi
+for fmt in $FORMATS; do
+  WORKDIR=$(job_workdir msa_$fmt)
+  python scripts/outputs.py $WORKDIR --msa \
+    --msa-compression $fmt --msa-compression-level 9
+  python - $WORKDIR $fmt <<'EOF' || fail "--msa-compression $fmt archive differs"
+import io
+import sys
+import tarfile
+import zipfile
+from pathlib import Path
+workdir, fmt = Path(sys.argv[1]), sys.argv[2]
+expected = {
+    path.name: path.read_bytes()
+    for path in (workdir / 'msas').iterdir() if path.is_file()
+}
+archive, = (workdir / 'extra/msas').iterdir()
+if fmt == 'tar.zst':
+    import zstandard
+    data = zstandard.ZstdDecompressor().stream_reader(archive.read_bytes())
+    with tarfile.open(fileobj=io.BytesIO(data.read()), mode='r:') as tar:
+        found = {m.name: tar.extractfile(m).read() for m in tar}
+else:
+    with zipfile.ZipFile(archive) as z:
+        compress_type = {
+            'stored': zipfile.ZIP_STORED,
+            'deflate': zipfile.ZIP_DEFLATED,
+        }[fmt]
+        assert all(i.compress_type == compress_type for i in z.infolist())
+        found = {name: z.read(name) for name in z.namelist()}
+assert found == expected
+EOF
+done
+
+echo ""
+printf "${KYEL}TEST --html-bundle data bundles${KNRM}\n"
+WORKDIR=$(job_workdir html_bundle)
+python scripts/outputs.py $WORKDIR --html-bundle
+python - $WORKDIR <<'EOF' || fail "--html-bundle data does not match model pkls"
+import json
+import struct
+import sys
+import numpy as np
+sys.path.insert(0, 'scripts')
+from outputs import HTML_BUNDLE_MAGIC, load_pickle
+workdir = sys.argv[1]
+with open(f'{workdir}/ranking_debug.json') as f:
+    order = json.load(f)['order']
+for rank, name in enumerate(order):
+    expected = load_pickle(f'{workdir}/result_{name}.pkl')
+    with open(f'{workdir}/extra/html/ranked_{rank}.bin', 'rb') as f:
+        assert f.read(4) == HTML_BUNDLE_MAGIC
+        header_size, = struct.unpack('<I', f.read(4))
+        header = json.loads(f.read(header_size))
+        n = header['residues']
+        plddt = np.frombuffer(f.read(n), dtype=np.uint8)
+        pae = np.frombuffer(f.read(), dtype=np.uint8).reshape(n, n)
+    assert n == len(expected['plddt'])
+    assert np.abs(plddt - expected['plddt']).max() <= 0.5
+    # The test data fit in a single tile, so the coarse level is full size
+    scale = header['pae_scale']
+    error = np.abs(pae * scale - expected['predicted_aligned_error']).max()
+    assert error <= scale / 2 + 1e-6
+EOF
+
+echo ""
+printf "${KYEL}TEST re-runs skip unchanged stages${KNRM}\n"
+WORKDIR=$(job_workdir rerun)
+ARGS="--confidence-scores --pkl --plot --pae"
+python scripts/outputs.py $WORKDIR $ARGS
+# Not ranked_*.pkl, which may be hard links to the input pkls
+touch -d '2000-01-01' $WORKDIR/extra/*.csv $WORKDIR/extra/*.png
+python scripts/outputs.py $WORKDIR $ARGS > $TMP_DIR/rerun.log
+grep -q "Skipping unchanged stage: pae" $TMP_DIR/rerun.log \
+  || fail "unchanged stages were not skipped on re-run"
+if [ -n "$(find $WORKDIR/extra -newermt '2000-01-02' -name '*.csv')" ]; then
+  fail "outputs of skipped stages were rewritten"
+fi
+rm $WORKDIR/extra/pae_ranked_0.csv
+python scripts/outputs.py $WORKDIR $ARGS > $TMP_DIR/rerun.log
+if grep -q "Skipping unchanged stage: pae" $TMP_DIR/rerun.log \
+    || [ ! -f $WORKDIR/extra/pae_ranked_0.csv ]; then
+  fail "stage with a missing output was not re-run"
+fi
+python scripts/outputs.py $WORKDIR $ARGS --force > $TMP_DIR/rerun.log
+if grep -q "Skipping unchanged stage" $TMP_DIR/rerun.log; then
+  fail "stages were skipped with --force"
+fi
+if [ -n "$(find $WORKDIR/extra -not -newermt '2000-01-02' -name '*.png')" ]; then
+  fail "outputs were not rewritten with --force"
+fi
+
+echo ""
+printf "${KYEL}TEST batch mode with one failing workdir${KNRM}\n"
+for name in batch_ok_1 batch_failed batch_ok_2; do
+  job_workdir $name > /dev/null
+done
+echo "not json" > $TMP_DIR/batch_failed/output/alphafold/ranking_debug.json
+if python scripts/outputs.py "$TMP_DIR/batch_*/output/alphafold" --pae \
+    --workers 2 --summary $TMP_DIR/summary.tsv; then
+  fail "batch mode did not exit with an error for the failed workdir"
+fi
+for name in batch_ok_1 batch_ok_2; do
+  grep -q "$name/output/alphafold"$'\t'ok $TMP_DIR/summary.tsv \
+    || fail "workdir $name not reported ok in batch summary"
+  [ -f $TMP_DIR/$name/output/alphafold/extra/pae_ranked_4.csv ] \
+    || fail "outputs missing for workdir $name in batch mode"
+done
+grep -q "batch_failed/output/alphafold"$'\t'failed $TMP_DIR/summary.tsv \
+  || fail "failed workdir not reported in batch summary"
+
+echo ""
+printf "${KYEL}TEST --interface-scores${KNRM}\n"
+WORKDIR=$(job_workdir interface_monomer)
+python scripts/outputs.py $WORKDIR --interface-scores
+if [ -f $WORKDIR/extra/interface_scores.tsv ]; then
+  fail "interface scores written for a monomer_ptm run"
+fi
+python - <<'EOF' || fail "chain_pair_scores does not match a direct calculation"
+import sys
+import numpy as np
+sys.path.insert(0, 'scripts')
+import outputs
+assert [outputs.multimer_chain_id(i) for i in (0, 25, 26, 27, 701, 702)] \
+    == ['A', 'Z', 'AA', 'BA', 'ZZ', 'AAA']
+# Read the PAE matrix in several uneven blocks of rows
+outputs.INTERFACE_BLOCK_CELLS = 7 * 60
+rng = np.random.default_rng(0)
+chain_lengths = [12, 1, 20, 27]
+n = sum(chain_lengths)
+plddt = rng.uniform(20, 100, n)
+pae = rng.uniform(0, 30, (n, n)).astype(np.float32)
+coords = rng.uniform(0, 30, (n, 3))
+scores = outputs.chain_pair_scores(plddt, pae, chain_lengths, coords=coords)
+chain_of = np.repeat(np.arange(len(chain_lengths)), chain_lengths)
+distance = np.linalg.norm(coords[:, None] - coords[None], axis=-1)
+contact = (distance < outputs.INTERFACE_CONTACT_DISTANCE) & ~np.eye(n, dtype=bool)
+for i in range(len(chain_lengths)):
+    rows = chain_of == i
+    assert np.isclose(scores['plddt'][i], plddt[rows].mean())
+    for j in range(len(chain_lengths)):
+        cols = chain_of == j
+        block = pae[np.ix_(rows, cols)].astype(np.float64)
+        assert np.isclose(scores['mean_pae'][i, j], block.mean())
+        assert np.isclose(scores['min_pae'][i, j], block.min())
+        pair = contact[np.ix_(rows, cols)]
+        assert scores['contacts'][i, j] == pair.sum()
+        if not pair.any():
+            assert np.isnan(scores['contact_pae'][i, j])
+            continue
+        assert np.isclose(scores['contact_pae'][i, j], block[pair].mean())
+        iface = np.concatenate([
+            plddt[rows][pair.any(axis=1)], plddt[cols][pair.any(axis=0)]])
+        assert np.isclose(scores['contact_plddt'][i, j], iface.mean())
+EOF
+WORKDIR=$(job_workdir interface_multimer multimer multimer.fasta)
+python scripts/outputs.py $WORKDIR --interface-scores
+python - $WORKDIR <<'EOF' || fail "--interface-scores output is invalid"
+import csv
+import sys
+workdir = sys.argv[1]
+with open(f'{workdir}/extra/interface_scores.tsv') as f:
+    rows = list(csv.DictReader(f, delimiter='\t'))
+assert list(rows[0]) == [
+    'model', 'chain_1', 'chain_2', 'chain_1_plddt', 'chain_2_plddt',
+    'mean_pae', 'min_pae', 'contacts', 'contact_pae', 'contact_plddt',
+]
+# Five models, each with every ordered pair of the two chains
+assert len(rows) == 5 * 2 * 2
+for row in rows:
+    assert 0 <= float(row['min_pae']) <= float(row['mean_pae'])
+    assert 0 <= float(row['chain_1_plddt']) <= 100
+    if row['chain_1'] == row['chain_2']:
+        assert row['contacts'] == ''
+    else:
+        assert int(row['contacts']) >= 0
+EOF
+
+echo ""
+printf "${KYEL}TEST --msa-stats depth and Neff${KNRM}\n"
+WORKDIR=$(job_workdir msa_stats)
+python scripts/outputs.py $WORKDIR --msa-stats
+python - $WORKDIR <<'EOF' || fail "--msa-stats output does not match features.pkl"
+import sys
+import numpy as np
+sys.path.insert(0, 'scripts')
+from outputs import MSA_GAP, NEFF_IDENTITY, load_pickle
+workdir = sys.argv[1]
+msa = load_pickle(f'{workdir}/features.pkl')['msa']
+with open(f'{workdir}/extra/msa_depth.tsv') as f:
+    assert f.readline().split() == ['position', 'depth', 'neff_estimate']
+stats = np.loadtxt(f'{workdir}/extra/msa_depth.tsv', skiprows=1)
+# Pairwise identity over all columns, compared directly
+identity = np.array([(msa == row).mean(1) for row in msa])
+weights = 1 / (identity >= NEFF_IDENTITY).sum(1)
+non_gaps = msa != MSA_GAP
+assert np.array_equal(stats[:, 0], np.arange(1, msa.shape[1] + 1))
+assert np.array_equal(stats[:, 1], non_gaps.sum(0))
+assert np.allclose(stats[:, 2], weights @ non_gaps, atol=0.005)
+EOF
+cp $WORKDIR/extra/msa_depth.tsv $TMP_DIR/msa_depth.tsv
+python scripts/outputs.py $WORKDIR --msa-stats --msa-stats-max-sequences 100
+head -1 $WORKDIR/extra/msa_depth.tsv | grep -q "^# Neff estimated from 100 of" \
+  || fail "subsampled Neff not noted in msa_depth.tsv"
+if ! diff <(tail -n +2 $WORKDIR/extra/msa_depth.tsv | cut -f 1,2) \
+    <(cut -f 1,2 $TMP_DIR/msa_depth.tsv) > /dev/null; then
+  fail "MSA depth changed when Neff was subsampled"
+fi
+
+echo ""
+printf "${KYEL}TEST metrics are written when a stage fails${KNRM}\n"
+WORKDIR=$(job_workdir metrics_failed)
+echo "not a pickle" > $WORKDIR/features.pkl
+if python scripts/outputs.py $WORKDIR --pae --msa-stats; then
+  fail "outputs.py did not fail with a corrupt features.pkl"
+fi
+python - $WORKDIR <<'EOF' || fail "metrics of completed stages were not written"
+import json
+import sys
+with open(f'{sys.argv[1]}/extra/outputs_metrics.json') as f:
+    report = json.load(f)
+assert report['status'] == 'failed'
+assert 'pae' in [m['stage'] for m in report['stages']]
+EOF
+
 if [[ "$@" != *"--keep"* ]]; then
   echo ""
   printf "${KGRN}Removing output data...\n"
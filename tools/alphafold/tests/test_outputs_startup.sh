@@ -0,0 +1,40 @@
+#!/usr/bin/env bash
+
+# Check that outputs.py --msa_only does not import matplotlib or numpy.
+# These imports are slow on network filesystems and are only needed by the
+# stages that read model pickles or draw plots.
+
+set -e
+
+# Check PWD
+if [[ "$PWD" == *"/tests" ]]; then
+  cd ..
+fi
+
+TMP_DIR=$(mktemp -d)
+trap 'rm -rf "$TMP_DIR"' EXIT
+
+# outputs.py expects the input FASTA two levels above the output directory
+WORKDIR=$TMP_DIR/output/alphafold
+mkdir -p $WORKDIR
+cp -R test-data/multimer_output/msas $WORKDIR/msas
+cp test-data/multimer.fasta $TMP_DIR/alphafold.fasta
+
+echo "Testing --msa_only imports..."
+python -X importtime scripts/outputs.py $WORKDIR --msa_only \
+    > $TMP_DIR/stdout \
+    2> $TMP_DIR/importtime
+
+for module in matplotlib numpy; do
+  if grep -qE "\| +$module(\.|$)" $TMP_DIR/importtime; then
+    echo "Failed: $module was imported on the --msa_only path"
+    exit 1
+  fi
+done
+
+if [ ! -f $WORKDIR/extra/msas/MSA-A-NP_000549.1.zip ]; then
+  echo "Failed: MSA archive not created"
+  exit 1
+fi
+
+echo "Tests passed"
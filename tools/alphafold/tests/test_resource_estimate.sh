@@ -0,0 +1,85 @@
+#!/usr/bin/env bash
+
+# Check that resource_estimate.py refit recovers the coefficients of job
+# metrics generated from a known model table, and keeps the previous
+# coefficients of quantities with too few rows to fit.
+
+set -e
+
+# Check PWD
+if [[ "$PWD" == *"/tests" ]]; then
+  cd ..
+fi
+
+TMP_DIR=$(mktemp -d)
+trap 'rm -rf "$TMP_DIR"' EXIT
+
+echo "Writing job metrics..."
+python - $TMP_DIR/metrics.tsv <<'EOF'
+import csv
+import sys
+fields = [
+    'model_preset', 'db_preset', 'tokens', 'unique_chains',
+    'unique_residues', 'peak_gpu_memory_gb', 'peak_host_memory_gb',
+    'msa_search_minutes',
+]
+rows = []
+# Monomer jobs on the reduced databases, without noise
+for tokens in range(100, 2100, 200):
+    rows.append({
+        'model_preset': 'monomer',
+        'db_preset': 'reduced',
+        'tokens': tokens,
+        'unique_chains': 1,
+        'unique_residues': tokens,
+        'peak_gpu_memory_gb': 1.5 + 0.001 * tokens + 3e-6 * tokens ** 2,
+        'peak_host_memory_gb': 4.0 + 0.005 * tokens,
+        'msa_search_minutes': 10.0 + 0.01 * tokens,
+    })
+# A single multimer job is too few to fit any quantity
+rows.append({
+    'model_preset': 'multimer',
+    'db_preset': 'full',
+    'tokens': 800,
+    'unique_chains': 2,
+    'unique_residues': 800,
+    'peak_gpu_memory_gb': 10.0,
+    'peak_host_memory_gb': 20.0,
+    'msa_search_minutes': '',
+})
+with open(sys.argv[1], 'w', newline='') as f:
+    writer = csv.DictWriter(f, fields, delimiter='\t')
+    writer.writeheader()
+    writer.writerows(rows)
+EOF
+
+echo "Testing refit..."
+python scripts/resource_estimate.py refit $TMP_DIR/metrics.tsv \
+    --gpu-memory-gb 80 \
+    -o $TMP_DIR/model.json
+
+if ! python - $TMP_DIR/model.json <<'EOF'
+import json
+import sys
+import numpy as np
+sys.path.insert(0, 'scripts')
+from resource_estimate import DEFAULT_MODEL
+with open(sys.argv[1]) as f:
+    model = json.load(f)
+assert model['gpu_memory_gb'] == 80
+monomer = model['models']['monomer']
+assert np.allclose(monomer['peak_gpu_memory_gb'], [1.5, 0.001, 3e-6])
+assert np.allclose(monomer['peak_host_memory_gb'], [4.0, 0.005])
+assert np.allclose(monomer['msa_search_minutes']['reduced'], [10.0, 0.01])
+# Too few rows (none, or the one multimer job) to refit these
+default = DEFAULT_MODEL['models']
+assert monomer['msa_search_minutes']['full'] \
+    == default['monomer']['msa_search_minutes']['full']
+assert model['models']['multimer'] == default['multimer']
+EOF
+then
+  echo "Failed: refitted coefficients do not match the job metrics"
+  exit 1
+fi
+
+echo "Tests passed"
@@ -59,4 +59,96 @@ if [ $? -ne $EXPECT_EXIT_CODE ]; then
     exit 1
 fi
 
+echo "Testing validation of pasted (escaped) content..."
+EXPECT_EXIT_CODE=0
+printf '__gt__seq_a__cn__MKVLAAGIV__cn____gt__seq_b__cn__MKTAYIAK__cn__' \
+    > /tmp/test-validate-fasta-5.input
+python scripts/validate_fasta.py        \
+    /tmp/test-validate-fasta-5.input    \
+    --min_length 1                      \
+    --max_length 1000                   \
+    --multimer                          \
+    > /tmp/test-validate-fasta-5.fasta  \
+    2> /tmp/test-validate-fasta-5.stderr
+
+if [ $? -ne $EXPECT_EXIT_CODE ]; then
+    echo "Failed test 5"
+    exit 1
+fi
+
+if ! grep -q "^>seq_b$" /tmp/test-validate-fasta-5.fasta; then
+    echo "Failed test 5: escaped header not restored"
+    exit 1
+fi
+
+echo "Testing multimer validation reports errors in every sequence..."
+EXPECT_EXIT_CODE=1
+printf '>seq_a\nMKVLAAGIV\n>seq_b\nMKT1YIAK\n>seq_c\nMKTAY*AK\n' \
+    > /tmp/test-validate-fasta-6.input
+python scripts/validate_fasta.py        \
+    /tmp/test-validate-fasta-6.input    \
+    --min_length 1                      \
+    --max_length 1000                   \
+    --multimer                          \
+    > /tmp/test-validate-fasta-6.fasta  \
+    2> /tmp/test-validate-fasta-6.stderr
+
+if [ $? -ne $EXPECT_EXIT_CODE ]; then
+    echo "Failed test 6"
+    exit 1
+fi
+
+for error in '>seq_b: Invalid amino acid found at pos 3: "1"' \
+             '>seq_c: Invalid amino acid found at pos 5: "\*"'; do
+    if ! grep -q "$error" /tmp/test-validate-fasta-6.stderr; then
+        echo "Failed test 6: missing error $error"
+        exit 1
+    fi
+done
+
+echo "Testing resource estimate..."
+EXPECT_EXIT_CODE=0
+python scripts/validate_fasta.py        \
+    test-data/multimer.fasta            \
+    --multimer                          \
+    --resource-estimate /tmp/test-validate-fasta-7.json \
+    > /tmp/test-validate-fasta-7.fasta  \
+    2> /tmp/test-validate-fasta-7.stderr
+
+if [ $? -ne $EXPECT_EXIT_CODE ]; then
+    echo "Failed test 7"
+    exit 1
+fi
+
+if ! grep -q '"tokens": 289' /tmp/test-validate-fasta-7.json; then
+    echo "Failed test 7: unexpected token count in resource estimate"
+    exit 1
+fi
+
+echo "Testing batch monomer mode..."
+EXPECT_EXIT_CODE=0
+rm -rf /tmp/test-validate-fasta-8
+python scripts/validate_fasta.py        \
+    test-data/multimer-3n.fasta         \
+    --batch                             \
+    --batch-max-residues 300            \
+    --batch-dir /tmp/test-validate-fasta-8 \
+    > /tmp/test-validate-fasta-8.fasta  \
+    2> /tmp/test-validate-fasta-8.stderr
+
+if [ $? -ne $EXPECT_EXIT_CODE ]; then
+    echo "Failed test 8"
+    exit 1
+fi
+
+if [ ! -f /tmp/test-validate-fasta-8/batches.json ]; then
+    echo "Failed test 8: batch manifest not created"
+    exit 1
+fi
+
+if [ $(ls /tmp/test-validate-fasta-8/batch_*/*.fasta | wc -l) -eq 0 ]; then
+    echo "Failed test 8: no batch FASTA files created"
+    exit 1
+fi
+
 echo "Tests passed"